@@ -2,43 +2,49 @@
 Serviço GraphQL implementado com Graphene e FastAPI.
 Executar com: python -m graphql_py.main
 """
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, Response
+import asyncio
+import contextvars
+import functools
+import hashlib
+import json
+import math
+import threading
+import time
 import uuid
 import sys
 import os
-from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Callable, Iterable, Optional
 
 # Configura o diretório raiz do projeto
 root_dir = os.path.dirname(os.path.dirname(__file__))
 
 import graphene  # type: ignore
+from graphql import (
+    DocumentNode, ExecutionResult, FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError,
+    GraphQLList, OperationDefinitionNode, OperationType, SelectionSetNode, create_source_event_stream,
+    execute_sync, get_named_type, get_nullable_type, get_operation_ast, parse, print_ast, validate,
+)
 
 # Reinsere o diretório raiz para importar módulos locais
 sys.path.insert(0, root_dir)
 
-from shared.database import get_db, init_db
+from shared.database import init_db, sessao_para, CLASSES_OPERACAO, limite_conexoes
+from sqlalchemy import text
 from shared.repository import Repositorio
 from shared.models import Usuario, Musica, Playlist
+from shared.bulkhead import metricas_bulkheads, vaga
+from shared.group_commit import coalescedor_escrita
+from shared.singleflight import leituras_compartilhadas
 
 # Inicializa o banco de dados
 init_db()
 
 
-@contextmanager
-def repo_context():
-    """Retorna o repositório garantindo o fechamento da sessão."""
-    db_gen = get_db()
-    db = next(db_gen)
-    try:
-        yield Repositorio(db)
-    finally:
-        try:
-            db_gen.close()
-        except Exception:
-            pass
-
-
 def to_usuario(usuario: Usuario):
     if not usuario:
         return None
@@ -62,6 +68,416 @@ def to_playlist(playlist: Playlist):
     )
 
 
+# ========== DATALOADERS ==========
+
+class Carregador:
+    """
+    DataLoader síncrono, válido por uma operação. Os objetos pais de uma lista
+    são enfileirados quando a lista é resolvida, se a seleção deles pede a
+    relação; o primeiro load de um deles busca de uma vez as chaves de todos os
+    pendentes (uma consulta com IN) e os demais saem do cache. Assim cada nível
+    da query custa uma ida ao banco por relação, e não uma por objeto.
+
+    Cada pai entra na fila com as seleções da relação no ponto da query de onde
+    ele veio; os objetos carregados para ele são registrados com elas, o que
+    enfileira o próximo nível só onde ele foi pedido.
+    """
+
+    def __init__(self, buscar: Callable[[list], dict], chaves_do_pai: Callable[[object], Iterable], padrao=None,
+                 registrar: Callable[[list, tuple], object] = None):
+        # buscar(chaves) -> {chave: valor}; chaves ausentes recebem `padrao`
+        self._buscar = buscar
+        self._chaves_do_pai = chaves_do_pai
+        self._padrao = padrao
+        # registrar(objetos, seleções): enfileira os objetos carregados nas relações seguintes
+        self._registrar = registrar
+        self._cache = {}
+        self._pais_pendentes = []
+
+    def enfileirar(self, pais: list, selecoes: tuple = ()):
+        self._pais_pendentes.extend((pai, selecoes) for pai in pais)
+
+    def carregar(self, chave, selecoes: tuple = ()):
+        if chave not in self._cache:
+            self._despachar([chave])
+        valor = self._cache[chave]
+        self._registrar_valores([valor], selecoes)
+        return valor
+
+    def carregar_muitos(self, chaves: list, selecoes: tuple = ()) -> list:
+        faltando = [chave for chave in chaves if chave not in self._cache]
+        if faltando:
+            self._despachar(faltando)
+        valores = [self._cache[chave] for chave in chaves]
+        self._registrar_valores(valores, selecoes)
+        return valores
+
+    def preencher(self, valores: dict):
+        """Coloca no cache valores já lidos (sem substituir os existentes)"""
+        for chave, valor in valores.items():
+            self._cache.setdefault(chave, valor)
+
+    def limpar(self):
+        self._cache.clear()
+        self._pais_pendentes.clear()
+
+    def _despachar(self, chaves: list):
+        pais = self._pais_pendentes
+        self._pais_pendentes = []
+        pendentes = list(chaves)
+        for pai, _ in pais:
+            pendentes.extend(self._chaves_do_pai(pai))
+        novas = [chave for chave in dict.fromkeys(pendentes) if chave not in self._cache]
+        if novas:
+            resultados = self._buscar(novas)
+            for chave in novas:
+                self._cache[chave] = resultados.get(chave, self._padrao)
+        for pai, selecoes in pais:
+            self._registrar_valores([self._cache[chave] for chave in self._chaves_do_pai(pai)], selecoes)
+
+    def _registrar_valores(self, valores: list, selecoes: tuple):
+        if self._registrar is None:
+            return
+        objetos = []
+        for valor in valores:
+            if isinstance(valor, list):
+                objetos.extend(valor)
+            elif valor is not None:
+                objetos.append(valor)
+        self._registrar(objetos, selecoes)
+
+
+class Carregadores:
+    """DataLoaders das relações entre os tipos do schema"""
+
+    def __init__(self, contexto: 'ContextoExecucao'):
+        self._contexto = contexto
+        registrar = self.registrar
+        self.usuarios = Carregador(self._buscar_usuarios, lambda playlist: (playlist.usuario_id,), None, registrar)
+        self.musicas = Carregador(self._buscar_musicas, lambda playlist: playlist.musicas_ids or (), None, registrar)
+        self.playlists_por_usuario = Carregador(
+            self._buscar_playlists_por_usuario, lambda usuario: (usuario.id,), (), registrar
+        )
+        self.playlists_por_musica = Carregador(
+            self._buscar_playlists_por_musica, lambda musica: (musica.id,), (), registrar
+        )
+        # Carregador de cada campo de relação, por tipo do pai
+        self._por_tipo = {
+            PlaylistType: {'usuario': self.usuarios, 'musicas': self.musicas},
+            UsuarioType: {'playlists': self.playlists_por_usuario},
+            MusicaType: {'playlists': self.playlists_por_musica},
+        }
+        # Carregadores por id, que aproveitam os objetos lidos por outras seleções
+        self._por_id = {UsuarioType: self.usuarios, MusicaType: self.musicas}
+
+    def registrar(self, objetos: list, selecoes: tuple = ()) -> list:
+        """
+        Enfileira os objetos (de um mesmo tipo) nos carregadores das relações que
+        as seleções deles pedem (selection sets do campo que os retornou)
+        """
+        if objetos:
+            tipo = type(objetos[0])
+            relacoes = self._por_tipo.get(tipo, {})
+            if relacoes and selecoes:
+                tipo_graphql = schema.graphql_schema.get_type(tipo._meta.name)
+                fragmentos = self._contexto.fragmentos()
+                for selecao in selecoes:
+                    for no, _ in campos_selecionados(selecao, tipo_graphql, fragmentos):
+                        carregador = relacoes.get(no.name.value)
+                        if carregador is not None:
+                            sub_selecoes = (no.selection_set,) if no.selection_set else ()
+                            carregador.enfileirar(objetos, sub_selecoes)
+            por_id = self._por_id.get(tipo)
+            if por_id is not None:
+                por_id.preencher({objeto.id: objeto for objeto in objetos})
+        return objetos
+
+    def limpar(self):
+        for carregador in (self.usuarios, self.musicas, self.playlists_por_usuario, self.playlists_por_musica):
+            carregador.limpar()
+
+    def _buscar_usuarios(self, ids: list) -> dict:
+        repo = self._contexto.repositorio()
+        linhas = repo.listar_linhas_por('usuarios', 'id', ids, self._contexto.campos(UsuarioType))
+        return {linha['id']: UsuarioType(**linha) for linha in linhas}
+
+    def _buscar_musicas(self, ids: list) -> dict:
+        repo = self._contexto.repositorio()
+        linhas = repo.listar_linhas_por('musicas', 'id', ids, self._contexto.campos(MusicaType))
+        return {linha['id']: MusicaType(**linha) for linha in linhas}
+
+    def _buscar_playlists_por_usuario(self, usuarios_ids: list) -> dict:
+        repo = self._contexto.repositorio()
+        campos = self._contexto.campos(PlaylistType, 'usuario_id')
+        por_usuario = {}
+        for linha in repo.listar_linhas_por('playlists', 'usuario_id', usuarios_ids, campos):
+            playlist = PlaylistType(**linha)
+            por_usuario.setdefault(playlist.usuario_id, []).append(playlist)
+        return por_usuario
+
+    def _buscar_playlists_por_musica(self, musicas_ids: list) -> dict:
+        repo = self._contexto.repositorio()
+        pares = repo.listar_playlists_por_musicas(musicas_ids, self._contexto.campos(PlaylistType))
+        # Uma playlist com várias das músicas vira um único objeto
+        playlists = {}
+        por_musica = {}
+        for musica_id, linha in pares:
+            if linha['id'] not in playlists:
+                playlists[linha['id']] = PlaylistType(**linha)
+            por_musica.setdefault(musica_id, []).append(playlists[linha['id']])
+        return por_musica
+
+
+# ========== PROJEÇÃO ==========
+
+# Entidade do repositório de cada tipo e os campos dela que cada campo GraphQL
+# precisa (o id é sempre lido: é a chave dos DataLoaders)
+PROJECOES = {
+    'UsuarioType': ('usuarios', {'nome': ('nome',), 'idade': ('idade',)}),
+    'MusicaType': ('musicas', {'nome': ('nome',), 'artista': ('artista',)}),
+    'PlaylistType': ('playlists', {
+        'nome': ('nome',),
+        'usuarioId': ('usuario_id',),
+        'musicasIds': ('musicas_ids',),
+        'usuario': ('usuario_id',),
+        'musicas': ('musicas_ids',),
+    }),
+}
+
+
+def campos_selecionados(selecoes, tipo, fragmentos: dict):
+    """Gera (nó, definição) dos campos de uma seleção, expandindo fragmentos; ignora introspecção"""
+    for selecao in selecoes.selections:
+        if isinstance(selecao, FieldNode):
+            nome = selecao.name.value
+            campo = tipo.fields.get(nome)
+            if not nome.startswith('__') and campo is not None:
+                yield selecao, campo
+            continue
+        if isinstance(selecao, FragmentSpreadNode):
+            fragmento = fragmentos.get(selecao.name.value)
+            if fragmento is None:
+                continue
+            condicao, sub_selecoes = fragmento.type_condition, fragmento.selection_set
+        else:
+            condicao, sub_selecoes = selecao.type_condition, selecao.selection_set
+        tipo_fragmento = schema.graphql_schema.get_type(condicao.name.value) if condicao else tipo
+        yield from campos_selecionados(sub_selecoes, tipo_fragmento, fragmentos)
+
+
+def fragmentos_do_documento(documento) -> dict:
+    return {
+        definicao.name.value: definicao
+        for definicao in documento.definitions
+        if isinstance(definicao, FragmentDefinitionNode)
+    }
+
+
+def projecao_da_operacao(operacao, fragmentos: dict) -> dict:
+    """
+    Campos do repositório a ler para cada tipo, somando todas as seleções do
+    tipo na operação (os DataLoaders compartilham os objetos entre elas)
+    """
+    selecionados = {}
+
+    def visitar(selecoes, tipo):
+        for no, campo in campos_selecionados(selecoes, tipo, fragmentos):
+            selecionados.setdefault(tipo.name, set()).add(no.name.value)
+            if no.selection_set:
+                visitar(no.selection_set, get_named_type(campo.type))
+
+    visitar(operacao.selection_set, schema.graphql_schema.get_root_type(operacao.operation))
+    projecao = {}
+    for tipo, (_, por_campo) in PROJECOES.items():
+        campos = ['id']
+        for nome in sorted(selecionados.get(tipo, ())):
+            campos.extend(por_campo.get(nome, ()))
+        projecao[tipo] = tuple(dict.fromkeys(campos))
+    return projecao
+
+
+# ========== SESSÃO POR OPERAÇÃO ==========
+
+def classe_da_operacao(info) -> str:
+    """
+    Sub-pool da sessão da operação: escrita para mutations, scan se algum
+    campo raiz da query é uma listagem e point caso contrário
+    """
+    if info.operation.operation == OperationType.MUTATION:
+        return 'write'
+    campos_raiz = info.schema.query_type.fields
+    for selecao in info.operation.selection_set.selections:
+        if not isinstance(selecao, FieldNode):
+            # Fragmentos na raiz: sem olhar dentro, assume o pior caso
+            return 'scan'
+        campo = campos_raiz.get(selecao.name.value)
+        if campo is not None and isinstance(get_nullable_type(campo.type), GraphQLList):
+            return 'scan'
+    return 'point'
+
+
+class ContextoExecucao:
+    """
+    Estado de uma operação GraphQL, disponível nos resolvers como info.context.
+    Todos os resolvers usam a mesma sessão, aberta no primeiro acesso ao banco
+    e fechada por quem executou a operação (fechar()).
+
+    Queries rodam em uma única transação REPEATABLE READ somente leitura, que
+    pertence à operação (como em /api/batch?transacao=true): todas as leituras
+    veem o mesmo snapshot, usam uma única conexão e ocupam uma única vaga no
+    bulkhead. Por isso essas leituras não passam pelo single-flight: não podem
+    receber linhas de fora do snapshot nem entregar o snapshot antigo a quem
+    chegou depois de uma escrita. Mutations continuam confirmando cada
+    alteração ao terminar.
+    """
+
+    def __init__(self, documento=None, operacao=None):
+        self.carregadores = Carregadores(self)
+        self._documento = documento
+        self._operacao = operacao
+        self._projecao = None
+        self._fragmentos = None
+        self._db = None
+        self._repo: Optional[Repositorio] = None
+        self._vaga = ExitStack()
+
+    def repositorio(self, info=None) -> Repositorio:
+        if self._repo is None:
+            classe = classe_da_operacao(info) if info is not None else 'point'
+            self._db = sessao_para(classe)
+            if classe == 'write':
+                self._repo = Repositorio(self._db)
+            else:
+                self._vaga.enter_context(vaga(classe))
+                self._db.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+                self._db.execute(text('SET TRANSACTION READ ONLY'))
+                self._repo = Repositorio(self._db, adiar_commit=True)
+        return self._repo
+
+    def fragmentos(self) -> dict:
+        if self._fragmentos is None:
+            self._fragmentos = fragmentos_do_documento(self._documento)
+        return self._fragmentos
+
+    def campos(self, tipo, *extras: str) -> tuple:
+        """Campos do repositório que a operação pede do tipo (mais `extras`)"""
+        if self._projecao is None:
+            self._projecao = projecao_da_operacao(self._operacao, self.fragmentos())
+        return tuple(dict.fromkeys(self._projecao[tipo._meta.name] + extras))
+
+    def fechar(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = self._repo = None
+        self._vaga.close()
+
+
+def carregadores(info) -> Carregadores:
+    return info.context.carregadores
+
+
+def selecoes(info) -> tuple:
+    """Selection sets do campo sendo resolvido (um por nó, com aliases repetidos)"""
+    return tuple(no.selection_set for no in info.field_nodes if no.selection_set)
+
+
+def campos(info, tipo, *extras: str) -> tuple:
+    return info.context.campos(tipo, *extras)
+
+
+def repositorio(info) -> Repositorio:
+    """Repositório da sessão da operação atual"""
+    return info.context.repositorio(info)
+
+
+def limpar_carregadores(mutate):
+    """Descarta o cache dos DataLoaders antes de uma mutação (os dados vão mudar)"""
+    @functools.wraps(mutate)
+    def executar(root, info, **kwargs):
+        carregadores(info).limpar()
+        return mutate(root, info, **kwargs)
+    return executar
+
+
+# ========== EVENTOS ==========
+
+# Eventos guardados por assinatura enquanto o cliente não os recebe; ao
+# encher, os mais antigos são descartados
+GRAPHQL_WS_BUFFER = int(os.getenv('GRAPHQL_WS_BUFFER', '100'))
+
+
+class Assinante:
+    """Fila limitada de eventos de uma assinatura, consumida no event loop"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, capacidade: int):
+        self.loop = loop
+        self.fila = asyncio.Queue(maxsize=capacidade)
+        self.descartados = 0
+
+    def entregar(self, evento):
+        if self.fila.full():
+            self.fila.get_nowait()
+            self.descartados += 1
+            canal_eventos.contar_descarte()
+        self.fila.put_nowait(evento)
+
+
+class CanalEventos:
+    """
+    Publica os eventos das mutations (que rodam nas threads do executor) para
+    as assinaturas abertas nos WebSockets (no event loop), por tópico
+    """
+
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self._assinantes = {}
+        self._lock = threading.Lock()
+        self._publicados = 0
+        self._descartados = 0
+
+    def publicar(self, topico: tuple, evento):
+        with self._lock:
+            assinantes = list(self._assinantes.get(topico, ()))
+            self._publicados += 1
+        for assinante in assinantes:
+            try:
+                assinante.loop.call_soon_threadsafe(assinante.entregar, evento)
+            except RuntimeError:
+                # Event loop já encerrado
+                pass
+
+    async def assinar(self, topico: tuple):
+        """Gera os eventos do tópico publicados a partir de agora"""
+        assinante = Assinante(asyncio.get_running_loop(), self.capacidade)
+        with self._lock:
+            self._assinantes.setdefault(topico, set()).add(assinante)
+        try:
+            while True:
+                yield await assinante.fila.get()
+        finally:
+            with self._lock:
+                assinantes = self._assinantes.get(topico)
+                assinantes.discard(assinante)
+                if not assinantes:
+                    del self._assinantes[topico]
+
+    def contar_descarte(self):
+        with self._lock:
+            self._descartados += 1
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "assinaturas": sum(len(a) for a in self._assinantes.values()),
+                "topicos": len(self._assinantes),
+                "publicados": self._publicados,
+                "descartados": self._descartados,
+            }
+
+
+canal_eventos = CanalEventos(GRAPHQL_WS_BUFFER)
+
+
 class UsuarioType(graphene.ObjectType):
     id = graphene.String()
     nome = graphene.String()
@@ -69,9 +485,7 @@ class UsuarioType(graphene.ObjectType):
     playlists = graphene.List(lambda: PlaylistType)
 
     def resolve_playlists(parent, info):
-        with repo_context() as repo:
-            playlists = repo.listar_playlists_por_usuario(parent.id)
-            return [to_playlist(p) for p in playlists]
+        return carregadores(info).playlists_por_usuario.carregar(parent.id, selecoes(info))
 
 
 class MusicaType(graphene.ObjectType):
@@ -81,9 +495,7 @@ class MusicaType(graphene.ObjectType):
     playlists = graphene.List(lambda: PlaylistType)
 
     def resolve_playlists(parent, info):
-        with repo_context() as repo:
-            playlists = repo.listar_playlists_por_musica(parent.id)
-            return [to_playlist(p) for p in playlists]
+        return carregadores(info).playlists_por_musica.carregar(parent.id, selecoes(info))
 
 
 class PlaylistType(graphene.ObjectType):
@@ -95,14 +507,11 @@ class PlaylistType(graphene.ObjectType):
     musicas = graphene.List(MusicaType)
 
     def resolve_usuario(parent, info):
-        with repo_context() as repo:
-            usuario = repo.obter_usuario(parent.usuario_id)
-            return to_usuario(usuario)
+        return carregadores(info).usuarios.carregar(parent.usuario_id, selecoes(info))
 
     def resolve_musicas(parent, info):
-        with repo_context() as repo:
-            musicas = repo.listar_musicas_por_playlist(parent.id)
-            return [to_musica(m) for m in musicas]
+        # Músicas removidas do catálogo não aparecem
+        return [m for m in carregadores(info).musicas.carregar_muitos(parent.musicas_ids or [], selecoes(info)) if m is not None]
 
 
 class UsuarioInput(graphene.InputObjectType):
@@ -146,41 +555,55 @@ class Query(graphene.ObjectType):
     musicas_por_playlist = graphene.List(MusicaType, playlist_id=graphene.String(required=True))
     playlists_por_musica = graphene.List(PlaylistType, musica_id=graphene.String(required=True))
 
+    # Os resolvers leem só as colunas dos campos pedidos na operação (projeção)
+    # e as relações pedidas vêm dos DataLoaders, uma consulta por nível
+
     def resolve_usuario(root, info, id):
-        with repo_context() as repo:
-            return to_usuario(repo.obter_usuario(id))
+        return obter_objeto(info, UsuarioType, id)
 
     def resolve_usuarios(root, info):
-        with repo_context() as repo:
-            return [to_usuario(u) for u in repo.listar_usuarios()]
+        return listar_objetos(info, UsuarioType)
 
     def resolve_musica(root, info, id):
-        with repo_context() as repo:
-            return to_musica(repo.obter_musica(id))
+        return obter_objeto(info, MusicaType, id)
 
     def resolve_musicas(root, info):
-        with repo_context() as repo:
-            return [to_musica(m) for m in repo.listar_musicas()]
+        return listar_objetos(info, MusicaType)
 
     def resolve_playlist(root, info, id):
-        with repo_context() as repo:
-            return to_playlist(repo.obter_playlist(id))
+        return obter_objeto(info, PlaylistType, id)
 
     def resolve_playlists(root, info):
-        with repo_context() as repo:
-            return [to_playlist(p) for p in repo.listar_playlists()]
+        return listar_objetos(info, PlaylistType)
 
     def resolve_playlists_por_usuario(root, info, usuario_id):
-        with repo_context() as repo:
-            return [to_playlist(p) for p in repo.listar_playlists_por_usuario(usuario_id)]
+        return carregadores(info).playlists_por_usuario.carregar(usuario_id, selecoes(info))
 
     def resolve_musicas_por_playlist(root, info, playlist_id):
-        with repo_context() as repo:
-            return [to_musica(m) for m in repo.listar_musicas_por_playlist(playlist_id)]
+        repo = repositorio(info)
+        playlist = repo.obter_linha('playlists', playlist_id, ('id', 'musicas_ids'))
+        if playlist is None:
+            return []
+        return [m for m in carregadores(info).musicas.carregar_muitos(playlist['musicas_ids'], selecoes(info)) if m is not None]
 
     def resolve_playlists_por_musica(root, info, musica_id):
-        with repo_context() as repo:
-            return [to_playlist(p) for p in repo.listar_playlists_por_musica(musica_id)]
+        return carregadores(info).playlists_por_musica.carregar(musica_id, selecoes(info))
+
+
+def obter_objeto(info, tipo, id: str):
+    """Um objeto do tipo por id, só com os campos pedidos"""
+    repo = repositorio(info)
+    linha = repo.obter_linha(PROJECOES[tipo._meta.name][0], id, campos(info, tipo))
+    if linha is None:
+        return None
+    return carregadores(info).registrar([tipo(**linha)], selecoes(info))[0]
+
+
+def listar_objetos(info, tipo) -> list:
+    """Todos os objetos do tipo, só com os campos pedidos, registrados nos DataLoaders"""
+    repo = repositorio(info)
+    linhas = repo.listar_linhas(PROJECOES[tipo._meta.name][0], campos(info, tipo))
+    return carregadores(info).registrar([tipo(**linha) for linha in linhas], selecoes(info))
 
 
 class CriarUsuario(graphene.Mutation):
@@ -189,11 +612,12 @@ class CriarUsuario(graphene.Mutation):
 
     usuario = graphene.Field(UsuarioType)
 
+    @limpar_carregadores
     def mutate(root, info, input):
-        with repo_context() as repo:
-            usuario = Usuario(id=str(uuid.uuid4()), nome=input.nome, idade=input.idade)
-            criado = repo.criar_usuario(usuario)
-            return CriarUsuario(usuario=to_usuario(criado))
+        repo = repositorio(info)
+        usuario = Usuario(id=str(uuid.uuid4()), nome=input.nome, idade=input.idade)
+        criado = repo.criar_usuario(usuario)
+        return CriarUsuario(usuario=to_usuario(criado))
 
 
 class AtualizarUsuario(graphene.Mutation):
@@ -203,11 +627,12 @@ class AtualizarUsuario(graphene.Mutation):
 
     usuario = graphene.Field(UsuarioType)
 
+    @limpar_carregadores
     def mutate(root, info, id, input):
         dados = {k: v for k, v in input.items() if v is not None}
-        with repo_context() as repo:
-            atualizado = repo.atualizar_usuario(id, dados)
-            return AtualizarUsuario(usuario=to_usuario(atualizado))
+        repo = repositorio(info)
+        atualizado = repo.atualizar_usuario(id, dados)
+        return AtualizarUsuario(usuario=to_usuario(atualizado))
 
 
 class RemoverUsuario(graphene.Mutation):
@@ -216,11 +641,12 @@ class RemoverUsuario(graphene.Mutation):
 
     mensagem = graphene.String()
 
+    @limpar_carregadores
     def mutate(root, info, id):
-        with repo_context() as repo:
-            if repo.remover_usuario(id):
-                return RemoverUsuario(mensagem="Usuário removido com sucesso")
-            return RemoverUsuario(mensagem="Usuário não encontrado")
+        repo = repositorio(info)
+        if repo.remover_usuario(id):
+            return RemoverUsuario(mensagem="Usuário removido com sucesso")
+        return RemoverUsuario(mensagem="Usuário não encontrado")
 
 
 class CriarMusica(graphene.Mutation):
@@ -229,11 +655,13 @@ class CriarMusica(graphene.Mutation):
 
     musica = graphene.Field(MusicaType)
 
+    @limpar_carregadores
     def mutate(root, info, input):
-        with repo_context() as repo:
-            musica = Musica(id=str(uuid.uuid4()), nome=input.nome, artista=input.artista)
-            criada = repo.criar_musica(musica)
-            return CriarMusica(musica=to_musica(criada))
+        repo = repositorio(info)
+        musica = Musica(id=str(uuid.uuid4()), nome=input.nome, artista=input.artista)
+        criada = to_musica(repo.criar_musica(musica))
+        canal_eventos.publicar(('musicaCriada',), criada)
+        return CriarMusica(musica=criada)
 
 
 class AtualizarMusica(graphene.Mutation):
@@ -243,11 +671,12 @@ class AtualizarMusica(graphene.Mutation):
 
     musica = graphene.Field(MusicaType)
 
+    @limpar_carregadores
     def mutate(root, info, id, input):
         dados = {k: v for k, v in input.items() if v is not None}
-        with repo_context() as repo:
-            atualizada = repo.atualizar_musica(id, dados)
-            return AtualizarMusica(musica=to_musica(atualizada))
+        repo = repositorio(info)
+        atualizada = repo.atualizar_musica(id, dados)
+        return AtualizarMusica(musica=to_musica(atualizada))
 
 
 class RemoverMusica(graphene.Mutation):
@@ -256,11 +685,12 @@ class RemoverMusica(graphene.Mutation):
 
     mensagem = graphene.String()
 
+    @limpar_carregadores
     def mutate(root, info, id):
-        with repo_context() as repo:
-            if repo.remover_musica(id):
-                return RemoverMusica(mensagem="Música removida com sucesso")
-            return RemoverMusica(mensagem="Música não encontrada")
+        repo = repositorio(info)
+        if repo.remover_musica(id):
+            return RemoverMusica(mensagem="Música removida com sucesso")
+        return RemoverMusica(mensagem="Música não encontrada")
 
 
 class CriarPlaylist(graphene.Mutation):
@@ -269,16 +699,17 @@ class CriarPlaylist(graphene.Mutation):
 
     playlist = graphene.Field(PlaylistType)
 
+    @limpar_carregadores
     def mutate(root, info, input):
-        with repo_context() as repo:
-            playlist = Playlist(
-                id=str(uuid.uuid4()),
-                nome=input.nome,
-                usuario_id=input.usuario_id,
-                musicas_ids=[]
-            )
-            criada = repo.criar_playlist(playlist)
-            return CriarPlaylist(playlist=to_playlist(criada))
+        repo = repositorio(info)
+        playlist = Playlist(
+            id=str(uuid.uuid4()),
+            nome=input.nome,
+            usuario_id=input.usuario_id,
+            musicas_ids=[]
+        )
+        criada = repo.criar_playlist(playlist)
+        return CriarPlaylist(playlist=to_playlist(criada))
 
 
 class AtualizarPlaylist(graphene.Mutation):
@@ -288,15 +719,18 @@ class AtualizarPlaylist(graphene.Mutation):
 
     playlist = graphene.Field(PlaylistType)
 
+    @limpar_carregadores
     def mutate(root, info, id, input):
         dados = {}
         if input.nome is not None:
             dados["nome"] = input.nome
         if input.usuario_id is not None:
             dados["usuario_id"] = input.usuario_id
-        with repo_context() as repo:
-            atualizada = repo.atualizar_playlist(id, dados)
-            return AtualizarPlaylist(playlist=to_playlist(atualizada))
+        repo = repositorio(info)
+        atualizada = to_playlist(repo.atualizar_playlist(id, dados))
+        if atualizada is not None:
+            canal_eventos.publicar(('playlistAtualizada', id), atualizada)
+        return AtualizarPlaylist(playlist=atualizada)
 
 
 class AdicionarMusicaAPlaylist(graphene.Mutation):
@@ -306,13 +740,16 @@ class AdicionarMusicaAPlaylist(graphene.Mutation):
 
     playlist = graphene.Field(PlaylistType)
 
+    @limpar_carregadores
     def mutate(root, info, playlist_id, musica_id):
-        with repo_context() as repo:
-            try:
-                playlist = repo.adicionar_musica_a_playlist(playlist_id, musica_id)
-                return AdicionarMusicaAPlaylist(playlist=to_playlist(playlist))
-            except ValueError as exc:
-                raise Exception(str(exc))
+        repo = repositorio(info)
+        try:
+            playlist = to_playlist(repo.adicionar_musica_a_playlist(playlist_id, musica_id))
+        except ValueError as exc:
+            raise Exception(str(exc))
+        if playlist is not None:
+            canal_eventos.publicar(('playlistAtualizada', playlist_id), playlist)
+        return AdicionarMusicaAPlaylist(playlist=playlist)
 
 
 class RemoverMusicaDePlaylist(graphene.Mutation):
@@ -322,10 +759,13 @@ class RemoverMusicaDePlaylist(graphene.Mutation):
 
     playlist = graphene.Field(PlaylistType)
 
+    @limpar_carregadores
     def mutate(root, info, playlist_id, musica_id):
-        with repo_context() as repo:
-            playlist = repo.remover_musica_de_playlist(playlist_id, musica_id)
-            return RemoverMusicaDePlaylist(playlist=to_playlist(playlist))
+        repo = repositorio(info)
+        playlist = to_playlist(repo.remover_musica_de_playlist(playlist_id, musica_id))
+        if playlist is not None:
+            canal_eventos.publicar(('playlistAtualizada', playlist_id), playlist)
+        return RemoverMusicaDePlaylist(playlist=playlist)
 
 
 class RemoverPlaylist(graphene.Mutation):
@@ -334,11 +774,14 @@ class RemoverPlaylist(graphene.Mutation):
 
     mensagem = graphene.String()
 
+    @limpar_carregadores
     def mutate(root, info, id):
-        with repo_context() as repo:
-            if repo.remover_playlist(id):
-                return RemoverPlaylist(mensagem="Playlist removida com sucesso")
-            return RemoverPlaylist(mensagem="Playlist não encontrada")
+        repo = repositorio(info)
+        if repo.remover_playlist(id):
+            # A assinatura recebe null quando a playlist deixa de existir
+            canal_eventos.publicar(('playlistAtualizada', id), None)
+            return RemoverPlaylist(mensagem="Playlist removida com sucesso")
+        return RemoverPlaylist(mensagem="Playlist não encontrada")
 
 
 class Mutation(graphene.ObjectType):
@@ -355,70 +798,1046 @@ class Mutation(graphene.ObjectType):
     remover_playlist = RemoverPlaylist.Field()
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(graphene.ObjectType):
+    # O valor de cada campo é o objeto publicado pela mutation; as relações
+    # pedidas são resolvidas a cada evento, com a sessão do evento
+    playlist_atualizada = graphene.Field(PlaylistType, id=graphene.String(required=True))
+    musica_criada = graphene.Field(MusicaType)
+
+    async def subscribe_playlist_atualizada(root, info, id):
+        async for playlist in canal_eventos.assinar(('playlistAtualizada', id)):
+            yield playlist
+
+    async def subscribe_musica_criada(root, info):
+        async for musica in canal_eventos.assinar(('musicaCriada',)):
+            yield musica
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
 
 app = FastAPI(title="Streaming de Músicas - GraphQL API", version="1.0.0")
 
 
-@app.post("/graphql")
-async def graphql_endpoint(request: Request):
-    """Endpoint GraphQL"""
-    try:
-        body = await request.json()
-        query = body.get("query")
-        variables = body.get("variables")
-        operation_name = body.get("operationName")
+# ========== EXECUÇÃO ==========
 
-        if not query:
-            return JSONResponse({"errors": [{"message": "Query não fornecida"}]}, status_code=400)
+# A execução do schema é síncrona (resolvers fazem I/O bloqueante no banco) e
+# roda em um pool limitado de threads, nunca no event loop
+GRAPHQL_TRABALHADORES = int(os.getenv(
+    'GRAPHQL_TRABALHADORES',
+    str(sum(limite_conexoes(c) for c in CLASSES_OPERACAO))
+))
+# Operações aguardando uma thread livre; acima disso a requisição é recusada com 503
+GRAPHQL_FILA_MAXIMA = int(os.getenv('GRAPHQL_FILA_MAXIMA', str(4 * GRAPHQL_TRABALHADORES)))
 
-        result = schema.execute(
-            query,
+
+class ExecutorCheio(Exception):
+    """Todas as threads ocupadas e a fila de espera cheia"""
+
+
+class ExecutorGraphQL:
+    """Pool limitado de threads para executar operações fora do event loop"""
+
+    def __init__(self, trabalhadores: int, fila_maxima: int):
+        self.trabalhadores = trabalhadores
+        self.fila_maxima = fila_maxima
+        self._pool = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix='graphql')
+        # Contadores alterados só no event loop, sem necessidade de lock
+        self._pendentes = 0
+        self._executadas = 0
+        self._rejeitadas = 0
+
+    async def executar(self, funcao, *args):
+        if self._pendentes >= self.trabalhadores + self.fila_maxima:
+            self._rejeitadas += 1
+            raise ExecutorCheio("Capacidade de execução GraphQL esgotada")
+        self._pendentes += 1
+        try:
+            contexto = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self._pool, contexto.run, functools.partial(funcao, *args))
+        finally:
+            self._pendentes -= 1
+            self._executadas += 1
+
+    def metricas(self) -> dict:
+        return {
+            "trabalhadores": self.trabalhadores,
+            "em_execucao": min(self._pendentes, self.trabalhadores),
+            "na_fila": max(0, self._pendentes - self.trabalhadores),
+            "fila_maxima": self.fila_maxima,
+            "executadas": self._executadas,
+            "rejeitadas": self._rejeitadas,
+        }
+
+
+executor_graphql = ExecutorGraphQL(GRAPHQL_TRABALHADORES, GRAPHQL_FILA_MAXIMA)
+
+
+# ========== CACHE DE DOCUMENTOS ==========
+
+# Documentos (parseados e validados) mantidos em memória
+GRAPHQL_CACHE_DOCUMENTOS = int(os.getenv('GRAPHQL_CACHE_DOCUMENTOS', '1000'))
+
+
+class CacheDocumentos:
+    """
+    LRU de documentos já parseados e validados contra o schema, pelo texto da
+    query. Queries inválidas também ficam no cache, com os seus erros. O nome
+    da operação não faz parte da chave: ele só é usado na execução.
+    """
+
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self._documentos = OrderedDict()
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._falhas = 0
+
+    def obter(self, query: str) -> tuple:
+        """
+        Retorna (documento, erros, assinatura); o documento é None se a query
+        não é válida. A assinatura é o sha256 do documento normalizado (sem
+        comentários nem diferenças de espaçamento).
+        """
+        with self._lock:
+            entrada = self._documentos.get(query)
+            if entrada is not None:
+                self._documentos.move_to_end(query)
+                self._acertos += 1
+                return entrada
+            self._falhas += 1
+        entrada = self._preparar(query)
+        if self.capacidade > 0:
+            with self._lock:
+                self._documentos[query] = entrada
+                self._documentos.move_to_end(query)
+                while len(self._documentos) > self.capacidade:
+                    self._documentos.popitem(last=False)
+        return entrada
+
+    @staticmethod
+    def _preparar(query: str) -> tuple:
+        try:
+            documento = parse(query)
+        except GraphQLError as erro:
+            return None, [erro], None
+        erros = validate(schema.graphql_schema, documento)
+        if erros:
+            return None, erros, None
+        return documento, [], hash_query(print_ast(documento))
+
+    def metricas(self) -> dict:
+        with self._lock:
+            total = self._acertos + self._falhas
+            return {
+                "tamanho": len(self._documentos),
+                "capacidade": self.capacidade,
+                "acertos": self._acertos,
+                "falhas": self._falhas,
+                "taxa_acerto": round(self._acertos / total, 4) if total else None,
+            }
+
+
+cache_documentos = CacheDocumentos(GRAPHQL_CACHE_DOCUMENTOS)
+
+
+# ========== CONSULTAS PERSISTIDAS ==========
+
+# Automatic persisted queries (protocolo do Apollo): o cliente envia só o
+# sha256 da query em extensions.persistedQuery; se o servidor não a conhece,
+# responde PersistedQueryNotFound e o cliente reenvia com o texto, que é
+# validado e registrado. Em modo allowlist só as queries do arquivo são aceitas.
+GRAPHQL_APQ = os.getenv('GRAPHQL_APQ', '1') == '1'
+GRAPHQL_APQ_ALLOWLIST = os.getenv('GRAPHQL_APQ_ALLOWLIST', '0') == '1'
+# JSON {sha256: query} carregado na inicialização (obrigatório com allowlist)
+GRAPHQL_APQ_ARQUIVO = os.getenv('GRAPHQL_APQ_ARQUIVO', '')
+GRAPHQL_APQ_CAPACIDADE = int(os.getenv('GRAPHQL_APQ_CAPACIDADE', '10000'))
+# max-age das respostas a GET por hash (0 desliga o Cache-Control)
+GRAPHQL_APQ_MAX_AGE = int(os.getenv('GRAPHQL_APQ_MAX_AGE', '60'))
+
+
+class ErroConsultaPersistida(Exception):
+    """Falha no protocolo de consultas persistidas"""
+
+    def __init__(self, mensagem: str, codigo: str, status_code: int):
+        super().__init__(mensagem)
+        self.codigo = codigo
+        self.status_code = status_code
+
+
+def hash_query(query: str) -> str:
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class ConsultasPersistidas:
+    """Queries conhecidas pelo sha256: as do arquivo e um LRU das registradas pelos clientes"""
+
+    def __init__(self, capacidade: int, allowlist: bool):
+        self.capacidade = capacidade
+        self.allowlist = allowlist
+        self._fixas = {}
+        self._registradas = OrderedDict()
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._nao_encontradas = 0
+        self._rejeitadas = 0
+
+    def carregar_arquivo(self, caminho: str):
+        """Carrega um JSON {sha256: query}; hashes errados ou queries inválidas impedem a inicialização"""
+        with open(caminho, encoding="utf-8") as arquivo:
+            consultas = json.load(arquivo)
+        for hash_informado, query in consultas.items():
+            if hash_query(query) != hash_informado.lower():
+                raise ValueError(f"{caminho}: o hash {hash_informado} não corresponde à query")
+            documento, erros, _ = cache_documentos.obter(query)
+            if documento is None:
+                raise ValueError(f"{caminho}: query {hash_informado} inválida: {erros[0].message}")
+            self._fixas[hash_informado.lower()] = query
+
+    def resolver(self, query: Optional[str], extensoes: Optional[dict]) -> tuple:
+        """
+        Retorna (query, hash a registrar depois de validada). Lança
+        ErroConsultaPersistida se o hash é desconhecido, não confere com o
+        texto ou (em allowlist) a query não está na lista.
+        """
+        persistida = (extensoes or {}).get("persistedQuery") if GRAPHQL_APQ else None
+        if not persistida:
+            if self.allowlist and query is not None and hash_query(query) not in self._fixas:
+                self._recusar()
+            return query, None
+        if persistida.get("version") != 1:
+            raise ErroConsultaPersistida("Versão de persistedQuery não suportada", "PERSISTED_QUERY_NOT_SUPPORTED", 400)
+        hash_informado = str(persistida.get("sha256Hash", "")).lower()
+        if query is None:
+            conhecida = self._buscar(hash_informado)
+            if conhecida is None:
+                if self.allowlist:
+                    self._recusar()
+                with self._lock:
+                    self._nao_encontradas += 1
+                # 200, como no protocolo: o cliente trata o erro reenviando a query
+                raise ErroConsultaPersistida("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND", 200)
+            return conhecida, None
+        if hash_query(query) != hash_informado:
+            raise ErroConsultaPersistida("O sha256Hash não corresponde à query", "PERSISTED_QUERY_HASH_MISMATCH", 400)
+        if self.allowlist:
+            if hash_informado not in self._fixas:
+                self._recusar()
+            return query, None
+        return query, hash_informado
+
+    def registrar(self, hash_informado: str, query: str):
+        """Guarda uma query já validada"""
+        with self._lock:
+            self._registradas[hash_informado] = query
+            self._registradas.move_to_end(hash_informado)
+            while len(self._registradas) > self.capacidade:
+                self._registradas.popitem(last=False)
+
+    def _buscar(self, hash_informado: str) -> Optional[str]:
+        with self._lock:
+            query = self._fixas.get(hash_informado)
+            if query is None and not self.allowlist:
+                query = self._registradas.get(hash_informado)
+                if query is not None:
+                    self._registradas.move_to_end(hash_informado)
+            if query is not None:
+                self._acertos += 1
+            return query
+
+    def _recusar(self):
+        with self._lock:
+            self._rejeitadas += 1
+        raise ErroConsultaPersistida("Query fora da allowlist", "PERSISTED_QUERY_NOT_ALLOWED", 403)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "allowlist": self.allowlist,
+                "fixas": len(self._fixas),
+                "registradas": len(self._registradas),
+                "acertos": self._acertos,
+                "nao_encontradas": self._nao_encontradas,
+                "rejeitadas": self._rejeitadas,
+            }
+
+
+consultas_persistidas = ConsultasPersistidas(GRAPHQL_APQ_CAPACIDADE, GRAPHQL_APQ_ALLOWLIST)
+if GRAPHQL_APQ_ARQUIVO:
+    consultas_persistidas.carregar_arquivo(GRAPHQL_APQ_ARQUIVO)
+elif GRAPHQL_APQ_ALLOWLIST:
+    raise RuntimeError("GRAPHQL_APQ_ALLOWLIST=1 exige GRAPHQL_APQ_ARQUIVO")
+
+
+# ========== ANÁLISE DE CUSTO ==========
+
+# Orçamento de custo estimado por operação (0 desliga)
+GRAPHQL_CUSTO_MAXIMO = int(os.getenv('GRAPHQL_CUSTO_MAXIMO', '1000000'))
+# Níveis de campos aninhados permitidos (0 desliga)
+GRAPHQL_PROFUNDIDADE_MAXIMA = int(os.getenv('GRAPHQL_PROFUNDIDADE_MAXIMA', '6'))
+# Intervalo (s) para renovar as contagens de linhas usadas nos multiplicadores
+GRAPHQL_CUSTO_ESTATISTICAS_TTL = float(os.getenv('GRAPHQL_CUSTO_ESTATISTICAS_TTL', '300'))
+# Tamanho assumido de listas sem estatística
+GRAPHQL_CUSTO_LISTA_PADRAO = int(os.getenv('GRAPHQL_CUSTO_LISTA_PADRAO', '10'))
+
+# Peso por objeto de cada campo; campos com sub-seleção pesam 1 e escalares 0.
+# Relações que passam pela tabela playlist_musica custam um join a mais.
+PESOS_CAMPOS = {
+    ('MusicaType', 'playlists'): 2,
+    ('PlaylistType', 'musicas'): 2,
+    ('Query', 'playlistsPorMusica'): 2,
+    ('Query', 'musicasPorPlaylist'): 2,
+}
+
+
+class EstatisticasTabelas:
+    """Tamanhos esperados das listas do schema, a partir das contagens de linhas das tabelas"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._tamanhos = {}
+        self._atualizado_em = None
+        self._lock = threading.Lock()
+
+    def tamanhos_listas(self) -> dict:
+        """{(tipo, campo): tamanho esperado}; renova as contagens quando passam do TTL"""
+        agora = time.monotonic()
+        if self._atualizado_em is None or agora - self._atualizado_em >= self.ttl:
+            # Só uma thread renova; as demais usam os valores anteriores
+            if self._lock.acquire(blocking=self._atualizado_em is None):
+                try:
+                    if self._atualizado_em is None or agora - self._atualizado_em >= self.ttl:
+                        self._atualizar()
+                finally:
+                    self._lock.release()
+        return self._tamanhos
+
+    def _atualizar(self):
+        db = sessao_para('point')
+        try:
+            linhas = Repositorio(db).estimar_linhas()
+        except Exception:
+            # Sem estatísticas as listas assumem GRAPHQL_CUSTO_LISTA_PADRAO; tenta de novo no próximo TTL
+            linhas = None
+        finally:
+            db.close()
+        self._atualizado_em = time.monotonic()
+        if linhas is None:
+            return
+
+        def media(total, grupos):
+            return max(1, math.ceil(total / grupos)) if grupos else 1
+
+        usuarios, musicas, playlists = linhas['usuarios'], linhas['musicas'], linhas['playlists']
+        associacoes = linhas['playlist_musica']
+        self._tamanhos = {
+            ('Query', 'usuarios'): max(1, usuarios),
+            ('Query', 'musicas'): max(1, musicas),
+            ('Query', 'playlists'): max(1, playlists),
+            ('Query', 'playlistsPorUsuario'): media(playlists, usuarios),
+            ('Query', 'musicasPorPlaylist'): media(associacoes, playlists),
+            ('Query', 'playlistsPorMusica'): media(associacoes, musicas),
+            ('UsuarioType', 'playlists'): media(playlists, usuarios),
+            ('MusicaType', 'playlists'): media(associacoes, musicas),
+            ('PlaylistType', 'musicas'): media(associacoes, playlists),
+        }
+
+
+estatisticas_tabelas = EstatisticasTabelas(GRAPHQL_CUSTO_ESTATISTICAS_TTL)
+
+
+def analisar_custo(documento, operacao) -> tuple:
+    """
+    Estima (custo, profundidade) de uma operação antes de executá-la. Cada
+    campo custa o número de objetos que deve produzir (o multiplicador dos
+    pais vezes o tamanho esperado da lista) vezes o seu peso. Fragmentos são
+    expandidos; campos de introspecção não contam.
+    """
+    fragmentos = fragmentos_do_documento(documento)
+    tamanhos = estatisticas_tabelas.tamanhos_listas()
+
+    def visitar(selecoes, tipo, multiplicador: int, nivel: int) -> tuple:
+        custo = 0
+        profundidade = nivel
+        for no, campo in campos_selecionados(selecoes, tipo, fragmentos):
+            nome = no.name.value
+            objetos = multiplicador
+            if isinstance(get_nullable_type(campo.type), GraphQLList):
+                objetos *= tamanhos.get((tipo.name, nome), GRAPHQL_CUSTO_LISTA_PADRAO)
+            custo += objetos * PESOS_CAMPOS.get((tipo.name, nome), 1 if no.selection_set else 0)
+            profundidade = max(profundidade, nivel + 1)
+            if no.selection_set:
+                custo_filhos, profundidade_filhos = visitar(no.selection_set, get_named_type(campo.type), objetos, nivel + 1)
+                custo += custo_filhos
+                profundidade = max(profundidade, profundidade_filhos)
+        return custo, profundidade
+
+    return visitar(operacao.selection_set, schema.graphql_schema.get_root_type(operacao.operation), 1, 0)
+
+
+def verificar_custo(documento, operacao) -> tuple:
+    """Retorna (extensão com o custo, erro se a operação passa dos limites)"""
+    custo, profundidade = analisar_custo(documento, operacao)
+    extensao = {
+        "estimado": custo,
+        "maximo": GRAPHQL_CUSTO_MAXIMO or None,
+        "profundidade": profundidade,
+        "profundidade_maxima": GRAPHQL_PROFUNDIDADE_MAXIMA or None,
+    }
+    if GRAPHQL_PROFUNDIDADE_MAXIMA and profundidade > GRAPHQL_PROFUNDIDADE_MAXIMA:
+        return extensao, GraphQLError(
+            f"Profundidade {profundidade} excede o máximo de {GRAPHQL_PROFUNDIDADE_MAXIMA}",
+            extensions={"code": "PROFUNDIDADE_EXCEDIDA"}
+        )
+    if GRAPHQL_CUSTO_MAXIMO and custo > GRAPHQL_CUSTO_MAXIMO:
+        return extensao, GraphQLError(
+            f"Custo estimado {custo} excede o máximo de {GRAPHQL_CUSTO_MAXIMO}",
+            extensions={"code": "CUSTO_EXCEDIDO"}
+        )
+    return extensao, None
+
+
+# ========== CACHE DE RESULTADOS ==========
+
+# Opcional: guarda o resultado de queries idênticas (documento normalizado + variáveis)
+GRAPHQL_CACHE_RESULTADOS = os.getenv('GRAPHQL_CACHE_RESULTADOS', '0') == '1'
+# Memória máxima ocupada pelos resultados (tamanho do JSON)
+GRAPHQL_CACHE_RESULTADOS_BYTES = int(os.getenv('GRAPHQL_CACHE_RESULTADOS_BYTES', str(64 * 1024 * 1024)))
+# max-age dos campos sem dica; o resultado vale pelo menor max-age entre os campos
+GRAPHQL_CACHE_RESULTADOS_MAX_AGE = int(os.getenv('GRAPHQL_CACHE_RESULTADOS_MAX_AGE', '60'))
+
+# Dicas de max-age (s) no estilo @cacheControl: por tipo retornado e, com
+# prioridade, por campo. 0 impede o cache das queries que usam o campo.
+DICAS_CACHE_TIPOS = {
+    # O catálogo muda pouco
+    'MusicaType': 300,
+    'PlaylistType': 30,
+}
+DICAS_CACHE_CAMPOS = {
+    # As músicas de uma playlist mudam com a playlist
+    ('PlaylistType', 'musicas'): 30,
+}
+
+# Entidades alteradas por cada mutation (os resultados que as leram são descartados)
+ENTIDADES_ALTERADAS = {
+    'CriarUsuario': ('usuarios',),
+    'AtualizarUsuario': ('usuarios',),
+    'RemoverUsuario': ('usuarios', 'playlists'),
+    'CriarMusica': ('musicas',),
+    'AtualizarMusica': ('musicas',),
+    'RemoverMusica': ('musicas', 'playlists'),
+    'CriarPlaylist': ('playlists',),
+    'AtualizarPlaylist': ('playlists',),
+    'AdicionarMusicaAPlaylist': ('playlists',),
+    'RemoverMusicaDePlaylist': ('playlists',),
+    'RemoverPlaylist': ('playlists',),
+}
+
+
+def politica_cache(documento, operacao) -> tuple:
+    """(max-age, entidades lidas) de uma query, pelas dicas dos campos com sub-seleção"""
+    fragmentos = fragmentos_do_documento(documento)
+    entidades = set()
+    max_age = None
+
+    def visitar(selecoes, tipo):
+        nonlocal max_age
+        for no, campo in campos_selecionados(selecoes, tipo, fragmentos):
+            if not no.selection_set:
+                continue
+            retorno = get_named_type(campo.type)
+            dica = DICAS_CACHE_CAMPOS.get(
+                (tipo.name, no.name.value),
+                DICAS_CACHE_TIPOS.get(retorno.name, GRAPHQL_CACHE_RESULTADOS_MAX_AGE)
+            )
+            max_age = dica if max_age is None else min(max_age, dica)
+            if retorno.name in PROJECOES:
+                entidades.add(PROJECOES[retorno.name][0])
+            visitar(no.selection_set, retorno)
+
+    visitar(operacao.selection_set, schema.graphql_schema.get_root_type(operacao.operation))
+    return (max_age if max_age is not None else GRAPHQL_CACHE_RESULTADOS_MAX_AGE), frozenset(entidades)
+
+
+def entidades_alteradas(documento, operacao) -> set:
+    """Entidades que as mutations da operação podem ter alterado"""
+    tipo_raiz = schema.graphql_schema.get_root_type(operacao.operation)
+    alteradas = set()
+    for _, campo in campos_selecionados(operacao.selection_set, tipo_raiz, fragmentos_do_documento(documento)):
+        alteradas.update(ENTIDADES_ALTERADAS.get(get_named_type(campo.type).name, ()))
+    return alteradas
+
+
+class CacheResultados:
+    """
+    Resultados de queries por (assinatura do documento, operação, variáveis),
+    com expiração pelo max-age, LRU dentro do orçamento de memória e
+    invalidação por entidade. Cada entidade tem uma geração, incrementada a
+    cada invalidação: um resultado calculado enquanto uma mutation alterava
+    as suas entidades não é guardado.
+    """
+
+    def __init__(self, orcamento_bytes: int):
+        self.orcamento_bytes = orcamento_bytes
+        self._entradas = OrderedDict()
+        self._por_entidade = {}
+        self._geracoes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._acertos = 0
+        self._falhas = 0
+        self._invalidadas = 0
+        self._expiradas = 0
+
+    @staticmethod
+    def chave(assinatura: str, operation_name: Optional[str], variables) -> str:
+        conteudo = json.dumps([assinatura, operation_name, variables or {}], sort_keys=True, default=str)
+        return hash_query(conteudo)
+
+    def obter(self, chave: str) -> Optional[tuple]:
+        """(dados, extensões) guardados, ou None"""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada['expira_em'] <= time.monotonic():
+                self._remover(chave)
+                self._expiradas += 1
+                entrada = None
+            if entrada is None:
+                self._falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self._acertos += 1
+            return entrada['dados'], entrada['extensoes']
+
+    def geracoes(self) -> dict:
+        with self._lock:
+            return dict(self._geracoes)
+
+    def guardar(self, chave: str, dados, extensoes: Optional[dict], entidades: frozenset,
+                max_age: int, geracoes: dict):
+        tamanho = len(json.dumps(dados, default=str))
+        if tamanho > self.orcamento_bytes:
+            return
+        with self._lock:
+            if any(self._geracoes.get(e, 0) != geracoes.get(e, 0) for e in entidades):
+                return
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = {
+                'dados': dados,
+                'extensoes': extensoes or {},
+                'entidades': entidades,
+                'expira_em': time.monotonic() + max_age,
+                'tamanho': tamanho,
+            }
+            self._bytes += tamanho
+            for entidade in entidades:
+                self._por_entidade.setdefault(entidade, set()).add(chave)
+            while self._bytes > self.orcamento_bytes:
+                self._remover(next(iter(self._entradas)))
+
+    def invalidar(self, entidades: Iterable[str]):
+        with self._lock:
+            for entidade in entidades:
+                self._geracoes[entidade] = self._geracoes.get(entidade, 0) + 1
+                for chave in list(self._por_entidade.get(entidade, ())):
+                    self._remover(chave)
+                    self._invalidadas += 1
+
+    def _remover(self, chave: str):
+        entrada = self._entradas.pop(chave)
+        self._bytes -= entrada['tamanho']
+        for entidade in entrada['entidades']:
+            chaves = self._por_entidade.get(entidade)
+            if chaves is not None:
+                chaves.discard(chave)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            total = self._acertos + self._falhas
+            return {
+                "habilitado": GRAPHQL_CACHE_RESULTADOS,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "orcamento_bytes": self.orcamento_bytes,
+                "acertos": self._acertos,
+                "falhas": self._falhas,
+                "taxa_acerto": round(self._acertos / total, 4) if total else None,
+                "invalidadas": self._invalidadas,
+                "expiradas": self._expiradas,
+            }
+
+
+cache_resultados = CacheResultados(GRAPHQL_CACHE_RESULTADOS_BYTES)
+
+
+# ========== CAMPOS RAIZ EM PARALELO ==========
+
+# Campos raiz de uma query executados ao mesmo tempo (1 desliga)
+GRAPHQL_PARALELISMO_RAIZ = int(os.getenv('GRAPHQL_PARALELISMO_RAIZ', '4'))
+# Threads compartilhadas pelos campos raiz de todas as operações
+GRAPHQL_TRABALHADORES_RAIZ = int(os.getenv('GRAPHQL_TRABALHADORES_RAIZ', str(GRAPHQL_TRABALHADORES)))
+
+
+class ExecucaoParalela:
+    """
+    Executa os campos raiz independentes de uma query ao mesmo tempo. Cada
+    listagem na raiz vira uma operação separada, com o seu próprio contexto
+    (sessão, vaga no bulkhead e DataLoaders); os demais campos raiz ficam
+    juntos em mais uma. As partes são distribuídas em até `paralelismo`
+    faixas: a primeira roda na thread da operação e as outras neste pool,
+    separado do executor para que uma operação nunca espere por uma thread
+    ocupada por outra que também espera.
+
+    Como cada parte tem a sua transação, as listagens não compartilham o
+    mesmo snapshot.
+    """
+
+    def __init__(self, trabalhadores: int, paralelismo: int):
+        self.paralelismo = paralelismo
+        self._pool = ThreadPoolExecutor(max_workers=max(1, trabalhadores), thread_name_prefix='graphql-raiz')
+        self._lock = threading.Lock()
+        self._operacoes = 0
+        self._partes = 0
+
+    def partes(self, operacao) -> list:
+        """Seleções raiz agrupadas em partes independentes ([] se não vale paralelizar)"""
+        if self.paralelismo <= 1 or operacao.operation != OperationType.QUERY:
+            return []
+        campos_raiz = schema.graphql_schema.query_type.fields
+        listagens = []
+        demais = []
+        for selecao in operacao.selection_set.selections:
+            if not isinstance(selecao, FieldNode):
+                # Fragmentos na raiz: executa a operação inteira de uma vez
+                return []
+            campo = campos_raiz.get(selecao.name.value)
+            if campo is not None and isinstance(get_nullable_type(campo.type), GraphQLList):
+                listagens.append([selecao])
+            else:
+                demais.append(selecao)
+        if len(listagens) < 2:
+            return []
+        return listagens + ([demais] if demais else [])
+
+    def executar(self, documento, operacao, partes: list, variables) -> ExecutionResult:
+        faixas = [partes[i::self.paralelismo] for i in range(min(self.paralelismo, len(partes)))]
+        futuros = [
+            self._pool.submit(contextvars.copy_context().run, self._executar_faixa, documento, operacao, faixa, variables)
+            for faixa in faixas[1:]
+        ]
+        with self._lock:
+            self._operacoes += 1
+            self._partes += len(partes)
+        resultados = self._executar_faixa(documento, operacao, faixas[0], variables)
+        for futuro in futuros:
+            resultados.update(futuro.result())
+
+        # Junta os resultados na ordem em que os campos foram pedidos
+        dados = {}
+        erros = []
+        for parte in partes:
+            resultado = resultados[id(parte)]
+            erros.extend(resultado.errors or ())
+            if resultado.data is None:
+                dados = None
+            elif dados is not None:
+                dados.update(resultado.data)
+        if dados is not None:
+            chaves = [(s.alias or s.name).value for s in operacao.selection_set.selections]
+            dados = {chave: dados[chave] for chave in chaves if chave in dados}
+        return ExecutionResult(data=dados, errors=erros or None)
+
+    @staticmethod
+    def _executar_faixa(documento, operacao, faixa: list, variables) -> dict:
+        resultados = {}
+        for parte in faixa:
+            sub_operacao = OperationDefinitionNode(
+                operation=operacao.operation,
+                name=operacao.name,
+                variable_definitions=operacao.variable_definitions,
+                directives=operacao.directives,
+                selection_set=SelectionSetNode(selections=tuple(parte)),
+            )
+            sub_documento = DocumentNode(definitions=(sub_operacao,) + tuple(
+                definicao for definicao in documento.definitions if isinstance(definicao, FragmentDefinitionNode)
+            ))
+            contexto = ContextoExecucao(sub_documento, sub_operacao)
+            try:
+                resultados[id(parte)] = execute_sync(
+                    schema.graphql_schema,
+                    sub_documento,
+                    variable_values=variables,
+                    context_value=contexto
+                )
+            finally:
+                contexto.fechar()
+        return resultados
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                "paralelismo": self.paralelismo,
+                "operacoes": self._operacoes,
+                "partes": self._partes,
+            }
+
+
+execucao_paralela = ExecucaoParalela(GRAPHQL_TRABALHADORES_RAIZ, GRAPHQL_PARALELISMO_RAIZ)
+
+
+def executar_documento(documento, operacao, variables, operation_name) -> ExecutionResult:
+    """Executa a operação, com os campos raiz em paralelo quando possível"""
+    partes = execucao_paralela.partes(operacao) if operacao is not None else []
+    if partes:
+        return execucao_paralela.executar(documento, operacao, partes, variables)
+    contexto = ContextoExecucao(documento, operacao)
+    try:
+        return execute_sync(
+            schema.graphql_schema,
+            documento,
             variable_values=variables,
-            operation_name=operation_name
+            operation_name=operation_name,
+            context_value=contexto
+        )
+    finally:
+        contexto.fechar()
+
+
+def preparar_operacao(query: Optional[str], operation_name, extensoes: Optional[dict] = None) -> tuple:
+    """
+    Resolve a query persistida, obtém o documento validado e verifica o custo.
+    Retorna (documento, assinatura, operação, extensões da resposta, resultado
+    com os erros se a operação não pode ser executada ou None).
+    """
+    query, registrar = consultas_persistidas.resolver(query, extensoes)
+    documento, erros, assinatura = cache_documentos.obter(query)
+    if documento is None:
+        return None, None, None, None, ExecutionResult(data=None, errors=erros)
+    if registrar is not None:
+        consultas_persistidas.registrar(registrar, query)
+    operacao = get_operation_ast(documento, operation_name)
+    if operacao is None:
+        # A execução reporta o nome de operação desconhecido
+        return documento, assinatura, None, None, None
+    custo, erro = verificar_custo(documento, operacao)
+    extensoes_resposta = {"custo": custo}
+    if erro is not None:
+        return documento, assinatura, operacao, extensoes_resposta, ExecutionResult(
+            data=None, errors=[erro], extensions=extensoes_resposta
         )
+    return documento, assinatura, operacao, extensoes_resposta, None
+
+
+def executar_operacao(query: Optional[str], variables, operation_name, extensoes: Optional[dict] = None):
+    """
+    Executa uma operação com o seu próprio contexto (sessão e DataLoaders).
+    Retorna (resultado, tipo da operação executada ou None se não executou).
+    """
+    documento, assinatura, operacao, extensoes_resposta, recusa = preparar_operacao(query, operation_name, extensoes)
+    if recusa is not None:
+        return recusa, operacao.operation if operacao is not None else None
+    if operacao is not None and operacao.operation == OperationType.SUBSCRIPTION:
+        erro = GraphQLError("Subscriptions só pelo WebSocket em /graphql (graphql-ws)")
+        return ExecutionResult(data=None, errors=[erro]), operacao.operation
+
+    cacheavel = GRAPHQL_CACHE_RESULTADOS and operacao is not None and operacao.operation == OperationType.QUERY
+    if cacheavel:
+        max_age, entidades = politica_cache(documento, operacao)
+        chave = cache_resultados.chave(assinatura, operation_name, variables)
+        entrada = cache_resultados.obter(chave)
+        if entrada is not None:
+            dados, extensoes_guardadas = entrada
+            return ExecutionResult(data=dados, extensions={
+                **extensoes_guardadas, "cache": {"acerto": True, "max_age": max_age}
+            }), operacao.operation
+        # Invalidações durante a execução impedem que o resultado seja guardado
+        geracoes = cache_resultados.geracoes()
 
-        if result.errors:
-            return JSONResponse({"errors": [{"message": str(e)} for e in result.errors]}, status_code=400)
+    try:
+        resultado = executar_documento(documento, operacao, variables, operation_name)
+    finally:
+        if GRAPHQL_CACHE_RESULTADOS and operacao is not None and operacao.operation == OperationType.MUTATION:
+            cache_resultados.invalidar(entidades_alteradas(documento, operacao))
+
+    if cacheavel:
+        if not resultado.errors and max_age > 0:
+            cache_resultados.guardar(chave, resultado.data, extensoes_resposta, entidades, max_age, geracoes)
+        extensoes_resposta = {**extensoes_resposta, "cache": {"acerto": False, "max_age": max_age}}
+    resultado.extensions = extensoes_resposta
+    return resultado, operacao.operation if operacao is not None else None
+
+
+def resposta_executor_cheio(erro: ExecutorCheio) -> JSONResponse:
+    return JSONResponse({"errors": [{"message": str(erro)}]}, status_code=503, headers={"Retry-After": "1"})
 
-        return JSONResponse({"data": result.data})
 
+async def responder(query: Optional[str], variables, operation_name, extensoes, metodo_get: bool) -> JSONResponse:
+    """Executa a operação no pool e monta a resposta HTTP"""
+    try:
+        if not query and not (extensoes or {}).get("persistedQuery"):
+            mensagem = "Query não fornecida. Use ?query=..." if metodo_get else "Query não fornecida"
+            return JSONResponse({"errors": [{"message": mensagem}]}, status_code=400)
+
+        result, operacao = await executor_graphql.executar(
+            executar_operacao, query or None, variables, operation_name, extensoes
+        )
+
+        corpo = {"extensions": result.extensions} if result.extensions else {}
+        if result.errors:
+            erros = [
+                {"message": str(e), "extensions": e.extensions} if e.extensions else {"message": str(e)}
+                for e in result.errors
+            ]
+            return JSONResponse({"errors": erros, **corpo}, status_code=400)
+
+        headers = {}
+        if metodo_get and not query and operacao == OperationType.QUERY and GRAPHQL_APQ_MAX_AGE > 0:
+            # A URL com o hash identifica a query: a resposta pode ficar em caches HTTP
+            headers["Cache-Control"] = f"public, max-age={GRAPHQL_APQ_MAX_AGE}"
+        return JSONResponse({"data": result.data, **corpo}, headers=headers)
+
+    except ErroConsultaPersistida as e:
+        return JSONResponse(
+            {"errors": [{"message": str(e), "extensions": {"code": e.codigo}}]},
+            status_code=e.status_code
+        )
+    except ExecutorCheio as e:
+        return resposta_executor_cheio(e)
     except Exception as e:
         return JSONResponse({"errors": [{"message": str(e)}]}, status_code=500)
 
 
-@app.get("/graphql")
-async def graphql_endpoint_get(request: Request):
-    """Endpoint GraphQL via GET (aceita query como parâmetro)"""
+@app.post("/graphql")
+async def graphql_endpoint(request: Request):
+    """Endpoint GraphQL"""
     try:
-        query = request.query_params.get("query")
-        variables_str = request.query_params.get("variables")
-        operation_name = request.query_params.get("operationName")
+        body = await request.json()
+    except Exception as e:
+        return JSONResponse({"errors": [{"message": str(e)}]}, status_code=500)
+    return await responder(
+        body.get("query"), body.get("variables"), body.get("operationName"), body.get("extensions"), metodo_get=False
+    )
 
-        if not query:
-            return JSONResponse({"errors": [{"message": "Query não fornecida. Use ?query=..."}]}, status_code=400)
 
-        variables = None
-        if variables_str:
-            import json
+@app.get("/graphql")
+async def graphql_endpoint_get(request: Request):
+    """Endpoint GraphQL via GET (aceita query como parâmetro ou o hash de uma query persistida)"""
+    parametros = {}
+    for nome in ("variables", "extensions"):
+        valor = request.query_params.get(nome)
+        if valor:
             try:
-                variables = json.loads(variables_str)
+                parametros[nome] = json.loads(valor)
             except json.JSONDecodeError:
-                return JSONResponse({"errors": [{"message": "Variables inválidas (deve ser JSON)"}]}, status_code=400)
+                mensagem = "Variables inválidas (deve ser JSON)" if nome == "variables" else "Extensions inválidas (deve ser JSON)"
+                return JSONResponse({"errors": [{"message": mensagem}]}, status_code=400)
+    return await responder(
+        request.query_params.get("query"),
+        parametros.get("variables"),
+        request.query_params.get("operationName"),
+        parametros.get("extensions"),
+        metodo_get=True
+    )
 
-        result = schema.execute(
-            query,
-            variable_values=variables,
-            operation_name=operation_name
-        )
 
-        if result.errors:
-            return JSONResponse({"errors": [{"message": str(e)} for e in result.errors]}, status_code=400)
+# ========== SUBSCRIPTIONS (WEBSOCKET) ==========
 
-        return JSONResponse({"data": result.data})
+PROTOCOLO_GRAPHQL_TRANSPORT_WS = 'graphql-transport-ws'
+# Protocolo legado do subscriptions-transport-ws
+PROTOCOLO_GRAPHQL_WS = 'graphql-ws'
+# Tempo (s) para o cliente enviar connection_init
+GRAPHQL_WS_TEMPO_INIT = float(os.getenv('GRAPHQL_WS_TEMPO_INIT', '10'))
+# Operações simultâneas por conexão
+GRAPHQL_WS_MAX_OPERACOES = int(os.getenv('GRAPHQL_WS_MAX_OPERACOES', '50'))
 
-    except Exception as e:
-        return JSONResponse({"errors": [{"message": str(e)}]}, status_code=500)
+# Nomes das mensagens que diferem entre os protocolos
+MENSAGENS_WS = {
+    PROTOCOLO_GRAPHQL_TRANSPORT_WS: {'iniciar': 'subscribe', 'parar': 'complete', 'resultado': 'next'},
+    PROTOCOLO_GRAPHQL_WS: {'iniciar': 'start', 'parar': 'stop', 'resultado': 'data'},
+}
+
+
+def executar_evento(documento, operacao, variables, operation_name, evento) -> ExecutionResult:
+    """Resolve a seleção de uma assinatura para um evento, com o seu próprio contexto"""
+    contexto = ContextoExecucao(documento, operacao)
+    try:
+        return execute_sync(
+            schema.graphql_schema,
+            documento,
+            root_value=evento,
+            variable_values=variables,
+            operation_name=operation_name,
+            context_value=contexto
+        )
+    finally:
+        contexto.fechar()
+
+
+class ConexaoGraphQLWS:
+    """
+    Uma conexão WebSocket em /graphql. Cada operação roda em uma tarefa; as
+    subscriptions ficam recebendo os eventos do canal até o cliente pará-las
+    ou desconectar. Consultas e mutations respondem uma vez e terminam.
+    """
+
+    ativas = 0
+
+    def __init__(self, websocket: WebSocket, protocolo: str):
+        self.websocket = websocket
+        self.protocolo = protocolo
+        self.mensagens = MENSAGENS_WS[protocolo]
+        self.operacoes = {}
+        self._envio = asyncio.Lock()
+        self._iniciada = False
+
+    async def executar(self):
+        ConexaoGraphQLWS.ativas += 1
+        loop = asyncio.get_running_loop()
+        limite_init = loop.time() + GRAPHQL_WS_TEMPO_INIT
+        try:
+            while True:
+                espera = None if self._iniciada else max(0.0, limite_init - loop.time())
+                try:
+                    texto = await asyncio.wait_for(self.websocket.receive_text(), espera)
+                except asyncio.TimeoutError:
+                    await self.websocket.close(code=4408, reason="Connection initialisation timeout")
+                    return
+                try:
+                    mensagem = json.loads(texto)
+                except json.JSONDecodeError:
+                    mensagem = None
+                if not isinstance(mensagem, dict) or not await self._tratar(mensagem):
+                    return
+        except WebSocketDisconnect:
+            pass
+        finally:
+            ConexaoGraphQLWS.ativas -= 1
+            for tarefa in list(self.operacoes.values()):
+                tarefa.cancel()
+
+    async def _tratar(self, mensagem: dict) -> bool:
+        """Trata uma mensagem do cliente; retorna False se a conexão foi fechada"""
+        tipo = mensagem.get("type")
+        id = mensagem.get("id")
+        if tipo == "connection_init":
+            if self._iniciada:
+                await self.websocket.close(code=4429, reason="Too many initialisation requests")
+                return False
+            self._iniciada = True
+            await self._enviar({"type": "connection_ack"})
+        elif tipo == "ping":
+            await self._enviar({"type": "pong"})
+        elif tipo == "pong":
+            pass
+        elif tipo == "connection_terminate":
+            await self.websocket.close()
+            return False
+        elif tipo == self.mensagens['iniciar']:
+            if not self._iniciada:
+                await self.websocket.close(code=4401, reason="Unauthorized")
+                return False
+            payload = mensagem.get("payload")
+            if not isinstance(id, str) or not isinstance(payload, dict):
+                await self.websocket.close(code=4400, reason="Mensagem inválida")
+                return False
+            if id in self.operacoes:
+                await self.websocket.close(code=4409, reason=f"Subscriber for {id} already exists")
+                return False
+            if len(self.operacoes) >= GRAPHQL_WS_MAX_OPERACOES:
+                await self._erro(id, [GraphQLError("Limite de operações por conexão atingido")])
+            else:
+                self.operacoes[id] = asyncio.create_task(self._operacao(id, payload))
+        elif tipo == self.mensagens['parar']:
+            tarefa = self.operacoes.pop(id, None)
+            if tarefa is not None:
+                tarefa.cancel()
+        else:
+            await self.websocket.close(code=4400, reason=f"Tipo de mensagem inválido: {tipo}")
+            return False
+        return True
+
+    async def _operacao(self, id: str, payload: dict):
+        query = payload.get("query")
+        variables = payload.get("variables")
+        operation_name = payload.get("operationName")
+        extensoes = payload.get("extensions")
+        try:
+            documento, _, operacao, _, recusa = await executor_graphql.executar(
+                preparar_operacao, query, operation_name, extensoes
+            )
+            if recusa is not None:
+                await self._erro(id, recusa.errors)
+                return
+            if operacao is None or operacao.operation != OperationType.SUBSCRIPTION:
+                resultado, _ = await executor_graphql.executar(
+                    executar_operacao, query, variables, operation_name, extensoes
+                )
+                await self._enviar({"type": self.mensagens['resultado'], "id": id, "payload": resultado.formatted})
+            else:
+                fonte = await create_source_event_stream(
+                    schema.graphql_schema, documento, variable_values=variables, operation_name=operation_name
+                )
+                if isinstance(fonte, ExecutionResult):
+                    await self._erro(id, fonte.errors)
+                    return
+                try:
+                    async for evento in fonte:
+                        try:
+                            resultado = await executor_graphql.executar(
+                                executar_evento, documento, operacao, variables, operation_name, evento
+                            )
+                        except ExecutorCheio:
+                            canal_eventos.contar_descarte()
+                            continue
+                        await self._enviar({"type": self.mensagens['resultado'], "id": id, "payload": resultado.formatted})
+                finally:
+                    await fonte.aclose()
+            await self._enviar({"type": "complete", "id": id})
+        except ErroConsultaPersistida as e:
+            await self._erro(id, [GraphQLError(str(e), extensions={"code": e.codigo})])
+        except ExecutorCheio as e:
+            await self._erro(id, [GraphQLError(str(e))])
+        except (WebSocketDisconnect, RuntimeError):
+            # A conexão fechou enquanto a operação respondia
+            pass
+        finally:
+            if self.operacoes.get(id) is asyncio.current_task():
+                del self.operacoes[id]
+
+    async def _erro(self, id: str, erros: list):
+        await self._enviar({"type": "error", "id": id, "payload": [erro.formatted for erro in erros]})
+
+    async def _enviar(self, mensagem: dict):
+        async with self._envio:
+            await self.websocket.send_text(json.dumps(mensagem, default=str))
+
+
+@app.websocket("/graphql")
+async def graphql_websocket(websocket: WebSocket):
+    """Subscriptions (e também queries e mutations) pelos protocolos graphql-transport-ws e graphql-ws"""
+    pedidos = websocket.scope.get("subprotocols", [])
+    protocolo = next((p for p in (PROTOCOLO_GRAPHQL_TRANSPORT_WS, PROTOCOLO_GRAPHQL_WS) if p in pedidos), None)
+    if protocolo is None:
+        await websocket.close(code=4406)
+        return
+    await websocket.accept(subprotocol=protocolo)
+    await ConexaoGraphQLWS(websocket, protocolo).executar()
+
+
+@app.get("/metricas")
+async def metricas():
+    """Métricas da execução, dos bulkheads, do single-flight e do group commit"""
+    return {
+        "execucao": executor_graphql.metricas(),
+        "raiz_paralela": execucao_paralela.metricas(),
+        "cache_documentos": cache_documentos.metricas(),
+        "consultas_persistidas": consultas_persistidas.metricas(),
+        "cache_resultados": cache_resultados.metricas(),
+        "subscriptions": {"conexoes": ConexaoGraphQLWS.ativas, **canal_eventos.metricas()},
+        "bulkheads": metricas_bulkheads(),
+        "single_flight": leituras_compartilhadas.metricas(),
+        "group_commit": coalescedor_escrita.metricas(),
+    }
 
 
 if __name__ == "__main__":
@@ -426,4 +1845,5 @@ if __name__ == "__main__":
     print("🎵 Serviço GraphQL rodando na porta 3003")
     print("📍 Endpoint POST: http://localhost:3003/graphql")
     print("📍 Endpoint GET: http://localhost:3003/graphql?query={usuarios{id nome}}")
+    print("📍 Subscriptions: ws://localhost:3003/graphql (graphql-transport-ws / graphql-ws)")
     uvicorn.run(app, host="0.0.0.0", port=3003)
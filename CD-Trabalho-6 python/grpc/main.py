@@ -39,8 +39,11 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from shared.database import get_db, init_db, SessionLocal
-from shared.repository import Repositorio
+from shared.repository import Repositorio, TokenExpirado, codificar_token, decodificar_token
 from shared.models import Usuario, Musica, Playlist
+from shared.cancelamento import TokenCancelamento, escopo_cancelamento, MOTIVO_DESCONEXAO
+from contextlib import contextmanager
+import threading
 import uuid
 
 
@@ -55,439 +58,471 @@ class StreamingMusicasService(streaming_pb2_grpc.StreamingMusicasServiceServicer
         # Não cria sessão aqui - cada método cria sua própria sessão
         pass
     
-    def _get_repo(self):
+    @contextmanager
+    def _sessao(self, context=None):
         """Cria uma nova sessão e repositório para cada requisição"""
-        db = SessionLocal()
+        token = None
+        if context is not None:
+            # O deadline do cliente vira o statement_timeout das transações da chamada,
+            # e o fim da RPC (cancelamento ou desconexão) interrompe as queries em andamento.
+            # O token vale só durante a chamada: a thread do pool volta sem ele.
+            # O callback também roda quando a RPC termina normalmente; só cancela
+            # se o handler ainda não tiver terminado.
+            token = TokenCancelamento(context.time_remaining())
+            encerrada = threading.Event()
+
+            def _rpc_terminada():
+                if not encerrada.is_set():
+                    token.cancelar(MOTIVO_DESCONEXAO)
+
+            context.add_callback(_rpc_terminada)
         try:
-            return Repositorio(db), db
-        except Exception:
-            db.close()
-            raise
+            with escopo_cancelamento(token):
+                db = SessionLocal()
+                try:
+                    yield Repositorio(db)
+                finally:
+                    db.close()
+        finally:
+            if token is not None:
+                encerrada.set()
     
     # ========== USUÁRIOS ==========
     
     def CriarUsuario(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            usuario = Usuario(
-                id=str(uuid.uuid4()),
-                nome=request.nome,
-                idade=request.idade
-            )
-            criado = repo.criar_usuario(usuario)
-            return streaming_pb2.UsuarioResponse(
-                usuario=streaming_pb2.Usuario(
-                    id=criado.id,
-                    nome=criado.nome,
-                    idade=criado.idade
+        with self._sessao(context) as repo:
+            try:
+                usuario = Usuario(
+                    id=str(uuid.uuid4()),
+                    nome=request.nome,
+                    idade=request.idade
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.UsuarioResponse(erro=str(e))
-        finally:
-            db.close()
+                criado = repo.criar_usuario(usuario)
+                return streaming_pb2.UsuarioResponse(
+                    usuario=streaming_pb2.Usuario(
+                        id=criado.id,
+                        nome=criado.nome,
+                        idade=criado.idade
+                    )
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.UsuarioResponse(erro=str(e))
     
     def ObterUsuario(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            usuario = repo.obter_usuario(request.id)
-            if not usuario:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Usuário não encontrado")
-                return streaming_pb2.UsuarioResponse(erro="Usuário não encontrado")
-            return streaming_pb2.UsuarioResponse(
-                usuario=streaming_pb2.Usuario(
-                    id=usuario.id,
-                    nome=usuario.nome,
-                    idade=usuario.idade
+        with self._sessao(context) as repo:
+            try:
+                usuario = repo.obter_usuario(request.id)
+                if not usuario:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Usuário não encontrado")
+                    return streaming_pb2.UsuarioResponse(erro="Usuário não encontrado")
+                return streaming_pb2.UsuarioResponse(
+                    usuario=streaming_pb2.Usuario(
+                        id=usuario.id,
+                        nome=usuario.nome,
+                        idade=usuario.idade
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.UsuarioResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.UsuarioResponse(erro=str(e))
     
     def ListarUsuarios(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            usuarios = repo.listar_usuarios()
-            return streaming_pb2.ListarUsuariosResponse(
-                usuarios=[
-                    streaming_pb2.Usuario(
-                        id=u.id,
-                        nome=u.nome,
-                        idade=u.idade
-                    ) for u in usuarios
-                ]
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.ListarUsuariosResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                usuarios = repo.listar_usuarios()
+                return streaming_pb2.ListarUsuariosResponse(
+                    usuarios=[
+                        streaming_pb2.Usuario(
+                            id=u.id,
+                            nome=u.nome,
+                            idade=u.idade
+                        ) for u in usuarios
+                    ]
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.ListarUsuariosResponse(erro=str(e))
     
     def AtualizarUsuario(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            usuario = repo.atualizar_usuario(request.id, {
-                'nome': request.nome,
-                'idade': request.idade
-            })
-            if not usuario:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Usuário não encontrado")
-                return streaming_pb2.UsuarioResponse(erro="Usuário não encontrado")
-            return streaming_pb2.UsuarioResponse(
-                usuario=streaming_pb2.Usuario(
-                    id=usuario.id,
-                    nome=usuario.nome,
-                    idade=usuario.idade
+        with self._sessao(context) as repo:
+            try:
+                usuario = repo.atualizar_usuario(request.id, {
+                    'nome': request.nome,
+                    'idade': request.idade
+                })
+                if not usuario:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Usuário não encontrado")
+                    return streaming_pb2.UsuarioResponse(erro="Usuário não encontrado")
+                return streaming_pb2.UsuarioResponse(
+                    usuario=streaming_pb2.Usuario(
+                        id=usuario.id,
+                        nome=usuario.nome,
+                        idade=usuario.idade
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.UsuarioResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.UsuarioResponse(erro=str(e))
     
     def RemoverUsuario(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            sucesso = repo.remover_usuario(request.id)
-            return streaming_pb2.RemoverUsuarioResponse(sucesso=sucesso)
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.RemoverUsuarioResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                sucesso = repo.remover_usuario(request.id)
+                return streaming_pb2.RemoverUsuarioResponse(sucesso=sucesso)
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.RemoverUsuarioResponse(erro=str(e))
     
     # ========== MÚSICAS ==========
     
     def CriarMusica(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            musica = Musica(
-                id=str(uuid.uuid4()),
-                nome=request.nome,
-                artista=request.artista
-            )
-            criada = repo.criar_musica(musica)
-            return streaming_pb2.MusicaResponse(
-                musica=streaming_pb2.Musica(
-                    id=criada.id,
-                    nome=criada.nome,
-                    artista=criada.artista
+        with self._sessao(context) as repo:
+            try:
+                musica = Musica(
+                    id=str(uuid.uuid4()),
+                    nome=request.nome,
+                    artista=request.artista
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.MusicaResponse(erro=str(e))
-        finally:
-            db.close()
+                criada = repo.criar_musica(musica)
+                return streaming_pb2.MusicaResponse(
+                    musica=streaming_pb2.Musica(
+                        id=criada.id,
+                        nome=criada.nome,
+                        artista=criada.artista
+                    )
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.MusicaResponse(erro=str(e))
     
     def ObterMusica(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            musica = repo.obter_musica(request.id)
-            if not musica:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Música não encontrada")
-                return streaming_pb2.MusicaResponse(erro="Música não encontrada")
-            return streaming_pb2.MusicaResponse(
-                musica=streaming_pb2.Musica(
-                    id=musica.id,
-                    nome=musica.nome,
-                    artista=musica.artista
+        with self._sessao(context) as repo:
+            try:
+                musica = repo.obter_musica(request.id)
+                if not musica:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Música não encontrada")
+                    return streaming_pb2.MusicaResponse(erro="Música não encontrada")
+                return streaming_pb2.MusicaResponse(
+                    musica=streaming_pb2.Musica(
+                        id=musica.id,
+                        nome=musica.nome,
+                        artista=musica.artista
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.MusicaResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.MusicaResponse(erro=str(e))
     
     def ListarMusicas(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            musicas = repo.listar_musicas()
-            return streaming_pb2.ListarMusicasResponse(
-                musicas=[
-                    streaming_pb2.Musica(
-                        id=m.id,
-                        nome=m.nome,
-                        artista=m.artista
-                    ) for m in musicas
-                ]
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.ListarMusicasResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                musicas = repo.listar_musicas()
+                return streaming_pb2.ListarMusicasResponse(
+                    musicas=[
+                        streaming_pb2.Musica(
+                            id=m.id,
+                            nome=m.nome,
+                            artista=m.artista
+                        ) for m in musicas
+                    ]
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.ListarMusicasResponse(erro=str(e))
     
     def AtualizarMusica(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            musica = repo.atualizar_musica(request.id, {
-                'nome': request.nome,
-                'artista': request.artista
-            })
-            if not musica:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Música não encontrada")
-                return streaming_pb2.MusicaResponse(erro="Música não encontrada")
-            return streaming_pb2.MusicaResponse(
-                musica=streaming_pb2.Musica(
-                    id=musica.id,
-                    nome=musica.nome,
-                    artista=musica.artista
+        with self._sessao(context) as repo:
+            try:
+                musica = repo.atualizar_musica(request.id, {
+                    'nome': request.nome,
+                    'artista': request.artista
+                })
+                if not musica:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Música não encontrada")
+                    return streaming_pb2.MusicaResponse(erro="Música não encontrada")
+                return streaming_pb2.MusicaResponse(
+                    musica=streaming_pb2.Musica(
+                        id=musica.id,
+                        nome=musica.nome,
+                        artista=musica.artista
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.MusicaResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.MusicaResponse(erro=str(e))
     
     def RemoverMusica(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            sucesso = repo.remover_musica(request.id)
-            return streaming_pb2.RemoverMusicaResponse(sucesso=sucesso)
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.RemoverMusicaResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                sucesso = repo.remover_musica(request.id)
+                return streaming_pb2.RemoverMusicaResponse(sucesso=sucesso)
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.RemoverMusicaResponse(erro=str(e))
     
     # ========== PLAYLISTS ==========
     
     def CriarPlaylist(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlist = Playlist(
-                id=str(uuid.uuid4()),
-                nome=request.nome,
-                usuario_id=request.usuarioId,
-                musicas_ids=[]
-            )
-            criada = repo.criar_playlist(playlist)
-            return streaming_pb2.PlaylistResponse(
-                playlist=streaming_pb2.Playlist(
-                    id=criada.id,
-                    nome=criada.nome,
-                    usuarioId=criada.usuario_id,
-                    musicasIds=criada.musicas_ids
+        with self._sessao(context) as repo:
+            try:
+                playlist = Playlist(
+                    id=str(uuid.uuid4()),
+                    nome=request.nome,
+                    usuario_id=request.usuarioId,
+                    musicas_ids=[]
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.PlaylistResponse(erro=str(e))
-        finally:
-            db.close()
+                criada = repo.criar_playlist(playlist)
+                return streaming_pb2.PlaylistResponse(
+                    playlist=streaming_pb2.Playlist(
+                        id=criada.id,
+                        nome=criada.nome,
+                        usuarioId=criada.usuario_id,
+                        musicasIds=criada.musicas_ids
+                    )
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.PlaylistResponse(erro=str(e))
     
     def ObterPlaylist(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlist = repo.obter_playlist(request.id)
-            if not playlist:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Playlist não encontrada")
-                return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
-            return streaming_pb2.PlaylistResponse(
-                playlist=streaming_pb2.Playlist(
-                    id=playlist.id,
-                    nome=playlist.nome,
-                    usuarioId=playlist.usuario_id,
-                    musicasIds=playlist.musicas_ids
+        with self._sessao(context) as repo:
+            try:
+                playlist = repo.obter_playlist(request.id)
+                if not playlist:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Playlist não encontrada")
+                    return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
+                return streaming_pb2.PlaylistResponse(
+                    playlist=streaming_pb2.Playlist(
+                        id=playlist.id,
+                        nome=playlist.nome,
+                        usuarioId=playlist.usuario_id,
+                        musicasIds=playlist.musicas_ids
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.PlaylistResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.PlaylistResponse(erro=str(e))
     
     def ListarPlaylists(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlists = repo.listar_playlists()
-            return streaming_pb2.ListarPlaylistsResponse(
-                playlists=[
-                    streaming_pb2.Playlist(
-                        id=p.id,
-                        nome=p.nome,
-                        usuarioId=p.usuario_id,
-                        musicasIds=p.musicas_ids
-                    ) for p in playlists
-                ]
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.ListarPlaylistsResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                playlists = repo.listar_playlists()
+                return streaming_pb2.ListarPlaylistsResponse(
+                    playlists=[
+                        streaming_pb2.Playlist(
+                            id=p.id,
+                            nome=p.nome,
+                            usuarioId=p.usuario_id,
+                            musicasIds=p.musicas_ids
+                        ) for p in playlists
+                    ]
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.ListarPlaylistsResponse(erro=str(e))
     
     def ListarPlaylistsPorUsuario(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlists = repo.listar_playlists_por_usuario(request.usuarioId)
-            return streaming_pb2.ListarPlaylistsResponse(
-                playlists=[
-                    streaming_pb2.Playlist(
-                        id=p.id,
-                        nome=p.nome,
-                        usuarioId=p.usuario_id,
-                        musicasIds=p.musicas_ids
-                    ) for p in playlists
-                ]
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.ListarPlaylistsResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                playlists = repo.listar_playlists_por_usuario(request.usuarioId)
+                return streaming_pb2.ListarPlaylistsResponse(
+                    playlists=[
+                        streaming_pb2.Playlist(
+                            id=p.id,
+                            nome=p.nome,
+                            usuarioId=p.usuario_id,
+                            musicasIds=p.musicas_ids
+                        ) for p in playlists
+                    ]
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.ListarPlaylistsResponse(erro=str(e))
     
     def ListarMusicasPorPlaylist(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            musicas = repo.listar_musicas_por_playlist(request.playlistId)
-            return streaming_pb2.ListarMusicasResponse(
-                musicas=[
-                    streaming_pb2.Musica(
-                        id=m.id,
-                        nome=m.nome,
-                        artista=m.artista
-                    ) for m in musicas
-                ]
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.ListarMusicasResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                musicas = repo.listar_musicas_por_playlist(request.playlistId)
+                return streaming_pb2.ListarMusicasResponse(
+                    musicas=[
+                        streaming_pb2.Musica(
+                            id=m.id,
+                            nome=m.nome,
+                            artista=m.artista
+                        ) for m in musicas
+                    ]
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.ListarMusicasResponse(erro=str(e))
     
     def ListarPlaylistsPorMusica(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlists = repo.listar_playlists_por_musica(request.musicaId)
-            return streaming_pb2.ListarPlaylistsResponse(
-                playlists=[
-                    streaming_pb2.Playlist(
-                        id=p.id,
-                        nome=p.nome,
-                        usuarioId=p.usuario_id,
-                        musicasIds=p.musicas_ids
-                    ) for p in playlists
-                ]
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.ListarPlaylistsResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                playlists = repo.listar_playlists_por_musica(request.musicaId)
+                return streaming_pb2.ListarPlaylistsResponse(
+                    playlists=[
+                        streaming_pb2.Playlist(
+                            id=p.id,
+                            nome=p.nome,
+                            usuarioId=p.usuario_id,
+                            musicasIds=p.musicas_ids
+                        ) for p in playlists
+                    ]
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.ListarPlaylistsResponse(erro=str(e))
     
     def AtualizarPlaylist(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlist = repo.atualizar_playlist(request.id, {
-                'nome': request.nome,
-                'usuario_id': request.usuarioId
-            })
-            if not playlist:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Playlist não encontrada")
-                return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
-            return streaming_pb2.PlaylistResponse(
-                playlist=streaming_pb2.Playlist(
-                    id=playlist.id,
-                    nome=playlist.nome,
-                    usuarioId=playlist.usuario_id,
-                    musicasIds=playlist.musicas_ids
+        with self._sessao(context) as repo:
+            try:
+                playlist = repo.atualizar_playlist(request.id, {
+                    'nome': request.nome,
+                    'usuario_id': request.usuarioId
+                })
+                if not playlist:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Playlist não encontrada")
+                    return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
+                return streaming_pb2.PlaylistResponse(
+                    playlist=streaming_pb2.Playlist(
+                        id=playlist.id,
+                        nome=playlist.nome,
+                        usuarioId=playlist.usuario_id,
+                        musicasIds=playlist.musicas_ids
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.PlaylistResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.PlaylistResponse(erro=str(e))
     
     def AdicionarMusicaAPlaylist(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlist = repo.adicionar_musica_a_playlist(request.playlistId, request.musicaId)
-            if not playlist:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Playlist não encontrada")
-                return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
-            return streaming_pb2.PlaylistResponse(
-                playlist=streaming_pb2.Playlist(
-                    id=playlist.id,
-                    nome=playlist.nome,
-                    usuarioId=playlist.usuario_id,
-                    musicasIds=playlist.musicas_ids
+        with self._sessao(context) as repo:
+            try:
+                playlist = repo.adicionar_musica_a_playlist(request.playlistId, request.musicaId)
+                if not playlist:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Playlist não encontrada")
+                    return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
+                return streaming_pb2.PlaylistResponse(
+                    playlist=streaming_pb2.Playlist(
+                        id=playlist.id,
+                        nome=playlist.nome,
+                        usuarioId=playlist.usuario_id,
+                        musicasIds=playlist.musicas_ids
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.PlaylistResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.PlaylistResponse(erro=str(e))
     
     def RemoverMusicaDePlaylist(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            playlist = repo.remover_musica_de_playlist(request.playlistId, request.musicaId)
-            if not playlist:
-                context.set_code(grpc.StatusCode.NOT_FOUND)
-                context.set_details("Playlist não encontrada")
-                return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
-            return streaming_pb2.PlaylistResponse(
-                playlist=streaming_pb2.Playlist(
-                    id=playlist.id,
-                    nome=playlist.nome,
-                    usuarioId=playlist.usuario_id,
-                    musicasIds=playlist.musicas_ids
+        with self._sessao(context) as repo:
+            try:
+                playlist = repo.remover_musica_de_playlist(request.playlistId, request.musicaId)
+                if not playlist:
+                    context.set_code(grpc.StatusCode.NOT_FOUND)
+                    context.set_details("Playlist não encontrada")
+                    return streaming_pb2.PlaylistResponse(erro="Playlist não encontrada")
+                return streaming_pb2.PlaylistResponse(
+                    playlist=streaming_pb2.Playlist(
+                        id=playlist.id,
+                        nome=playlist.nome,
+                        usuarioId=playlist.usuario_id,
+                        musicasIds=playlist.musicas_ids
+                    )
                 )
-            )
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.PlaylistResponse(erro=str(e))
-        finally:
-            db.close()
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.PlaylistResponse(erro=str(e))
     
     def RemoverPlaylist(self, request, context):
-        repo, db = self._get_repo()
-        try:
-            sucesso = repo.remover_playlist(request.id)
-            return streaming_pb2.RemoverPlaylistResponse(sucesso=sucesso)
-        except Exception as e:
-            context.set_code(grpc.StatusCode.INTERNAL)
-            context.set_details(str(e))
-            return streaming_pb2.RemoverPlaylistResponse(erro=str(e))
-        finally:
-            db.close()
+        with self._sessao(context) as repo:
+            try:
+                sucesso = repo.remover_playlist(request.id)
+                return streaming_pb2.RemoverPlaylistResponse(sucesso=sucesso)
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.RemoverPlaylistResponse(erro=str(e))
+
+    
+    # ========== SINCRONIZAÇÃO ==========
+    
+    def ListarMudancas(self, request, context):
+        with self._sessao(context) as repo:
+            try:
+                try:
+                    desde = decodificar_token(request.desde)
+                    # limite 0 (campo ausente) usa a página padrão; o repositório valida a faixa.
+                    # desde vazio devolve só o token atual; "0" lê o log desde o início
+                    pagina = repo.listar_mudancas(desde, request.limite or 1000)
+                except ValueError as e:
+                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                    context.set_details(str(e))
+                    return streaming_pb2.ListarMudancasResponse(erro=str(e))
+                except TokenExpirado as e:
+                    # Parte do log já foi apagada: o cliente precisa ressincronizar tudo
+                    context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                    context.set_details(str(e))
+                    return streaming_pb2.ListarMudancasResponse(erro=str(e))
+                mudancas = []
+                for m in pagina['mudancas']:
+                    mudanca = streaming_pb2.Mudanca(
+                        versao=m['versao'],
+                        entidade=m['entidade'],
+                        id=m['id'],
+                        operacao=m['operacao']
+                    )
+                    dados = m['dados']
+                    if dados is not None:
+                        if m['entidade'] == 'usuarios':
+                            mudanca.usuario.CopyFrom(streaming_pb2.Usuario(**dados))
+                        elif m['entidade'] == 'musicas':
+                            mudanca.musica.CopyFrom(streaming_pb2.Musica(**dados))
+                        else:
+                            mudanca.playlist.CopyFrom(streaming_pb2.Playlist(
+                                id=dados['id'],
+                                nome=dados['nome'],
+                                usuarioId=dados['usuario_id'],
+                                musicasIds=dados['musicas_ids']
+                            ))
+                    mudancas.append(mudanca)
+                return streaming_pb2.ListarMudancasResponse(
+                    mudancas=mudancas,
+                    token=codificar_token(pagina['token']),
+                    mais=pagina['mais']
+                )
+            except Exception as e:
+                context.set_code(grpc.StatusCode.INTERNAL)
+                context.set_details(str(e))
+                return streaming_pb2.ListarMudancasResponse(erro=str(e))
 
 
 def serve():
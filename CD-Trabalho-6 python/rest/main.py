@@ -53,12 +53,42 @@ try:
         raise FileNotFoundError(f"Arquivo não encontrado: {models_file}")
     load_module('shared.models', models_file)
     
+    # Medição das fases das requisições (sem dependências de outros módulos shared)
+    temporizacao_file = os.path.join(shared_dir, 'temporizacao.py')
+    if not os.path.exists(temporizacao_file):
+        raise FileNotFoundError(f"Arquivo não encontrado: {temporizacao_file}")
+    load_module('shared.temporizacao', temporizacao_file)
+    
+    # Cancelamento de requisições (sem dependências de outros módulos shared)
+    cancelamento_file = os.path.join(shared_dir, 'cancelamento.py')
+    if not os.path.exists(cancelamento_file):
+        raise FileNotFoundError(f"Arquivo não encontrado: {cancelamento_file}")
+    load_module('shared.cancelamento', cancelamento_file)
+    
     # Depois carrega database (depende de models)
     database_file = os.path.join(shared_dir, 'database.py')
     if not os.path.exists(database_file):
         raise FileNotFoundError(f"Arquivo não encontrado: {database_file}")
     load_module('shared.database', database_file)
     
+    # Bulkheads por classe de operação (depende de database)
+    bulkhead_file = os.path.join(shared_dir, 'bulkhead.py')
+    if not os.path.exists(bulkhead_file):
+        raise FileNotFoundError(f"Arquivo não encontrado: {bulkhead_file}")
+    load_module('shared.bulkhead', bulkhead_file)
+    
+    # Single-flight das leituras (depende de cancelamento)
+    singleflight_file = os.path.join(shared_dir, 'singleflight.py')
+    if not os.path.exists(singleflight_file):
+        raise FileNotFoundError(f"Arquivo não encontrado: {singleflight_file}")
+    load_module('shared.singleflight', singleflight_file)
+    
+    # Group commit de escritas (depende de database, bulkhead e singleflight)
+    group_commit_file = os.path.join(shared_dir, 'group_commit.py')
+    if not os.path.exists(group_commit_file):
+        raise FileNotFoundError(f"Arquivo não encontrado: {group_commit_file}")
+    load_module('shared.group_commit', group_commit_file)
+    
     # Por último carrega repository (depende de models e database)
     repository_file = os.path.join(shared_dir, 'repository.py')
     if not os.path.exists(repository_file):
@@ -72,15 +102,898 @@ except Exception as e:
     sys.exit(1)
 
 # Agora importa normalmente (os módulos já estão em sys.modules)
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import Body, FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from shared.database import get_db, init_db
-from shared.repository import Repositorio
+from typing import Any, List, Optional
+from pydantic import BaseModel, ValidationError
+import asyncio
+import contextvars
+import typing
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import logging.handlers
+import math
+import queue
+import re
+import signal
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+import anyio
+from shared.database import get_db, init_db, sessao_para, dividir_pools, engines, SessionLocal, CLASSES_OPERACAO, limite_conexoes
+from shared.repository import (
+    Repositorio, DB_MUDANCAS_LIMITE_MAXIMO, TokenExpirado, codificar_token, decodificar_token
+)
+from shared.bulkhead import BulkheadCheio, MetricasFila, metricas_bulkheads, redimensionar_bulkheads, vaga
+from shared.group_commit import coalescedor_escrita
+from shared.singleflight import leituras_compartilhadas
+from shared.cancelamento import OperacaoCancelada, TokenCancelamento, token_atual, MOTIVO_DESCONEXAO, MOTIVO_PRAZO
 from shared.models import Usuario, Musica, Playlist
+from shared.temporizacao import MedicaoRequisicao, medicao_atual, medir
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Mensagens do serviço gRPC (geradas por grpc/generate_proto.py), reaproveitadas
+# no formato application/x-protobuf; sem os arquivos gerados o formato fica indisponível
+try:
+    from google.protobuf.message import DecodeError
+    mensagens_protobuf = load_module('streaming_pb2', os.path.join(root_dir, 'grpc', 'proto', 'grpc_proto.py'))
+except Exception:
+    sys.modules.pop('streaming_pb2', None)
+    mensagens_protobuf = None
+
+
+# ========== RESPOSTA JSON ==========
+
+# Listagens grandes são serializadas direto das linhas do banco, sem passar
+# pela revalidação do response_model (que continua valendo para o OpenAPI)
+REST_JSON_RAPIDO = os.getenv('REST_JSON_RAPIDO', '1') == '1'
+
+
+def json_bytes(dados) -> bytes:
+    """Codifica dados (dicts, listas, str, números) em JSON"""
+    if orjson is not None:
+        return orjson.dumps(dados)
+    return json.dumps(dados, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(dados: bytes):
+    """Decodifica JSON (lança ValueError se inválido)"""
+    if orjson is not None:
+        return orjson.loads(dados)
+    return json.loads(dados)
+
+
+def parametro_lista(valor: Optional[str]) -> Optional[tuple]:
+    """Converte 'a,b,c' em ('a', 'b', 'c'); None se o parâmetro não foi enviado"""
+    if valor is None:
+        return None
+    return tuple(item.strip() for item in valor.split(",") if item.strip())
+
+
+# ========== NEGOCIAÇÃO DE CONTEÚDO ==========
+
+TIPO_JSON = "application/json"
+TIPO_MSGPACK = "application/msgpack"
+TIPO_PROTOBUF = "application/x-protobuf"
+# Content-Types aceitos nos corpos de criação em lote
+TIPOS_CORPO_MSGPACK = (TIPO_MSGPACK, "application/x-msgpack")
+TIPOS_CORPO_PROTOBUF = (TIPO_PROTOBUF, "application/protobuf")
+
+# Entidade -> mensagem do streaming.proto; listas usam Listar<Entidade>Response
+MENSAGENS_ENTIDADES = {'usuarios': 'Usuario', 'musicas': 'Musica', 'playlists': 'Playlist'}
+MODELOS_ENTIDADES = {Usuario: 'usuarios', Musica: 'musicas', Playlist: 'playlists'}
+# Colunas cujo nome no .proto é diferente
+CAMPOS_PROTOBUF = {'usuario_id': 'usuarioId', 'musicas_ids': 'musicasIds'}
+
+# (Content-Type, conversor para protobuf) da resposta da requisição atual
+FORMATO_JSON = (TIPO_JSON, None)
+formato_resposta: contextvars.ContextVar[tuple] = contextvars.ContextVar('formato_resposta', default=FORMATO_JSON)
+
+
+def pesos_cabecalho(valor: str) -> dict:
+    """Lê um header no formato do Accept/Accept-Encoding: {nome: q-value}"""
+    pesos = {}
+    for item in valor.split(","):
+        partes = item.strip().split(";")
+        nome = partes[0].strip().lower()
+        if not nome:
+            continue
+        peso = 1.0
+        for parametro in partes[1:]:
+            chave, _, valor_parametro = parametro.strip().partition("=")
+            if chave.strip() == "q":
+                try:
+                    peso = float(valor_parametro)
+                except ValueError:
+                    peso = 0.0
+        pesos[nome] = peso
+    return pesos
+
+
+def mensagem_entidade(entidade: str, linha: dict):
+    """Linha (dict com as colunas do repositório) -> mensagem protobuf da entidade"""
+    classe = getattr(mensagens_protobuf, MENSAGENS_ENTIDADES[entidade])
+    return classe(**{CAMPOS_PROTOBUF.get(campo, campo): valor for campo, valor in linha.items() if valor is not None})
+
+
+def mensagem_lista(entidade: str):
+    """Classe Listar<Entidade>Response, com o campo repetido `entidade`"""
+    return getattr(mensagens_protobuf, f"Listar{entidade.capitalize()}Response")
+
+
+def linha_da_mensagem(mensagem) -> dict:
+    """Mensagem protobuf -> dict com os nomes de campo do .proto"""
+    linha = {}
+    for campo in mensagem.DESCRIPTOR.fields:
+        valor = getattr(mensagem, campo.name)
+        # Campos repeated viram listas; as mensagens de entidade só têm escalares
+        linha[campo.name] = valor if isinstance(valor, (str, int, float, bytes)) else list(valor)
+    return linha
+
+
+def conversor_protobuf(modelo):
+    """Conversor dados -> mensagem para um response_model de entidade (ou List dela)"""
+    if modelo in MODELOS_ENTIDADES:
+        entidade = MODELOS_ENTIDADES[modelo]
+        return lambda dados: mensagem_entidade(entidade, dados)
+    argumentos = typing.get_args(modelo)
+    if typing.get_origin(modelo) is list and argumentos and argumentos[0] in MODELOS_ENTIDADES:
+        entidade = MODELOS_ENTIDADES[argumentos[0]]
+        return lambda dados: mensagem_lista(entidade)(**{entidade: [mensagem_entidade(entidade, linha) for linha in dados]})
+    return None
+
+
+def mensagem_protobuf(conversor):
+    """Declara o conversor protobuf de uma rota cujo corpo não é um response_model de entidade"""
+    def registrar(funcao):
+        funcao.conversor_protobuf = conversor
+        return funcao
+    return registrar
+
+
+def negociar_formato(request: Request, conversor) -> tuple:
+    """
+    Escolhe o formato da resposta pelo Accept (q-values). Curingas (*/*,
+    application/*) só selecionam JSON: os formatos binários precisam ser
+    pedidos explicitamente e, com o mesmo peso, são preferidos ao JSON.
+    """
+    accept = request.headers.get("accept")
+    if not accept:
+        return FORMATO_JSON
+    pesos = pesos_cabecalho(accept)
+    candidatos = []
+    # protobuf não representa as relações embutidas por ?include=
+    if mensagens_protobuf is not None and conversor is not None and "include" not in request.query_params:
+        candidatos.append(((pesos.get(TIPO_PROTOBUF, 0.0), 2), (TIPO_PROTOBUF, conversor)))
+    if msgpack is not None:
+        candidatos.append(((pesos.get(TIPO_MSGPACK, 0.0), 1), (TIPO_MSGPACK, None)))
+    peso_json = max(
+        pesos.get(TIPO_JSON, pesos.get("application/*", pesos.get("*/*", 0.0))),
+        # NDJSON é JSON; as listagens o tratam como pedido de streaming
+        pesos.get("application/x-ndjson", 0.0),
+    )
+    candidatos.append(((peso_json, 0), FORMATO_JSON))
+    (peso, _), formato = max(candidatos, key=lambda candidato: candidato[0])
+    if peso <= 0:
+        disponiveis = ", ".join(tipo for _, (tipo, _) in reversed(candidatos))
+        raise HTTPException(status_code=406, detail=f"Formatos disponíveis: {disponiveis}")
+    return formato
+
+
+def serializar(dados) -> tuple:
+    """Codifica dados no formato negociado; retorna (corpo, Content-Type)"""
+    tipo, conversor = formato_resposta.get()
+    # Entra na fase 'json' do Server-Timing, qualquer que seja o formato
+    with medir('json'):
+        if tipo == TIPO_MSGPACK:
+            return msgpack.packb(dados), tipo
+        if tipo == TIPO_PROTOBUF:
+            return conversor(dados).SerializeToString(), tipo
+        return json_bytes(dados), tipo
+
+
+def resposta_serializada(dados, status_code: int = 200) -> Response:
+    """Resposta com o corpo já codificado; o FastAPI não valida nem re-serializa"""
+    corpo, tipo = serializar(dados)
+    return Response(content=corpo, status_code=status_code, media_type=tipo)
+
+
+class RotaNegociada(APIRoute):
+    """Rota que negocia o formato da resposta (JSON, MessagePack ou protobuf) antes do handler"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        conversor = getattr(self.endpoint, "conversor_protobuf", None) or conversor_protobuf(self.response_model)
+        sem_corpo = self.status_code == 204
+
+        async def negociado(request: Request) -> Response:
+            formato = FORMATO_JSON if sem_corpo else negociar_formato(request, conversor)
+            anterior = formato_resposta.set(formato)
+            try:
+                resposta = await handler(request)
+            finally:
+                formato_resposta.reset(anterior)
+            resposta.headers.add_vary_header("Accept")
+            return resposta
+        return negociado
+
+
+# ========== CONTROLE DE ADMISSÃO ==========
+
+# Threads do threadpool onde rodam os handlers síncronos
+REST_THREADPOOL = int(os.getenv('REST_THREADPOOL', '40'))
+# Requisições simultâneas: nunca mais do que há de threads ou de conexões no banco
+REST_MAX_CONCORRENCIA = int(os.getenv(
+    'REST_MAX_CONCORRENCIA',
+    str(min(REST_THREADPOOL, sum(limite_conexoes(c) for c in CLASSES_OPERACAO)))
+))
+REST_FILA_MAXIMA = int(os.getenv('REST_FILA_MAXIMA', str(2 * REST_MAX_CONCORRENCIA)))
+# Tempo máximo que uma requisição pode passar na fila antes de ser descartada
+REST_ORCAMENTO_LATENCIA = float(os.getenv('REST_ORCAMENTO_LATENCIA_MS', '2000')) / 1000
+
+ROTAS_SEM_ADMISSAO = {"/metricas", "/docs", "/openapi.json"}
+
+
+class ControleAdmissao:
+    """
+    Limita a concorrência do serviço com uma fila FIFO limitada.
+
+    Uma requisição é rejeitada com 429 quando a fila está cheia e com 503 quando
+    a espera estimada (ou a real) passaria do orçamento de latência, ou do prazo
+    restante da requisição. Assim o serviço continua entregando
+    respostas úteis sob sobrecarga em vez de deixar todas estourarem o timeout.
+    """
+
+    def __init__(self, limite: int, fila_maxima: int, orcamento: float):
+        self.limite = limite
+        self.fila_maxima = fila_maxima
+        self.orcamento = orcamento
+        self.em_execucao = 0
+        self._fila = deque()
+        # Média móvel exponencial do tempo de serviço, usada para estimar a espera
+        self.tempo_servico = 0.05
+        self.admitidas = 0
+        self.concluidas = 0
+        self.rejeitadas_429 = 0
+        self.rejeitadas_503 = 0
+        self.expiradas = 0
+
+    def prazo_requisicao(self) -> float:
+        """Orçamento de espera da requisição, limitado pelo prazo dela"""
+        token = token_atual.get()
+        restante = token.tempo_restante() if token is not None else None
+        if restante is None:
+            return self.orcamento
+        return min(self.orcamento, restante)
+
+    def espera_estimada(self) -> float:
+        return (len(self._fila) + 1) / self.limite * self.tempo_servico
+
+    async def admitir(self, prazo: float):
+        """Aguarda uma vaga; retorna (status, retry_after) quando a requisição deve ser descartada"""
+        if self.em_execucao < self.limite and not self._fila:
+            self.em_execucao += 1
+            self.admitidas += 1
+            return None
+        if len(self._fila) >= self.fila_maxima:
+            self.rejeitadas_429 += 1
+            return 429, self.espera_estimada()
+        espera = self.espera_estimada()
+        if espera > prazo:
+            self.rejeitadas_503 += 1
+            return 503, espera
+        vaga = asyncio.get_running_loop().create_future()
+        self._fila.append(vaga)
+        try:
+            await asyncio.wait({vaga}, timeout=prazo)
+        except asyncio.CancelledError:
+            # Cliente desconectou (ou a tarefa foi cancelada) ainda na fila
+            if vaga.done() and not vaga.cancelled():
+                # A vaga já tinha sido repassada para esta requisição: devolve
+                self._repassar()
+            else:
+                vaga.cancel()
+                self._fila.remove(vaga)
+            raise
+        if not vaga.done():
+            vaga.cancel()
+            self._fila.remove(vaga)
+            self.expiradas += 1
+            return 503, self.espera_estimada()
+        self.admitidas += 1
+        return None
+
+    def liberar(self, duracao: float):
+        """Registra o tempo de serviço e repassa a vaga para o próximo da fila"""
+        self.concluidas += 1
+        self.tempo_servico = 0.8 * self.tempo_servico + 0.2 * duracao
+        self._repassar()
+
+    def _repassar(self):
+        """Entrega a vaga ao próximo da fila ainda esperando, ou a libera"""
+        while self._fila:
+            vaga = self._fila.popleft()
+            if not vaga.cancelled():
+                vaga.set_result(None)
+                return
+        self.em_execucao -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "limite": self.limite,
+            "fila_maxima": self.fila_maxima,
+            "orcamento_ms": round(self.orcamento * 1000, 3),
+            "em_execucao": self.em_execucao,
+            "na_fila": len(self._fila),
+            "admitidas": self.admitidas,
+            "concluidas": self.concluidas,
+            "rejeitadas_429": self.rejeitadas_429,
+            "rejeitadas_503": self.rejeitadas_503,
+            "expiradas_na_fila": self.expiradas,
+            "tempo_servico_ms": round(self.tempo_servico * 1000, 3),
+        }
+
+
+controle_admissao = ControleAdmissao(REST_MAX_CONCORRENCIA, REST_FILA_MAXIMA, REST_ORCAMENTO_LATENCIA)
+
+
+class AdmissaoMiddleware:
+    """Middleware ASGI que aplica o controle de admissão antes de qualquer handler"""
+
+    def __init__(self, app, controle: ControleAdmissao):
+        self.app = app
+        self.controle = controle
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ROTAS_SEM_ADMISSAO:
+            await self.app(scope, receive, send)
+            return
+
+        rejeicao = await self.controle.admitir(self.controle.prazo_requisicao())
+        if rejeicao is not None:
+            status, espera = rejeicao
+            resposta = JSONResponse(
+                {"detail": "Serviço sobrecarregado, tente novamente mais tarde"},
+                status_code=status,
+                headers={"Retry-After": str(max(1, math.ceil(espera)))}
+            )
+            await resposta(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        try:
+            token = token_atual.get()
+            if token is not None and token.motivo == MOTIVO_DESCONEXAO:
+                # O cliente desistiu enquanto estava na fila
+                return
+            await self.app(scope, receive, send)
+        finally:
+            self.controle.liberar(time.perf_counter() - inicio)
+
+
+# ========== CANCELAMENTO ==========
+
+# Prazo padrão das requisições; o cliente pode pedir um menor em X-Timeout-Ms
+REST_PRAZO_REQUISICAO = float(os.getenv('REST_PRAZO_REQUISICAO_MS', '30000')) / 1000
+
+
+class CancelamentoMiddleware:
+    """
+    Cria um TokenCancelamento por requisição e o cancela quando o cliente
+    desconecta ou o prazo expira, interrompendo as queries em andamento.
+
+    O receive original é consumido por uma tarefa própria, que repassa as
+    mensagens ao app e percebe o http.disconnect mesmo enquanto o handler
+    síncrono está ocupado no threadpool. A fila entre os dois guarda uma
+    mensagem só: a tarefa não lê o próximo pedaço do corpo antes de o app
+    consumir o anterior, preservando o backpressure dos uploads lidos aos
+    poucos (/bulk). Depois do corpo, a próxima mensagem só pode ser o
+    disconnect, que cancela o token antes mesmo de entrar na fila.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _prazo(scope) -> float:
+        for nome, valor in scope.get("headers", []):
+            if nome == b"x-timeout-ms":
+                try:
+                    return min(REST_PRAZO_REQUISICAO, float(valor) / 1000)
+                except ValueError:
+                    break
+        return REST_PRAZO_REQUISICAO
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ROTAS_SEM_ADMISSAO:
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        prazo = self._prazo(scope)
+        token = TokenCancelamento(prazo)
+        mensagens = asyncio.Queue(maxsize=1)
+
+        def cancelar(motivo):
+            # O cancelamento abre uma conexão com o servidor; não bloqueia o event loop
+            loop.run_in_executor(None, token.cancelar, motivo)
+
+        async def bombear():
+            while True:
+                mensagem = await receive()
+                if mensagem["type"] == "http.disconnect":
+                    # Cancela já: a fila pode estar ocupada por um corpo que o app não leu
+                    cancelar(MOTIVO_DESCONEXAO)
+                    await mensagens.put(mensagem)
+                    return
+                await mensagens.put(mensagem)
+
+        async def receber():
+            if mensagens.empty() and token.motivo == MOTIVO_DESCONEXAO:
+                return {"type": "http.disconnect"}
+            return await mensagens.get()
+
+        substituida = False
+
+        async def enviar(mensagem):
+            nonlocal substituida
+            if substituida or token.motivo == MOTIVO_DESCONEXAO:
+                return
+            if mensagem["type"] == "http.response.start" and mensagem["status"] >= 500 and token.cancelado:
+                # O handler falhou porque o prazo expirou: responde 504 em vez do erro genérico
+                substituida = True
+                resposta = JSONResponse({"detail": "Prazo da requisição expirado"}, status_code=504)
+                await resposta(scope, receber, send)
+                return
+            await send(mensagem)
+
+        bomba = asyncio.ensure_future(bombear())
+        temporizador = loop.call_later(prazo, cancelar, MOTIVO_PRAZO)
+        anterior = token_atual.set(token)
+        try:
+            await self.app(scope, receber, enviar)
+        finally:
+            token_atual.reset(anterior)
+            temporizador.cancel()
+            bomba.cancel()
+
+
+# ========== STREAMING ==========
+
+# Formatos de listagem em streaming: uma linha JSON por registro, ou um array
+# JSON enviado em partes conforme as linhas chegam do cursor no servidor
+FORMATOS_STREAM = {
+    'ndjson': 'application/x-ndjson',
+    'array': 'application/json',
+}
+
+
+def formato_stream(request: Request, stream: Optional[str]) -> Optional[str]:
+    """Formato de streaming pedido via ?stream= ou Accept: application/x-ndjson"""
+    if stream is not None:
+        if stream not in FORMATOS_STREAM:
+            raise HTTPException(status_code=400, detail=f"stream deve ser um de: {', '.join(FORMATOS_STREAM)}")
+        return stream
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return 'ndjson'
+    return None
+
+
+def _codificar_lote(linhas: List[dict], formato: str, primeiro: bool) -> bytes:
+    with medir('json'):
+        if formato == 'ndjson':
+            return b"".join(json_bytes(linha) + b"\n" for linha in linhas)
+        corpo = b",".join(json_bytes(linha) for linha in linhas)
+    if not primeiro and corpo:
+        corpo = b"," + corpo
+    return corpo
+
+
+def resposta_stream(entidade: str, formato: str, campos: Optional[tuple] = None,
+                    incluir: tuple = ()) -> StreamingResponse:
+    """
+    Transmite uma listagem lote a lote. Roda no threadpool: o primeiro lote é
+    lido aqui mesmo, para que erros (bulkhead cheio, banco fora) ainda virem
+    um status HTTP; os demais são lidos sob demanda enquanto o corpo é enviado.
+    """
+    db = sessao_para('scan')
+    lotes = Repositorio(db).iterar_linhas(entidade, campos, incluir)
+
+    def fechar():
+        lotes.close()
+        db.close()
+
+    try:
+        primeiro_lote = next(lotes, [])
+    except Exception:
+        fechar()
+        raise
+
+    async def corpo():
+        try:
+            if formato == 'array':
+                yield b"["
+            yield _codificar_lote(primeiro_lote, formato, True)
+            vazio = not primeiro_lote
+            while True:
+                lote = await anyio.to_thread.run_sync(next, lotes, None)
+                if lote is None:
+                    break
+                yield _codificar_lote(lote, formato, vazio)
+                vazio = vazio and not lote
+            if formato == 'array':
+                yield b"]"
+        finally:
+            # Fecha o cursor mesmo se o cliente desconectou no meio do stream
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(fechar)
+
+    return StreamingResponse(corpo(), media_type=FORMATOS_STREAM[formato])
+
+
+# ========== COMPRESSÃO ==========
+
+REST_COMPRESSAO = os.getenv('REST_COMPRESSAO', '1') == '1'
+# Corpos menores que isso não compensam o custo de comprimir
+REST_COMPRESSAO_MINIMO = int(os.getenv('REST_COMPRESSAO_MINIMO', '1024'))
+NIVEIS_COMPRESSAO = {
+    'gzip': int(os.getenv('REST_COMPRESSAO_NIVEL_GZIP', '6')),
+    'br': int(os.getenv('REST_COMPRESSAO_NIVEL_BR', '5')),
+    'zstd': int(os.getenv('REST_COMPRESSAO_NIVEL_ZSTD', '3')),
+}
+REST_COMPRESSAO_CACHE_BYTES = int(float(os.getenv('REST_COMPRESSAO_CACHE_MB', '64')) * 1024 * 1024)
+TIPOS_COMPRESSIVEIS = ("application/json", "application/x-ndjson", "application/xml", "text/",
+                       "application/msgpack", "application/x-protobuf")
+
+
+def _comprimir_gzip(corpo: bytes, nivel: int) -> bytes:
+    # mtime fixo para que o mesmo corpo gere sempre os mesmos bytes
+    return gzip.compress(corpo, compresslevel=nivel, mtime=0)
+
+
+# Em ordem de preferência do servidor quando o cliente aceita mais de um
+COMPRESSORES = OrderedDict()
+if zstandard is not None:
+    COMPRESSORES['zstd'] = lambda corpo, nivel: zstandard.ZstdCompressor(level=nivel).compress(corpo)
+if brotli is not None:
+    COMPRESSORES['br'] = lambda corpo, nivel: brotli.compress(corpo, quality=nivel)
+COMPRESSORES['gzip'] = _comprimir_gzip
+
+
+def escolher_codificacao(accept_encoding: str):
+    """Escolhe a codificação pelo Accept-Encoding (q-values) entre as disponíveis"""
+    pesos = pesos_cabecalho(accept_encoding)
+    melhor, melhor_peso = None, 0.0
+    for nome in COMPRESSORES:
+        peso = pesos.get(nome, pesos.get("*", 0.0))
+        if peso > melhor_peso:
+            melhor, melhor_peso = nome, peso
+    return melhor
+
+
+class CacheCompressao:
+    """LRU de corpos comprimidos, indexado pelo digest do corpo original"""
+
+    def __init__(self, orcamento_bytes: int):
+        self.orcamento_bytes = orcamento_bytes
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()
+        self._bytes = 0
+        self.acertos = 0
+        self.faltas = 0
+        self.bytes_originais = 0
+        self.bytes_enviados = 0
+
+    def comprimir(self, corpo: bytes, codificacao: str) -> bytes:
+        nivel = NIVEIS_COMPRESSAO[codificacao]
+        chave = (hashlib.blake2b(corpo, digest_size=16).digest(), codificacao, nivel)
+        with self._lock:
+            comprimido = self._itens.get(chave)
+            if comprimido is not None:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+        if comprimido is None:
+            comprimido = COMPRESSORES[codificacao](corpo, nivel)
+            with self._lock:
+                self.faltas += 1
+                if len(comprimido) <= self.orcamento_bytes and chave not in self._itens:
+                    self._itens[chave] = comprimido
+                    self._bytes += len(comprimido)
+                    while self._bytes > self.orcamento_bytes:
+                        _, removido = self._itens.popitem(last=False)
+                        self._bytes -= len(removido)
+        with self._lock:
+            self.bytes_originais += len(corpo)
+            self.bytes_enviados += len(comprimido)
+        return comprimido
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                'codificacoes': list(COMPRESSORES),
+                'acertos_cache': self.acertos,
+                'faltas_cache': self.faltas,
+                'itens_cache': len(self._itens),
+                'bytes_cache': self._bytes,
+                'bytes_originais': self.bytes_originais,
+                'bytes_enviados': self.bytes_enviados,
+            }
+
+
+cache_compressao = CacheCompressao(REST_COMPRESSAO_CACHE_BYTES)
+
+
+class CompressaoMiddleware:
+    """
+    Comprime respostas não-streaming conforme o Accept-Encoding do cliente.
+
+    O corpo é acumulado até a última parte; respostas em streaming (mais de uma
+    parte) passam sem compressão. A compressão roda no threadpool para não
+    bloquear o event loop.
+    """
+
+    def __init__(self, app, cache: CacheCompressao):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not REST_COMPRESSAO:
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for nome, valor in scope.get("headers", []):
+            if nome == b"accept-encoding":
+                accept_encoding = valor.decode("latin-1")
+                break
+        codificacao = escolher_codificacao(accept_encoding)
+
+        inicio = None
+        streaming = False
+
+        async def enviar(mensagem):
+            nonlocal inicio, streaming
+            if mensagem["type"] == "http.response.start":
+                inicio = mensagem
+                return
+            if mensagem["type"] != "http.response.body" or streaming:
+                await send(mensagem)
+                return
+            if mensagem.get("more_body", False):
+                # Streaming: repassa sem comprimir
+                streaming = True
+                await send(inicio)
+                await send(mensagem)
+                return
+            await self._enviar_completo(inicio, mensagem.get("body", b""), codificacao, send)
+
+        await self.app(scope, receive, enviar)
+
+    async def _enviar_completo(self, inicio, corpo: bytes, codificacao, send):
+        headers = [(nome, valor) for nome, valor in inicio.get("headers", [])]
+        tipo = b""
+        ja_codificado = False
+        vary = False
+        for nome, valor in headers:
+            if nome == b"content-type":
+                tipo = valor
+            elif nome == b"content-encoding":
+                ja_codificado = True
+            elif nome == b"vary" and b"accept-encoding" in valor.lower():
+                vary = True
+        compressivel = not ja_codificado and tipo.decode("latin-1").startswith(TIPOS_COMPRESSIVEIS)
+        if compressivel and not vary:
+            headers.append((b"vary", b"Accept-Encoding"))
+        if compressivel and codificacao is not None and len(corpo) >= REST_COMPRESSAO_MINIMO:
+            with medir('compressao'):
+                corpo = await anyio.to_thread.run_sync(self.cache.comprimir, corpo, codificacao)
+            headers = [(nome, valor) for nome, valor in headers if nome != b"content-length"]
+            headers.append((b"content-encoding", codificacao.encode("latin-1")))
+            headers.append((b"content-length", str(len(corpo)).encode("latin-1")))
+        await send({**inicio, "headers": headers})
+        await send({"type": "http.response.body", "body": corpo})
+
+
+# ========== SERVER-TIMING ==========
+
+REST_SERVER_TIMING = os.getenv('REST_SERVER_TIMING', '1') == '1'
+# Arquivo para o log de depuração (uma linha JSON por requisição); vazio desliga
+REST_SERVER_TIMING_LOG = os.getenv('REST_SERVER_TIMING_LOG', '')
+
+_lock_log_timing = threading.Lock()
+# Listener (thread com o arquivo aberto) e o pid do processo que o criou: os
+# workers do pre-fork criam o seu na primeira requisição
+_log_timing = None
+
+
+def logger_server_timing() -> logging.Logger:
+    """
+    Logger do log de depuração. As linhas entram em uma fila (sem I/O no event
+    loop) e uma thread as grava no arquivo, aberto uma única vez.
+    """
+    global _log_timing
+    logger = logging.getLogger('rest.server_timing')
+    if _log_timing is not None and _log_timing[1] == os.getpid():
+        return logger
+    with _lock_log_timing:
+        if _log_timing is None or _log_timing[1] != os.getpid():
+            fila = queue.SimpleQueue()
+            arquivo = logging.FileHandler(REST_SERVER_TIMING_LOG, encoding="utf-8")
+            arquivo.setFormatter(logging.Formatter("%(message)s"))
+            listener = logging.handlers.QueueListener(fila, arquivo)
+            listener.start()
+            logger.handlers = [logging.handlers.QueueHandler(fila)]
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            _log_timing = (listener, os.getpid())
+    return logger
+
+
+def parar_log_server_timing():
+    """Grava as linhas pendentes e fecha o arquivo"""
+    global _log_timing
+    with _lock_log_timing:
+        if _log_timing is not None and _log_timing[1] == os.getpid():
+            _log_timing[0].stop()
+            for handler in _log_timing[0].handlers:
+                handler.close()
+            _log_timing = None
+
+
+class RotaMedida(RotaNegociada):
+    """Rota que marca quando o handler retornou, para separar a validação do response_model"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        endpoint = self.dependant.call
+
+        def marcar_fim():
+            medicao = medicao_atual.get()
+            if medicao is not None:
+                medicao.fim_handler = time.perf_counter()
+
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def medido(*args, **kwargs):
+                try:
+                    return await endpoint(*args, **kwargs)
+                finally:
+                    marcar_fim()
+        else:
+            @functools.wraps(endpoint)
+            def medido(*args, **kwargs):
+                try:
+                    return endpoint(*args, **kwargs)
+                finally:
+                    marcar_fim()
+        self.dependant.call = medido
+
+
+class RespostaMedida(JSONResponse):
+    """
+    Resposta padrão das rotas: codifica no formato negociado e mede a
+    validação (response_model) e a codificação
+    """
+
+    def render(self, content) -> bytes:
+        medicao = medicao_atual.get()
+        if medicao is not None and medicao.fim_handler is not None:
+            medicao.adicionar('validacao', time.perf_counter() - medicao.fim_handler)
+            medicao.fim_handler = None
+        if formato_resposta.get()[0] != TIPO_JSON:
+            corpo, self.media_type = serializar(content)
+            return corpo
+        with medir('json'):
+            return super().render(content)
 
-app = FastAPI(title="Streaming de Músicas - REST API", version="1.0.0")
+
+class ServerTimingMiddleware:
+    """
+    Mede as fases de cada requisição e as devolve no header Server-Timing
+    (fila do bulkhead, espera no pool, SQL, ORM, validação, JSON, compressão).
+    O tamanho do corpo vai no header quando já é conhecido (Content-Length);
+    o log de depuração registra os bytes efetivamente enviados.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not REST_SERVER_TIMING:
+            await self.app(scope, receive, send)
+            return
+
+        medicao = MedicaoRequisicao()
+        inicio = time.perf_counter()
+        status = None
+        bytes_enviados = 0
+
+        async def enviar(mensagem):
+            nonlocal status, bytes_enviados
+            if mensagem["type"] == "http.response.start":
+                status = mensagem["status"]
+                headers = list(mensagem.get("headers", []))
+                tamanho = next((v.decode("latin-1") for n, v in headers if n == b"content-length"), None)
+                valor = self._server_timing(medicao.snapshot(), time.perf_counter() - inicio, tamanho)
+                headers.append((b"server-timing", valor.encode("latin-1")))
+                mensagem = {**mensagem, "headers": headers}
+            elif mensagem["type"] == "http.response.body":
+                bytes_enviados += len(mensagem.get("body", b""))
+            await send(mensagem)
+
+        anterior = medicao_atual.set(medicao)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            medicao_atual.reset(anterior)
+            if REST_SERVER_TIMING_LOG:
+                self._registrar(scope, status, medicao.snapshot(), time.perf_counter() - inicio, bytes_enviados)
+
+    @staticmethod
+    def _server_timing(medidas: dict, total: float, tamanho: Optional[str]) -> str:
+        itens = []
+        for fase, duracao in medidas["fases_ms"].items():
+            item = f"{fase};dur={duracao}"
+            if fase == "sql":
+                item += f';desc="{medidas["statements"]} statements, {medidas["linhas"]} linhas"'
+            itens.append(item)
+        itens.append(f"total;dur={round(total * 1000, 3)}")
+        if tamanho is not None:
+            itens.append(f'bytes;desc="{tamanho}"')
+        return ", ".join(itens)
+
+    @staticmethod
+    def _registrar(scope, status, medidas: dict, total: float, bytes_enviados: int):
+        registro = {
+            "metodo": scope["method"],
+            "caminho": scope["path"],
+            "status": status,
+            "total_ms": round(total * 1000, 3),
+            **medidas,
+            "bytes": bytes_enviados,
+        }
+        logger_server_timing().info(json_bytes(registro).decode("utf-8"))
+
+
+app = FastAPI(title="Streaming de Músicas - REST API", version="1.0.0", default_response_class=RespostaMedida)
+app.router.route_class = RotaMedida
+
+# Controle de admissão (registrado antes do CORS para que as rejeições também tenham os headers de CORS)
+app.add_middleware(AdmissaoMiddleware, controle=controle_admissao)
+# Cancelamento por desconexão/prazo (envolve a admissão, para que o prazo conte o tempo na fila)
+app.add_middleware(CancelamentoMiddleware)
+# Compressão por fora do cancelamento: nada é comprimido para um cliente que já desconectou
+app.add_middleware(CompressaoMiddleware, cache=cache_compressao)
+# Server-Timing por fora da compressão, para medir também o tempo dela e os bytes enviados
+app.add_middleware(ServerTimingMiddleware)
 
 # CORS
 app.add_middleware(
@@ -91,10 +1004,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Com vários workers as tabelas são criadas uma única vez, no processo pai
+INICIALIZAR_BANCO = True
+
+
 # Inicializa o banco de dados na primeira execução
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = REST_THREADPOOL
+    if INICIALIZAR_BANCO:
+        init_db()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    parar_log_server_timing()
 
 
 def get_repositorio(db: Session = Depends(get_db)) -> Repositorio:
@@ -102,11 +1026,72 @@ def get_repositorio(db: Session = Depends(get_db)) -> Repositorio:
     return Repositorio(db)
 
 
+# ========== BULKHEADS ==========
+
+# Threads do threadpool reservadas para cada classe de operação. A soma não deve
+# passar de REST_THREADPOOL, para que listagens lentas não ocupem as threads das
+# leituras pontuais enquanto aguardam uma conexão.
+LIMITES_REST = {
+    'scan': int(os.getenv('REST_WORKERS_SCAN', '8')),
+    'point': int(os.getenv('REST_WORKERS_POINT', '24')),
+    'write': int(os.getenv('REST_WORKERS_WRITE', '8')),
+}
+REST_BULKHEAD_TIMEOUT = float(os.getenv('REST_BULKHEAD_TIMEOUT', '10'))
+
+_semaforos_rest = {classe: asyncio.Semaphore(limite) for classe, limite in LIMITES_REST.items()}
+_metricas_rest = {classe: MetricasFila(limite) for classe, limite in LIMITES_REST.items()}
+
+
+def limitar_classe(classe: str):
+    """Cria uma dependency que aguarda (no event loop) uma vaga da classe de operação"""
+    async def dependencia():
+        semaforo = _semaforos_rest[classe]
+        metricas = _metricas_rest[classe]
+        inicio = time.perf_counter()
+        metricas.entrou_na_fila()
+        try:
+            await asyncio.wait_for(semaforo.acquire(), timeout=REST_BULKHEAD_TIMEOUT)
+        except asyncio.TimeoutError:
+            metricas.saiu_da_fila(time.perf_counter() - inicio, admitida=False)
+            raise HTTPException(
+                status_code=503,
+                detail=f"Capacidade esgotada para operações '{classe}'",
+                headers={"Retry-After": "1"}
+            )
+        metricas.saiu_da_fila(time.perf_counter() - inicio, admitida=True)
+        try:
+            yield
+        finally:
+            metricas.liberou()
+            semaforo.release()
+    return dependencia
+
+
+bulkhead_scan = Depends(limitar_classe('scan'))
+bulkhead_point = Depends(limitar_classe('point'))
+bulkhead_write = Depends(limitar_classe('write'))
+
+
+@app.get("/metricas")
+def metricas():
+    """Métricas do controle de admissão, dos bulkheads, do single-flight e do group commit"""
+    return {
+        "pid": os.getpid(),
+        "admissao": controle_admissao.snapshot(),
+        "bulkheads": {
+            "rest": {classe: m.snapshot() for classe, m in _metricas_rest.items()},
+            "banco": metricas_bulkheads(),
+        },
+        "single_flight": leituras_compartilhadas.metricas(),
+        "group_commit": coalescedor_escrita.metricas(),
+        "compressao": cache_compressao.metricas(),
+    }
+
 
 
 # ========== USUÁRIOS ==========
 
-@app.post("/api/usuarios", response_model=Usuario, status_code=201)
+@app.post("/api/usuarios", response_model=Usuario, status_code=201, dependencies=[bulkhead_write])
 def criar_usuario(usuario: Usuario, repo: Repositorio = Depends(get_repositorio)):
     """Cria um novo usuário"""
     try:
@@ -115,27 +1100,42 @@ def criar_usuario(usuario: Usuario, repo: Repositorio = Depends(get_repositorio)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/usuarios", response_model=List[Usuario])
-def listar_usuarios(repo: Repositorio = Depends(get_repositorio)):
+@app.get("/api/usuarios", response_model=List[Usuario], dependencies=[bulkhead_scan])
+def listar_usuarios(request: Request, stream: Optional[str] = None, fields: Optional[str] = None, repo: Repositorio = Depends(get_repositorio)):
     """Lista todos os usuários"""
+    formato = formato_stream(request, stream)
+    campos = parametro_lista(fields)
     try:
+        if formato is not None:
+            return resposta_stream('usuarios', formato, campos)
+        if REST_JSON_RAPIDO or campos is not None:
+            return resposta_serializada(repo.listar_linhas('usuarios', campos))
         return repo.listar_usuarios()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Erro ao listar usuários: {str(e)}")
 
 
-@app.get("/api/usuarios/{id}", response_model=Usuario)
-def obter_usuario(id: str, repo: Repositorio = Depends(get_repositorio)):
+@app.get("/api/usuarios/{id}", response_model=Usuario, dependencies=[bulkhead_point])
+def obter_usuario(id: str, fields: Optional[str] = None, repo: Repositorio = Depends(get_repositorio)):
     """Obtém um usuário por ID"""
-    usuario = repo.obter_usuario(id)
+    campos = parametro_lista(fields)
+    if campos is None:
+        usuario = repo.obter_usuario(id)
+    else:
+        try:
+            usuario = repo.obter_linha('usuarios', id, campos)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     if not usuario:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
-    return usuario
+    return usuario if campos is None else resposta_serializada(usuario)
 
 
-@app.put("/api/usuarios/{id}", response_model=Usuario)
+@app.put("/api/usuarios/{id}", response_model=Usuario, dependencies=[bulkhead_write])
 def atualizar_usuario(id: str, dados: dict, repo: Repositorio = Depends(get_repositorio)):
     """Atualiza um usuário"""
     usuario = repo.atualizar_usuario(id, dados)
@@ -144,7 +1144,7 @@ def atualizar_usuario(id: str, dados: dict, repo: Repositorio = Depends(get_repo
     return usuario
 
 
-@app.delete("/api/usuarios/{id}", status_code=204)
+@app.delete("/api/usuarios/{id}", status_code=204, dependencies=[bulkhead_write])
 def remover_usuario(id: str, repo: Repositorio = Depends(get_repositorio)):
     """Remove um usuário"""
     if not repo.remover_usuario(id):
@@ -153,7 +1153,7 @@ def remover_usuario(id: str, repo: Repositorio = Depends(get_repositorio)):
 
 # ========== MÚSICAS ==========
 
-@app.post("/api/musicas", response_model=Musica, status_code=201)
+@app.post("/api/musicas", response_model=Musica, status_code=201, dependencies=[bulkhead_write])
 def criar_musica(musica: Musica, repo: Repositorio = Depends(get_repositorio)):
     """Cria uma nova música"""
     try:
@@ -162,25 +1162,40 @@ def criar_musica(musica: Musica, repo: Repositorio = Depends(get_repositorio)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/musicas", response_model=List[Musica])
-def listar_musicas(repo: Repositorio = Depends(get_repositorio)):
+@app.get("/api/musicas", response_model=List[Musica], dependencies=[bulkhead_scan])
+def listar_musicas(request: Request, stream: Optional[str] = None, fields: Optional[str] = None, repo: Repositorio = Depends(get_repositorio)):
     """Lista todas as músicas"""
+    formato = formato_stream(request, stream)
+    campos = parametro_lista(fields)
     try:
+        if formato is not None:
+            return resposta_stream('musicas', formato, campos)
+        if REST_JSON_RAPIDO or campos is not None:
+            return resposta_serializada(repo.listar_linhas('musicas', campos))
         return repo.listar_musicas()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/musicas/{id}", response_model=Musica)
-def obter_musica(id: str, repo: Repositorio = Depends(get_repositorio)):
+@app.get("/api/musicas/{id}", response_model=Musica, dependencies=[bulkhead_point])
+def obter_musica(id: str, fields: Optional[str] = None, repo: Repositorio = Depends(get_repositorio)):
     """Obtém uma música por ID"""
-    musica = repo.obter_musica(id)
+    campos = parametro_lista(fields)
+    if campos is None:
+        musica = repo.obter_musica(id)
+    else:
+        try:
+            musica = repo.obter_linha('musicas', id, campos)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     if not musica:
         raise HTTPException(status_code=404, detail="Música não encontrada")
-    return musica
+    return musica if campos is None else resposta_serializada(musica)
 
 
-@app.put("/api/musicas/{id}", response_model=Musica)
+@app.put("/api/musicas/{id}", response_model=Musica, dependencies=[bulkhead_write])
 def atualizar_musica(id: str, dados: dict, repo: Repositorio = Depends(get_repositorio)):
     """Atualiza uma música"""
     musica = repo.atualizar_musica(id, dados)
@@ -189,7 +1204,7 @@ def atualizar_musica(id: str, dados: dict, repo: Repositorio = Depends(get_repos
     return musica
 
 
-@app.delete("/api/musicas/{id}", status_code=204)
+@app.delete("/api/musicas/{id}", status_code=204, dependencies=[bulkhead_write])
 def remover_musica(id: str, repo: Repositorio = Depends(get_repositorio)):
     """Remove uma música"""
     if not repo.remover_musica(id):
@@ -198,30 +1213,33 @@ def remover_musica(id: str, repo: Repositorio = Depends(get_repositorio)):
 
 # ========== PLAYLISTS ==========
 
-@app.post("/api/playlists", response_model=Playlist, status_code=201)
-async def criar_playlist(request: Request, repo: Repositorio = Depends(get_repositorio)):
+def playlist_do_corpo(body: dict) -> Playlist:
+    """Monta a Playlist a partir do body de criação (aceita camelCase e snake_case)"""
+    # Extrai e valida campos do body
+    nome = body.get("nome")
+    usuario_id = body.get("usuarioId") or body.get("usuario_id")
+    musicas_ids = body.get("musicasIds") or body.get("musicas_ids") or []
+    
+    # Validação manual
+    if not nome:
+        raise HTTPException(status_code=400, detail="nome é obrigatório")
+    if not usuario_id:
+        raise HTTPException(status_code=400, detail="usuarioId é obrigatório")
+    
+    return Playlist(
+        nome=nome,
+        usuario_id=usuario_id,
+        musicas_ids=musicas_ids
+    )
+
+
+@app.post("/api/playlists", response_model=Playlist, status_code=201, dependencies=[bulkhead_write])
+def criar_playlist(body: dict = Body(...), repo: Repositorio = Depends(get_repositorio)):
     """Cria uma nova playlist"""
+    # Handler síncrono: a espera pela vaga de escrita e pelo group commit
+    # acontece no threadpool, e não no event loop
     try:
-        # Pega o body da requisição
-        body = await request.json()
-        
-        # Extrai e valida campos do body
-        nome = body.get("nome")
-        usuario_id = body.get("usuarioId") or body.get("usuario_id")
-        musicas_ids = body.get("musicasIds") or body.get("musicas_ids") or []
-        
-        # Validação manual
-        if not nome:
-            raise HTTPException(status_code=400, detail="nome é obrigatório")
-        if not usuario_id:
-            raise HTTPException(status_code=400, detail="usuarioId é obrigatório")
-        
-        # Cria objeto Playlist
-        playlist = Playlist(
-            nome=nome,
-            usuario_id=usuario_id,
-            musicas_ids=musicas_ids
-        )
+        playlist = playlist_do_corpo(body)
         
         # Chama o repositório
         resultado = repo.criar_playlist(playlist)
@@ -237,27 +1255,44 @@ async def criar_playlist(request: Request, repo: Repositorio = Depends(get_repos
         raise HTTPException(status_code=500, detail=f"Erro ao criar playlist: {str(e)}")
 
 
-@app.get("/api/playlists", response_model=List[Playlist])
-def listar_playlists(repo: Repositorio = Depends(get_repositorio)):
+@app.get("/api/playlists", response_model=List[Playlist], dependencies=[bulkhead_scan])
+def listar_playlists(request: Request, stream: Optional[str] = None, fields: Optional[str] = None, include: Optional[str] = None, repo: Repositorio = Depends(get_repositorio)):
     """Lista todas as playlists"""
+    formato = formato_stream(request, stream)
+    campos = parametro_lista(fields)
+    incluir = parametro_lista(include) or ()
     try:
+        if formato is not None:
+            return resposta_stream('playlists', formato, campos, incluir)
+        if REST_JSON_RAPIDO or campos is not None or incluir:
+            return resposta_serializada(repo.listar_linhas('playlists', campos, incluir))
         return repo.listar_playlists()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Erro ao listar playlists: {str(e)}")
 
 
-@app.get("/api/playlists/{id}", response_model=Playlist)
-def obter_playlist(id: str, repo: Repositorio = Depends(get_repositorio)):
+@app.get("/api/playlists/{id}", response_model=Playlist, dependencies=[bulkhead_point])
+def obter_playlist(id: str, fields: Optional[str] = None, include: Optional[str] = None, repo: Repositorio = Depends(get_repositorio)):
     """Obtém uma playlist por ID"""
-    playlist = repo.obter_playlist(id)
+    campos = parametro_lista(fields)
+    incluir = parametro_lista(include) or ()
+    if campos is None and not incluir:
+        playlist = repo.obter_playlist(id)
+    else:
+        try:
+            playlist = repo.obter_linha('playlists', id, campos, incluir)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     if not playlist:
         raise HTTPException(status_code=404, detail="Playlist não encontrada")
-    return playlist
+    return playlist if campos is None and not incluir else resposta_serializada(playlist)
 
 
-@app.get("/api/usuarios/{usuario_id}/playlists", response_model=List[Playlist])
+@app.get("/api/usuarios/{usuario_id}/playlists", response_model=List[Playlist], dependencies=[bulkhead_point])
 def listar_playlists_por_usuario(usuario_id: str, repo: Repositorio = Depends(get_repositorio)):
     """Lista playlists de um usuário"""
     try:
@@ -266,7 +1301,7 @@ def listar_playlists_por_usuario(usuario_id: str, repo: Repositorio = Depends(ge
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/playlists/{id}/musicas", response_model=List[Musica])
+@app.get("/api/playlists/{id}/musicas", response_model=List[Musica], dependencies=[bulkhead_point])
 def listar_musicas_por_playlist(id: str, repo: Repositorio = Depends(get_repositorio)):
     """Lista músicas de uma playlist"""
     try:
@@ -275,7 +1310,7 @@ def listar_musicas_por_playlist(id: str, repo: Repositorio = Depends(get_reposit
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/musicas/{musica_id}/playlists", response_model=List[Playlist])
+@app.get("/api/musicas/{musica_id}/playlists", response_model=List[Playlist], dependencies=[bulkhead_point])
 def listar_playlists_por_musica(musica_id: str, repo: Repositorio = Depends(get_repositorio)):
     """Lista playlists que contêm uma música"""
     try:
@@ -284,7 +1319,7 @@ def listar_playlists_por_musica(musica_id: str, repo: Repositorio = Depends(get_
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.put("/api/playlists/{id}", response_model=Playlist)
+@app.put("/api/playlists/{id}", response_model=Playlist, dependencies=[bulkhead_write])
 def atualizar_playlist(id: str, dados: dict, repo: Repositorio = Depends(get_repositorio)):
     """Atualiza uma playlist"""
     try:
@@ -296,7 +1331,7 @@ def atualizar_playlist(id: str, dados: dict, repo: Repositorio = Depends(get_rep
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/api/playlists/{id}/musicas", response_model=Playlist)
+@app.post("/api/playlists/{id}/musicas", response_model=Playlist, dependencies=[bulkhead_write])
 def adicionar_musica_a_playlist(id: str, body: dict, repo: Repositorio = Depends(get_repositorio)):
     """Adiciona uma música a uma playlist"""
     try:
@@ -311,7 +1346,7 @@ def adicionar_musica_a_playlist(id: str, body: dict, repo: Repositorio = Depends
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.delete("/api/playlists/{id}/musicas/{musica_id}", response_model=Playlist)
+@app.delete("/api/playlists/{id}/musicas/{musica_id}", response_model=Playlist, dependencies=[bulkhead_write])
 def remover_musica_de_playlist(id: str, musica_id: str, repo: Repositorio = Depends(get_repositorio)):
     """Remove uma música de uma playlist"""
     playlist = repo.remover_musica_de_playlist(id, musica_id)
@@ -320,14 +1355,541 @@ def remover_musica_de_playlist(id: str, musica_id: str, repo: Repositorio = Depe
     return playlist
 
 
-@app.delete("/api/playlists/{id}", status_code=204)
+@app.delete("/api/playlists/{id}", status_code=204, dependencies=[bulkhead_write])
 def remover_playlist(id: str, repo: Repositorio = Depends(get_repositorio)):
     """Remove uma playlist"""
     if not repo.remover_playlist(id):
         raise HTTPException(status_code=404, detail="Playlist não encontrada")
 
 
+# ========== SINCRONIZAÇÃO ==========
+
+def mudancas_protobuf(dados: dict):
+    """Página de /api/changes -> ListarMudancasResponse (o mesmo do gRPC)"""
+    mudancas = []
+    for item in dados["mudancas"]:
+        mudanca = mensagens_protobuf.Mudanca(
+            versao=item["versao"], entidade=item["entidade"], id=item["id"], operacao=item["operacao"]
+        )
+        if item.get("dados") is not None:
+            campo = MENSAGENS_ENTIDADES[item["entidade"]].lower()
+            getattr(mudanca, campo).CopyFrom(mensagem_entidade(item["entidade"], item["dados"]))
+        mudancas.append(mudanca)
+    return mensagens_protobuf.ListarMudancasResponse(mudancas=mudancas, token=dados["token"], mais=dados["mais"])
+
+
+@app.get("/api/changes", dependencies=[bulkhead_point])
+@mensagem_protobuf(mudancas_protobuf)
+def listar_mudancas(since: Optional[str] = None, limit: int = 1000, dados: bool = True,
+                    repo: Repositorio = Depends(get_repositorio)):
+    """
+    Mudanças (gravações e remoções) desde o token `since`. A resposta traz um
+    novo token para a próxima chamada; `mais` indica que há outra página.
+
+    Sem `since`, devolve só o token atual. O log não tem os dados anteriores a
+    ele nem as mudanças além da retenção (DB_MUDANCAS_RETENCAO): para começar
+    (ou após um 410), pegue o token atual, baixe as listagens completas e
+    sincronize a partir do token. `since=0` lê o log desde o início.
+    """
+    if not 1 <= limit <= DB_MUDANCAS_LIMITE_MAXIMO:
+        raise HTTPException(status_code=400, detail=f"limit deve estar entre 1 e {DB_MUDANCAS_LIMITE_MAXIMO}")
+    try:
+        desde = decodificar_token(since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        pagina = repo.listar_mudancas(desde, limit, dados)
+    except TokenExpirado as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return resposta_serializada({
+        "mudancas": pagina["mudancas"],
+        "token": codificar_token(pagina["token"]),
+        "mais": pagina["mais"],
+    })
+
+
+# ========== LOTE DE OPERAÇÕES ==========
+
+# Máximo de sub-requisições por chamada a /api/batch
+REST_LOTE_MAXIMO = int(os.getenv('REST_LOTE_MAXIMO', '1000'))
+# Threads para as leituras independentes executadas em paralelo
+REST_LOTE_PARALELISMO = int(os.getenv('REST_LOTE_PARALELISMO', '8'))
+
+_executor_lote = ThreadPoolExecutor(max_workers=REST_LOTE_PARALELISMO, thread_name_prefix='lote')
+
+
+class SubRequisicao(BaseModel):
+    """Uma operação de /api/batch, no mesmo formato de uma chamada REST"""
+    method: str = "GET"
+    path: str
+    body: Optional[Any] = None
+
+
+# (método, padrão do caminho, função(repo, body, consulta, **parâmetros) -> (status, body))
+ROTAS_LOTE = []
+
+
+def rota_lote(metodo: str, caminho: str):
+    """Registra uma função como destino de sub-requisições do /api/batch"""
+    padrao = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", caminho) + "$")
+
+    def registrar(funcao):
+        ROTAS_LOTE.append((metodo, padrao, funcao))
+        return funcao
+    return registrar
+
+
+def _encontrado(objeto, detalhe: str):
+    if not objeto:
+        raise HTTPException(status_code=404, detail=detalhe)
+    return objeto
+
+
+def _registrar_entidade(entidade: str, singular: str, modelo, nao_encontrado: str):
+    """Registra as rotas de CRUD de uma entidade no /api/batch"""
+    incluir = lambda consulta: parametro_lista(consulta.get("include")) or ()
+
+    @rota_lote("GET", f"/api/{entidade}")
+    def listar(repo, body, consulta):
+        return 200, repo.listar_linhas(entidade, parametro_lista(consulta.get("fields")), incluir(consulta))
+
+    @rota_lote("GET", f"/api/{entidade}/{{id}}")
+    def obter(repo, body, consulta, id):
+        linha = repo.obter_linha(entidade, id, parametro_lista(consulta.get("fields")), incluir(consulta))
+        return 200, _encontrado(linha, nao_encontrado)
+
+    @rota_lote("POST", f"/api/{entidade}")
+    def criar(repo, body, consulta):
+        objeto = playlist_do_corpo(body) if modelo is Playlist else modelo(**body)
+        return 201, getattr(repo, f"criar_{singular}")(objeto).model_dump()
+
+    @rota_lote("PUT", f"/api/{entidade}/{{id}}")
+    def atualizar(repo, body, consulta, id):
+        return 200, _encontrado(getattr(repo, f"atualizar_{singular}")(id, body), nao_encontrado).model_dump()
+
+    @rota_lote("DELETE", f"/api/{entidade}/{{id}}")
+    def remover(repo, body, consulta, id):
+        _encontrado(getattr(repo, f"remover_{singular}")(id), nao_encontrado)
+        return 204, None
+
+
+_registrar_entidade("usuarios", "usuario", Usuario, "Usuário não encontrado")
+_registrar_entidade("musicas", "musica", Musica, "Música não encontrada")
+_registrar_entidade("playlists", "playlist", Playlist, "Playlist não encontrada")
+
+
+@rota_lote("GET", "/api/usuarios/{usuario_id}/playlists")
+def _lote_playlists_por_usuario(repo, body, consulta, usuario_id):
+    return 200, [p.model_dump() for p in repo.listar_playlists_por_usuario(usuario_id)]
+
+
+@rota_lote("GET", "/api/playlists/{id}/musicas")
+def _lote_musicas_por_playlist(repo, body, consulta, id):
+    return 200, [m.model_dump() for m in repo.listar_musicas_por_playlist(id)]
+
+
+@rota_lote("GET", "/api/musicas/{musica_id}/playlists")
+def _lote_playlists_por_musica(repo, body, consulta, musica_id):
+    return 200, [p.model_dump() for p in repo.listar_playlists_por_musica(musica_id)]
+
+
+@rota_lote("POST", "/api/playlists/{id}/musicas")
+def _lote_adicionar_musica(repo, body, consulta, id):
+    musica_id = body.get("musicaId")
+    if not musica_id:
+        raise HTTPException(status_code=400, detail="musicaId é obrigatório")
+    playlist = repo.adicionar_musica_a_playlist(id, musica_id)
+    return 200, _encontrado(playlist, "Playlist não encontrada").model_dump()
+
+
+@rota_lote("DELETE", "/api/playlists/{id}/musicas/{musica_id}")
+def _lote_remover_musica(repo, body, consulta, id, musica_id):
+    playlist = repo.remover_musica_de_playlist(id, musica_id)
+    return 200, _encontrado(playlist, "Playlist não encontrada").model_dump()
+
+
+def executar_subrequisicao(repo: Repositorio, sub: SubRequisicao):
+    """Executa uma sub-requisição com o repositório dado e retorna (status, body)"""
+    metodo = sub.method.upper()
+    url = urlsplit(sub.path)
+    consulta = dict(parse_qsl(url.query, keep_blank_values=True))
+    caminho_existe = False
+    for metodo_rota, padrao, funcao in ROTAS_LOTE:
+        parametros = padrao.match(url.path)
+        if parametros is None:
+            continue
+        caminho_existe = True
+        if metodo_rota != metodo:
+            continue
+        try:
+            return funcao(repo, sub.body or {}, consulta, **parametros.groupdict())
+        except HTTPException as e:
+            return e.status_code, {"detail": e.detail}
+        except ValidationError as e:
+            return 422, {"detail": json.loads(e.json(include_url=False))}
+        except ValueError as e:
+            return 400, {"detail": str(e)}
+        except BulkheadCheio as e:
+            return 503, {"detail": str(e)}
+        except OperacaoCancelada:
+            # O lote inteiro perdeu o prazo ou o cliente desconectou
+            raise
+        except Exception as e:
+            return 500, {"detail": str(e)}
+    if caminho_existe:
+        return 405, {"detail": "Método não permitido"}
+    return 404, {"detail": "Rota não encontrada"}
+
+
+def _leitura_isolada(sub: SubRequisicao):
+    """Executa uma leitura com uma sessão própria (para rodar em paralelo)"""
+    db = SessionLocal()
+    try:
+        return executar_subrequisicao(Repositorio(db), sub)
+    finally:
+        db.close()
+
+
+def _executar_sequencial(repo: Repositorio, operacoes: List[SubRequisicao], paralelo: bool):
+    resultados = []
+    indice = 0
+    while indice < len(operacoes):
+        fim = indice
+        if paralelo:
+            # Leituras consecutivas não dependem umas das outras; escritas são barreiras
+            while fim < len(operacoes) and operacoes[fim].method.upper() == "GET":
+                fim += 1
+        if fim - indice > 1:
+            futuros = [
+                _executor_lote.submit(contextvars.copy_context().run, _leitura_isolada, sub)
+                for sub in operacoes[indice:fim]
+            ]
+            resultados.extend(futuro.result() for futuro in futuros)
+            indice = fim
+        else:
+            resultados.append(executar_subrequisicao(repo, operacoes[indice]))
+            indice += 1
+    return resultados
+
+
+def _executar_transacao(operacoes: List[SubRequisicao]):
+    """Executa todas as operações em uma única transação; a primeira falha desfaz tudo"""
+    db = sessao_para('write')
+    repo = Repositorio(db, adiar_commit=True)
+    try:
+        with vaga('write'):
+            resultados = []
+            for indice, sub in enumerate(operacoes):
+                status, corpo = executar_subrequisicao(repo, sub)
+                if status >= 400:
+                    db.rollback()
+                    desfeita = (424, {"detail": f"Transação desfeita: a operação {indice} falhou"})
+                    return [desfeita] * indice + [(status, corpo)] + [desfeita] * (len(operacoes) - indice - 1)
+                resultados.append((status, corpo))
+            db.commit()
+            leituras_compartilhadas.invalidar()
+            return resultados
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+@app.post("/api/batch", dependencies=[bulkhead_write])
+def executar_lote(operacoes: List[SubRequisicao], transacao: bool = False, paralelo: bool = False,
+                  repo: Repositorio = Depends(get_repositorio)):
+    """
+    Executa várias operações REST em uma única chamada. Retorna uma lista de
+    {status, body} na mesma ordem. Com ?transacao=true tudo roda em uma
+    transação; com ?paralelo=true leituras consecutivas rodam em paralelo.
+    """
+    if len(operacoes) > REST_LOTE_MAXIMO:
+        raise HTTPException(status_code=413, detail=f"Máximo de {REST_LOTE_MAXIMO} operações por lote")
+    if transacao:
+        resultados = _executar_transacao(operacoes)
+    else:
+        resultados = _executar_sequencial(repo, operacoes, paralelo)
+    return resposta_serializada([{"status": status, "body": corpo} for status, corpo in resultados])
+
+
+# ========== CRIAÇÃO EM LOTE ==========
+
+# Itens validados e inseridos por transação em /api/{entidade}/bulk
+REST_BULK_LOTE = int(os.getenv('REST_BULK_LOTE', '1000'))
+
+MODELOS_BULK = {'usuarios': Usuario, 'musicas': Musica, 'playlists': Playlist}
+
+
+async def _itens_do_corpo(request: Request, entidade: str):
+    """
+    Gera (item, erro) do corpo: array JSON, NDJSON ou MessagePack (um array ou
+    uma sequência de objetos) lidos conforme chegam, ou o protobuf
+    Listar<Entidade>Response do streaming.proto
+    """
+    tipo = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if tipo == "application/x-ndjson":
+        resto = b""
+        async for parte in request.stream():
+            resto += parte
+            *linhas, resto = resto.split(b"\n")
+            for linha in linhas:
+                if linha.strip():
+                    yield _decodificar_linha(linha)
+        if resto.strip():
+            yield _decodificar_linha(resto)
+        return
+
+    if tipo in TIPOS_CORPO_MSGPACK and msgpack is not None:
+        desempacotador = msgpack.Unpacker(raw=False)
+        recebidos = consumidos = 0
+        async for parte in request.stream():
+            desempacotador.feed(parte)
+            recebidos += len(parte)
+            objetos, consumidos, erro = _desempacotar(desempacotador, consumidos)
+            for objeto in objetos:
+                for item in (objeto if isinstance(objeto, list) else [objeto]):
+                    yield item, None
+            if erro is not None:
+                # Depois de um erro não há como achar o início do próximo objeto
+                yield None, erro
+                return
+        if consumidos < recebidos:
+            yield None, "MessagePack incompleto"
+        return
+
+    if tipo in TIPOS_CORPO_PROTOBUF and mensagens_protobuf is not None:
+        lista = mensagem_lista(entidade)()
+        try:
+            lista.ParseFromString(await request.body())
+        except DecodeError:
+            raise HTTPException(status_code=400, detail="Corpo não é um protobuf válido")
+        for mensagem in getattr(lista, entidade):
+            yield linha_da_mensagem(mensagem), None
+        return
+
+    if tipo and tipo != TIPO_JSON and not tipo.endswith("+json"):
+        aceitos = [TIPO_JSON, "application/x-ndjson"]
+        if msgpack is not None:
+            aceitos.append(TIPO_MSGPACK)
+        if mensagens_protobuf is not None:
+            aceitos.append(TIPO_PROTOBUF)
+        raise HTTPException(status_code=415, detail=f"Content-Type aceitos: {', '.join(aceitos)}")
+
+    try:
+        itens = json_loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Corpo não é um JSON válido")
+    if not isinstance(itens, list):
+        raise HTTPException(status_code=400, detail="O corpo deve ser um array JSON ou NDJSON")
+    for item in itens:
+        yield item, None
+
+
+def _desempacotar(desempacotador, consumidos: int):
+    """Objetos MessagePack completos já recebidos, bytes consumidos por eles e o erro de formato"""
+    objetos = []
+    try:
+        for objeto in desempacotador:
+            objetos.append(objeto)
+            consumidos = desempacotador.tell()
+    except ValueError:
+        return objetos, consumidos, "MessagePack inválido"
+    return objetos, consumidos, None
+
+
+def _decodificar_linha(linha: bytes):
+    try:
+        return json_loads(linha), None
+    except ValueError:
+        return None, "JSON inválido"
+
+
+def _validar_item(entidade: str, item):
+    if not isinstance(item, dict):
+        raise ValueError("Cada item deve ser um objeto JSON")
+    if entidade == 'playlists':
+        return playlist_do_corpo(item)
+    return MODELOS_BULK[entidade](**item)
+
+
+async def criar_em_lote(entidade: str, request: Request, repo: Repositorio) -> Response:
+    """
+    Valida e insere os itens do corpo em lotes de REST_BULK_LOTE. Itens
+    inválidos ou recusados pelo banco são reportados pelo índice, sem
+    impedir a criação dos demais.
+    """
+    ids = []
+    erros = []
+    pendentes = []
+
+    async def confirmar():
+        modelos = [modelo for _, modelo in pendentes]
+        try:
+            resultados = await anyio.to_thread.run_sync(repo.criar_em_lote, entidade, modelos)
+        except OperacaoCancelada:
+            raise
+        except Exception as e:
+            resultados = [(None, str(e))] * len(pendentes)
+        for (indice, _), (id, erro) in zip(pendentes, resultados):
+            if erro is None:
+                ids.append(id)
+            else:
+                erros.append({"indice": indice, "detail": erro})
+        pendentes.clear()
+
+    indice = 0
+    async for item, erro in _itens_do_corpo(request, entidade):
+        if erro is None:
+            try:
+                pendentes.append((indice, _validar_item(entidade, item)))
+            except ValidationError as e:
+                erro = json.loads(e.json(include_url=False))
+            except HTTPException as e:
+                erro = e.detail
+            except ValueError as e:
+                erro = str(e)
+        if erro is not None:
+            erros.append({"indice": indice, "detail": erro})
+        indice += 1
+        if len(pendentes) >= REST_BULK_LOTE:
+            await confirmar()
+    if pendentes:
+        await confirmar()
+
+    erros.sort(key=lambda e: e["indice"])
+    return resposta_serializada(
+        {"total": indice, "criados": len(ids), "ids": ids, "erros": erros},
+        status_code=201 if not erros else 207
+    )
+
+
+@app.post("/api/usuarios/bulk", dependencies=[bulkhead_write])
+async def criar_usuarios_em_lote(request: Request, repo: Repositorio = Depends(get_repositorio)):
+    """Cria usuários em lote (array JSON, NDJSON, MessagePack ou protobuf)"""
+    return await criar_em_lote('usuarios', request, repo)
+
+
+@app.post("/api/musicas/bulk", dependencies=[bulkhead_write])
+async def criar_musicas_em_lote(request: Request, repo: Repositorio = Depends(get_repositorio)):
+    """Cria músicas em lote (array JSON, NDJSON, MessagePack ou protobuf)"""
+    return await criar_em_lote('musicas', request, repo)
+
+
+@app.post("/api/playlists/bulk", dependencies=[bulkhead_write])
+async def criar_playlists_em_lote(request: Request, repo: Repositorio = Depends(get_repositorio)):
+    """Cria playlists em lote (array JSON, NDJSON, MessagePack ou protobuf)"""
+    return await criar_em_lote('playlists', request, repo)
+
+
+# ========== MÚLTIPLOS WORKERS ==========
+
+def configurar_worker(processos: int):
+    """Ajusta os pools e limites deste processo à sua parte do orçamento de conexões"""
+    dividir_pools(processos)
+    redimensionar_bulkheads()
+    if 'REST_MAX_CONCORRENCIA' not in os.environ:
+        controle_admissao.limite = min(REST_THREADPOOL, sum(limite_conexoes(c) for c in CLASSES_OPERACAO))
+        if 'REST_FILA_MAXIMA' not in os.environ:
+            controle_admissao.fila_maxima = 2 * controle_admissao.limite
+
+
+def _criar_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    familia = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(familia, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Cada worker tem o seu socket e o kernel distribui as conexões entre eles
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _executar_worker(processos: int, host: str, port: int, sock: Optional[socket.socket]):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    configurar_worker(processos)
+    if sock is None:
+        sock = _criar_socket(host, port, reuse_port=True)
+    import uvicorn
+    uvicorn.Server(uvicorn.Config(app, host=host, port=port)).run(sockets=[sock])
+
+
+def executar_workers(processos: int, host: str, port: int, reuse_port: bool):
+    """
+    Pre-fork: o processo pai cria as tabelas, abre o socket (a menos que cada
+    worker use SO_REUSEPORT) e mantém `processos` workers rodando, reiniciando
+    os que morrerem. Cada worker fica com 1/processos das conexões ao banco.
+    """
+    global INICIALIZAR_BANCO
+    init_db()
+    INICIALIZAR_BANCO = False
+    # Fecha as conexões usadas pelo init_db antes de qualquer fork
+    for _engine in engines.values():
+        _engine.dispose()
+
+    sock = None if reuse_port else _criar_socket(host, port, reuse_port=False)
+    filhos = {}
+    encerrando = False
+
+    def iniciar(numero: int):
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                _executar_worker(processos, host, port, sock)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                codigo = 1
+            finally:
+                os._exit(codigo)
+        filhos[pid] = numero
+
+    def encerrar(sinal, frame):
+        nonlocal encerrando
+        encerrando = True
+        for pid in list(filhos):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+    for numero in range(processos):
+        iniciar(numero)
+    print(f"REST: {processos} workers em {host}:{port} (SO_REUSEPORT={'sim' if reuse_port else 'não'})")
+
+    while filhos:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        numero = filhos.pop(pid, None)
+        if numero is not None and not encerrando:
+            print(f"Worker {numero} (pid {pid}) terminou com status {status}; reiniciando")
+            time.sleep(1)
+            iniciar(numero)
+
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=3001)
+    parser = argparse.ArgumentParser(description="Serviço REST")
+    parser.add_argument("--host", default=os.getenv('REST_HOST', "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv('REST_PORT', '3001')))
+    parser.add_argument("--workers", type=int, default=int(os.getenv('REST_PROCESSOS', '1')),
+                        help="número de processos (pre-fork)")
+    parser.add_argument("--reuse-port", action="store_true", default=os.getenv('REST_REUSE_PORT', '0') == '1',
+                        help="um socket por worker com SO_REUSEPORT")
+    args = parser.parse_args()
+    if args.workers > 1 and hasattr(os, 'fork'):
+        executar_workers(args.workers, args.host, args.port, args.reuse_port)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
 
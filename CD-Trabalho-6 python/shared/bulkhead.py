@@ -0,0 +1,179 @@
+"""
+Bulkheads por classe de operação (scan, point, write)
+
+Cada classe tem um limite de concorrência igual ao tamanho do seu sub-pool de
+conexões, de modo que listagens pesadas não bloqueiem leituras pontuais.
+"""
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from shared.database import CLASSES_OPERACAO, classe_operacao, limite_conexoes
+from shared.cancelamento import MOTIVO_PRAZO, OperacaoCancelada, token_atual
+from shared.temporizacao import medicao_atual, medir
+
+BULKHEAD_TIMEOUT = float(os.getenv('DB_BULKHEAD_TIMEOUT', '30'))
+
+
+class BulkheadCheio(Exception):
+    """Lançada quando a fila de uma classe de operação excede o tempo limite"""
+
+    def __init__(self, classe: str, espera: float):
+        super().__init__(f"Capacidade esgotada para operações '{classe}' (aguardou {espera:.3f}s)")
+        self.classe = classe
+        self.espera = espera
+
+
+class MetricasFila:
+    """Contadores de ocupação e de tempo de fila de um bulkhead"""
+
+    def __init__(self, limite: int):
+        self._lock = threading.Lock()
+        self.limite = limite
+        self.em_uso = 0
+        self.aguardando = 0
+        self.admitidas = 0
+        self.rejeitadas = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+
+    def entrou_na_fila(self):
+        with self._lock:
+            self.aguardando += 1
+
+    def saiu_da_fila(self, espera: float, admitida: bool):
+        with self._lock:
+            self.aguardando -= 1
+            if admitida:
+                self.em_uso += 1
+                self.admitidas += 1
+                self.espera_total += espera
+                self.espera_maxima = max(self.espera_maxima, espera)
+            else:
+                self.rejeitadas += 1
+
+    def liberou(self):
+        with self._lock:
+            self.em_uso -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'limite': self.limite,
+                'em_uso': self.em_uso,
+                'aguardando': self.aguardando,
+                'admitidas': self.admitidas,
+                'rejeitadas': self.rejeitadas,
+                'espera_media_ms': round(self.espera_total / self.admitidas * 1000, 3) if self.admitidas else 0.0,
+                'espera_maxima_ms': round(self.espera_maxima * 1000, 3),
+            }
+
+
+class Bulkhead:
+    """Semáforo limitado com métricas de fila para uma classe de operação"""
+
+    def __init__(self, classe: str, limite: int):
+        self.classe = classe
+        self._semaforo = threading.BoundedSemaphore(limite)
+        self.metricas = MetricasFila(limite)
+
+    @contextmanager
+    def adquirir(self, timeout: float = BULKHEAD_TIMEOUT):
+        inicio = time.perf_counter()
+        self.metricas.entrou_na_fila()
+        admitida = self._semaforo.acquire(timeout=timeout)
+        espera = time.perf_counter() - inicio
+        self.metricas.saiu_da_fila(espera, admitida)
+        medicao = medicao_atual.get()
+        if medicao is not None:
+            medicao.adicionar('fila', espera)
+        if not admitida:
+            raise BulkheadCheio(self.classe, espera)
+        try:
+            yield espera
+        finally:
+            self.metricas.liberou()
+            self._semaforo.release()
+
+
+bulkheads = {classe: Bulkhead(classe, limite_conexoes(classe)) for classe in CLASSES_OPERACAO}
+
+
+def redimensionar_bulkheads():
+    """Recria os bulkheads com os limites atuais dos sub-pools (ex.: após dividir_pools)"""
+    for classe in CLASSES_OPERACAO:
+        bulkheads[classe] = Bulkhead(classe, limite_conexoes(classe))
+
+
+def _timeout_bulkhead(cancelamento) -> float:
+    """Tempo máximo de espera por uma vaga, limitado ao prazo da requisição"""
+    timeout = BULKHEAD_TIMEOUT
+    if cancelamento is not None:
+        cancelamento.verificar()
+        restante = cancelamento.tempo_restante()
+        if restante is not None:
+            timeout = min(timeout, restante)
+    return timeout
+
+
+@contextmanager
+def vaga(classe: str):
+    """Ocupa uma vaga do bulkhead da classe durante todo o bloco (ex.: um stream)"""
+    cancelamento = token_atual.get()
+    try:
+        with bulkheads[classe].adquirir(_timeout_bulkhead(cancelamento)) as espera:
+            yield espera
+    except BulkheadCheio:
+        if cancelamento is not None:
+            cancelamento.verificar()
+        raise
+
+
+def operacao(classe: str):
+    """
+    Decorator para métodos do Repositorio: roteia a sessão para o sub-pool da
+    classe, respeita o limite de concorrência dela e devolve a conexão ao pool
+    assim que uma leitura termina. Se a requisição for cancelada ou perder o
+    prazo, o trabalho é interrompido com OperacaoCancelada.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def wrapper(self, *args, **kwargs):
+            if self.adiar_commit:
+                # A transação (e a vaga no bulkhead) pertence a quem criou o repositório
+                return funcao(self, *args, **kwargs)
+            cancelamento = token_atual.get()
+            timeout = _timeout_bulkhead(cancelamento)
+            token = classe_operacao.set(classe)
+            try:
+                with bulkheads[classe].adquirir(timeout):
+                    try:
+                        with medir('repositorio'):
+                            resultado = funcao(self, *args, **kwargs)
+                        if cancelamento is not None and classe != 'write':
+                            # Não entrega para serialização uma leitura que ninguém vai receber
+                            cancelamento.verificar()
+                    except Exception as exc:
+                        self.db.rollback()
+                        if cancelamento is not None and cancelamento.cancelado and not isinstance(exc, OperacaoCancelada):
+                            raise OperacaoCancelada(cancelamento.motivo or MOTIVO_PRAZO) from exc
+                        raise
+                    if classe != 'write':
+                        self.db.rollback()
+                    return resultado
+            except BulkheadCheio:
+                if cancelamento is not None:
+                    cancelamento.verificar()
+                raise
+            finally:
+                classe_operacao.reset(token)
+        wrapper.classe_operacao = classe
+        return wrapper
+    return decorador
+
+
+def metricas_bulkheads() -> dict:
+    """Retorna as métricas de fila de todas as classes de operação"""
+    return {classe: bulkhead.metricas.snapshot() for classe, bulkhead in bulkheads.items()}
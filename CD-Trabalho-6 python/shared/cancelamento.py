@@ -0,0 +1,94 @@
+"""
+Cancelamento de trabalho no banco quando o cliente desiste ou o prazo expira
+
+Cada requisição pode ter um TokenCancelamento no contexto atual. As conexões que
+a sessão usa enquanto o token está ativo ficam registradas nele; cancelar o token
+envia um cancelamento de statement ao PostgreSQL para cada uma delas. Quando o
+token tem prazo, o statement_timeout da transação é limitado ao tempo restante.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+MOTIVO_PRAZO = 'prazo expirado'
+MOTIVO_DESCONEXAO = 'cliente desconectou'
+
+
+class OperacaoCancelada(Exception):
+    """Lançada quando a requisição foi cancelada ou perdeu o prazo"""
+
+
+class TokenCancelamento:
+    """Estado de cancelamento de uma requisição"""
+
+    def __init__(self, prazo: Optional[float] = None):
+        # prazo em segundos a partir de agora (None = sem prazo)
+        self.limite = time.monotonic() + prazo if prazo is not None else None
+        self.motivo: Optional[str] = None
+        self._lock = threading.Lock()
+        self._conexoes = set()
+
+    @property
+    def cancelado(self) -> bool:
+        return self.motivo is not None or self.expirado
+
+    @property
+    def expirado(self) -> bool:
+        return self.limite is not None and time.monotonic() >= self.limite
+
+    def tempo_restante(self) -> Optional[float]:
+        if self.limite is None:
+            return None
+        return max(0.0, self.limite - time.monotonic())
+
+    def registrar(self, dbapi_connection):
+        with self._lock:
+            self._conexoes.add(dbapi_connection)
+
+    def remover(self, dbapi_connection):
+        with self._lock:
+            self._conexoes.discard(dbapi_connection)
+
+    def cancelar(self, motivo: str = MOTIVO_PRAZO):
+        """Marca o token como cancelado e interrompe os statements em andamento"""
+        # O cancelamento é enviado segurando o lock que o checkin também usa para
+        # remover a conexão: uma conexão devolvida ao pool (e talvez já entregue
+        # a outra requisição) nunca recebe o cancelamento desta
+        with self._lock:
+            if self.motivo is None:
+                self.motivo = motivo
+            for conexao in self._conexoes:
+                try:
+                    # Equivalente a pg_cancel_backend(pid) da conexão, sem precisar de outra sessão
+                    conexao.cancel()
+                except Exception:
+                    pass
+
+    def verificar(self):
+        """Lança OperacaoCancelada se não vale mais a pena continuar o trabalho"""
+        if self.motivo is not None:
+            raise OperacaoCancelada(self.motivo)
+        if self.expirado:
+            raise OperacaoCancelada(MOTIVO_PRAZO)
+
+
+token_atual: ContextVar[Optional[TokenCancelamento]] = ContextVar('token_cancelamento', default=None)
+
+
+@contextmanager
+def escopo_cancelamento(token: Optional[TokenCancelamento]):
+    """Define o token de cancelamento do contexto atual"""
+    anterior = token_atual.set(token)
+    try:
+        yield token
+    finally:
+        token_atual.reset(anterior)
+
+
+def verificar_cancelamento():
+    """Verifica o token do contexto atual (se houver)"""
+    token = token_atual.get()
+    if token is not None:
+        token.verificar()
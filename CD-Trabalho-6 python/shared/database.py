@@ -1,9 +1,13 @@
 """
 Configuração do banco de dados PostgreSQL
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session
+from contextlib import contextmanager
+from contextvars import ContextVar
 from shared.models import Base
+from shared.cancelamento import token_atual
+from shared.temporizacao import marcar_pedido_conexao
 import os
 from dotenv import load_dotenv
 import urllib.parse
@@ -55,18 +59,158 @@ database_url = URL.create(
     database=DB_NAME
 )
 
-engine = create_engine(
-    database_url,
-    echo=False,
-    pool_pre_ping=True,
-    pool_size=20,  # Aumenta o pool de conexões
-    max_overflow=40,  # Aumenta o overflow
-    pool_recycle=3600,  # Recicla conexões após 1 hora
-    connect_args={
-        'client_encoding': 'utf8'
-    }
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Bulkhead: cada classe de operação tem seu próprio sub-pool de conexões.
+# Listagens completas (scan) são lentas e não podem esgotar as conexões usadas
+# pelas leituras pontuais (point) e pelas escritas (write).
+CLASSES_OPERACAO = ('scan', 'point', 'write')
+CLASSE_PADRAO = 'point'
+
+POOL_CONFIG = {
+    'scan': (int(os.getenv('DB_POOL_SCAN_SIZE', '8')), int(os.getenv('DB_POOL_SCAN_OVERFLOW', '4'))),
+    'point': (int(os.getenv('DB_POOL_POINT_SIZE', '16')), int(os.getenv('DB_POOL_POINT_OVERFLOW', '8'))),
+    'write': (int(os.getenv('DB_POOL_WRITE_SIZE', '8')), int(os.getenv('DB_POOL_WRITE_OVERFLOW', '4'))),
+}
+
+
+def _criar_engine(pool_size: int, max_overflow: int):
+    """Cria uma engine com o seu próprio pool de conexões"""
+    return create_engine(
+        database_url,
+        echo=False,
+        pool_pre_ping=True,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=3600,  # Recicla conexões após 1 hora
+        connect_args={
+            'client_encoding': 'utf8'
+        }
+    )
+
+
+engines = {classe: _criar_engine(*POOL_CONFIG[classe]) for classe in CLASSES_OPERACAO}
+engine = engines[CLASSE_PADRAO]
+
+# Classe da operação em andamento na thread/tarefa atual (definida pelo bulkhead)
+classe_operacao: ContextVar[str] = ContextVar('classe_operacao', default=CLASSE_PADRAO)
+
+
+def limite_conexoes(classe: str) -> int:
+    """Número máximo de conexões simultâneas do sub-pool de uma classe"""
+    pool_size, max_overflow = POOL_CONFIG[classe]
+    return pool_size + max_overflow
+
+
+class SessaoRoteada(Session):
+    """Sessão que escolhe o sub-pool de acordo com a classe da operação atual"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        marcar_pedido_conexao()
+        if self.bind is not None:
+            return self.bind
+        return engines[classe_operacao.get()]
+
+
+SessionLocal = sessionmaker(class_=SessaoRoteada, autocommit=False, autoflush=False)
+
+
+def sessao_para(classe: str) -> Session:
+    """Cria uma sessão fixa no sub-pool de uma classe de operação"""
+    return SessionLocal(bind=engines[classe])
+
+
+# Maior valor aceito pelo PostgreSQL para statement_timeout (int32, em ms)
+STATEMENT_TIMEOUT_MAXIMO_MS = 2 ** 31 - 1
+
+
+@event.listens_for(SessaoRoteada, 'after_begin')
+def _vincular_token_cancelamento(session, transaction, connection):
+    """Registra a conexão no token da requisição e limita o statement_timeout ao prazo dela"""
+    token = token_atual.get()
+    if token is None:
+        return
+    token.verificar()
+    fairy = connection.connection
+    fairy.info['token_cancelamento'] = token
+    token.registrar(fairy.dbapi_connection)
+    restante = token.tempo_restante()
+    if restante is not None:
+        # SET LOCAL vale só até o fim da transação, então não vaza para o próximo uso da conexão
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {_timeout_ms(restante)}")
+
+
+def _timeout_ms(restante: float) -> int:
+    return min(max(1, int(restante * 1000)), STATEMENT_TIMEOUT_MAXIMO_MS)
+
+
+@contextmanager
+def token_na_transacao(session: Session, token):
+    """
+    Aplica o token de uma operação a um trecho de uma transação já aberta por
+    outra pessoa (ex.: o SAVEPOINT de cada operação de um lote do group commit):
+    o cancelamento do token interrompe só os statements desse trecho, e o
+    statement_timeout fica limitado ao prazo dele. Deve ser usado logo após
+    begin_nested(), já que o rollback do SAVEPOINT desfaz o SET LOCAL.
+    """
+    if token is None:
+        yield
+        return
+    token.verificar()
+    connection = session.connection()
+    dbapi_connection = connection.connection.dbapi_connection
+    restante = token.tempo_restante()
+    timeout = _timeout_ms(restante) if restante is not None else 'DEFAULT'
+    connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout}")
+    token.registrar(dbapi_connection)
+    try:
+        yield
+    finally:
+        token.remover(dbapi_connection)
+
+
+def _desvincular_token_cancelamento(dbapi_connection, connection_record):
+    """Remove a conexão do token ao devolvê-la ao pool, para não cancelar o trabalho de outra requisição"""
+    token = connection_record.info.pop('token_cancelamento', None)
+    if token is not None:
+        token.remover(dbapi_connection)
+
+
+for _engine in engines.values():
+    event.listen(_engine, 'checkin', _desvincular_token_cancelamento)
+
+
+def descartar_pools_herdados():
+    """
+    Esquece as conexões herdadas do processo pai após um fork, sem fechá-las:
+    os sockets continuam sendo do pai e não podem ser usados pelo filho.
+    """
+    for _engine in engines.values():
+        _engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=descartar_pools_herdados)
+
+
+def dividir_pools(processos: int):
+    """
+    Recria os sub-pools com a parte deste processo do orçamento global de
+    conexões (DB_CONEXOES_GLOBAIS, por padrão o total configurado para um
+    único processo), mantendo a proporção entre as classes de operação.
+    """
+    global engine
+    total_atual = sum(limite_conexoes(classe) for classe in CLASSES_OPERACAO)
+    orcamento = int(os.getenv('DB_CONEXOES_GLOBAIS', str(total_atual)))
+    fator = max(len(CLASSES_OPERACAO), orcamento // processos) / total_atual
+    for classe in CLASSES_OPERACAO:
+        pool_size, max_overflow = POOL_CONFIG[classe]
+        limite = max(1, int((pool_size + max_overflow) * fator))
+        novo_pool_size = min(limite, max(1, round(limite * pool_size / (pool_size + max_overflow))))
+        POOL_CONFIG[classe] = (novo_pool_size, limite - novo_pool_size)
+        anterior = engines[classe]
+        engines[classe] = _criar_engine(*POOL_CONFIG[classe])
+        event.listen(engines[classe], 'checkin', _desvincular_token_cancelamento)
+        anterior.dispose(close=False)
+    engine = engines[CLASSE_PADRAO]
 
 
 def init_db():
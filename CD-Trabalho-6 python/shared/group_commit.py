@@ -0,0 +1,153 @@
+"""
+Group commit: agrupa escritas pequenas e concorrentes em uma única transação
+
+Quando ativado (DB_GROUP_COMMIT=1), as operações marcadas com @agrupar_escrita
+são enfileiradas por alguns milissegundos e executadas por uma thread própria,
+cada uma no seu SAVEPOINT, com um único commit para o lote inteiro. Cada
+chamador recebe o seu próprio resultado ou erro; só uma falha no commit do lote
+afeta todas as operações dele. O token de cancelamento de cada chamador vale
+dentro do lote (prazo como statement_timeout do SAVEPOINT dela) e limita a
+espera pelo resultado.
+"""
+import functools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturoTimeout
+
+from shared.bulkhead import bulkheads
+from shared.cancelamento import escopo_cancelamento, token_atual
+from shared.database import sessao_para, token_na_transacao
+from shared.singleflight import leituras_compartilhadas
+
+GROUP_COMMIT = os.getenv('DB_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_JANELA = float(os.getenv('DB_GROUP_COMMIT_JANELA_MS', '2')) / 1000
+GROUP_COMMIT_MAX_LOTE = int(os.getenv('DB_GROUP_COMMIT_MAX_LOTE', '64'))
+
+
+class CoalescedorEscrita:
+    """Coleta operações de escrita de várias threads e as confirma em lote"""
+
+    def __init__(self, ativo: bool, janela: float, max_lote: int):
+        self.ativo = ativo
+        self.janela = janela
+        self.max_lote = max_lote
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.lotes = 0
+        self.operacoes = 0
+        self.maior_lote = 0
+
+    def submeter(self, operacao):
+        """
+        Enfileira operacao(db) e aguarda o commit do lote em que ela entrou.
+        Com um token de cancelamento no contexto, a espera termina no prazo
+        dele; a operação ainda não iniciada sai do lote.
+        """
+        token = token_atual.get()
+        if token is not None:
+            token.verificar()
+        self._iniciar()
+        futuro = Future()
+        self._fila.put((operacao, futuro, token))
+        try:
+            return futuro.result(timeout=token.tempo_restante() if token is not None else None)
+        except FuturoTimeout:
+            # Se a operação já começou, fica limitada pelo statement_timeout do token
+            futuro.cancel()
+            token.verificar()
+            raise
+
+    def _iniciar(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name='group-commit', daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        while True:
+            lote = [self._fila.get()]
+            limite = time.monotonic() + self.janela
+            while len(lote) < self.max_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(self._fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._confirmar_lote(lote)
+
+    def _confirmar_lote(self, lote):
+        resultados = []
+        try:
+            with bulkheads['write'].adquirir():
+                db = sessao_para('write')
+                try:
+                    for operacao, futuro, token in lote:
+                        if not futuro.set_running_or_notify_cancel():
+                            # Quem submeteu desistiu antes do lote chegar a ela
+                            continue
+                        savepoint = db.begin_nested()
+                        try:
+                            with escopo_cancelamento(token), token_na_transacao(db, token):
+                                resultado = operacao(db)
+                            savepoint.commit()
+                            resultados.append((futuro, resultado, None))
+                        except Exception as exc:
+                            savepoint.rollback()
+                            resultados.append((futuro, None, exc))
+                    db.commit()
+                    leituras_compartilhadas.invalidar()
+                finally:
+                    db.close()
+        except Exception as exc:
+            # Sem o commit do lote, nenhuma das operações foi persistida
+            resultados = [
+                (futuro, None, exc) for _, futuro, _ in lote
+                if futuro.running() or futuro.set_running_or_notify_cancel()
+            ]
+
+        with self._lock:
+            self.lotes += 1
+            self.operacoes += len(lote)
+            self.maior_lote = max(self.maior_lote, len(lote))
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                'ativo': self.ativo,
+                'janela_ms': round(self.janela * 1000, 3),
+                'max_lote': self.max_lote,
+                'lotes': self.lotes,
+                'operacoes': self.operacoes,
+                'media_por_lote': round(self.operacoes / self.lotes, 2) if self.lotes else 0.0,
+                'maior_lote': self.maior_lote,
+            }
+
+
+coalescedor_escrita = CoalescedorEscrita(GROUP_COMMIT, GROUP_COMMIT_JANELA, GROUP_COMMIT_MAX_LOTE)
+
+
+def agrupar_escrita(metodo):
+    """
+    Decorator para escritas do Repositorio: com o group commit ativo, executa o
+    método em um repositório com commit adiado dentro do próximo lote.
+    """
+    @functools.wraps(metodo)
+    def wrapper(self, *args, **kwargs):
+        if not coalescedor_escrita.ativo or self.adiar_commit:
+            return metodo(self, *args, **kwargs)
+        return coalescedor_escrita.submeter(
+            lambda db: metodo(type(self)(db, adiar_commit=True), *args, **kwargs)
+        )
+    return wrapper
@@ -1,7 +1,7 @@
 """
 Modelos de dados compartilhados entre todas as implementações
 """
-from sqlalchemy import Column, String, Integer, ForeignKey, Table
+from sqlalchemy import Column, String, Integer, BigInteger, ForeignKey, Table, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from typing import Optional, List
@@ -57,6 +57,29 @@ class PlaylistDB(Base):
     musicas = relationship('MusicaDB', secondary=playlist_musica, back_populates='playlists')
 
 
+class MudancaDB(Base):
+    """Log de mudanças usado pela sincronização incremental"""
+    __tablename__ = 'mudancas'
+    
+    versao = Column(BigInteger, primary_key=True, autoincrement=True)
+    # Transação que fez a mudança; define até onde o log já é estável para leitura
+    txid = Column(BigInteger, nullable=False, server_default=text('txid_current()'))
+    entidade = Column(String, nullable=False)
+    entidade_id = Column(String, nullable=False)
+    operacao = Column(String, nullable=False)
+    
+    __table_args__ = (Index('ix_mudancas_txid_versao', 'txid', 'versao'),)
+
+
+class PodaMudancasDB(Base):
+    """Posição (txid, versao) até onde o log de mudanças já foi apagado (uma linha só)"""
+    __tablename__ = 'mudancas_poda'
+    
+    id = Column(Integer, primary_key=True)
+    txid = Column(BigInteger, nullable=False)
+    versao = Column(BigInteger, nullable=False)
+
+
 # Modelos Pydantic para validação e serialização
 class Usuario(BaseModel):
     id: Optional[str] = None
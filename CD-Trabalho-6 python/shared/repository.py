@@ -1,21 +1,122 @@
 """
 Repositório compartilhado usando SQLAlchemy e PostgreSQL
 """
+from sqlalchemy import literal, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy.exc import IntegrityError
-from typing import Optional, List
+from typing import Optional, List, Iterator
+import os
+import threading
+import time
 import uuid
-from shared.models import Base, UsuarioDB, MusicaDB, PlaylistDB, Usuario, Musica, Playlist
+from shared.models import (
+    Base, UsuarioDB, MusicaDB, PlaylistDB, MudancaDB, PodaMudancasDB, playlist_musica, Usuario, Musica, Playlist
+)
+from shared.bulkhead import operacao, vaga
+from shared.database import SessionLocal
+from shared.group_commit import agrupar_escrita
+from shared.singleflight import leitura_compartilhada, leituras_compartilhadas
+from shared.cancelamento import verificar_cancelamento
+from shared.temporizacao import medir
+
+# Linhas buscadas por vez do cursor no servidor ao transmitir uma listagem
+DB_STREAM_LOTE = int(os.getenv('DB_STREAM_LOTE', '500'))
+
+# Colunas de cada entidade, na ordem em que aparecem no JSON
+COLUNAS = {
+    'usuarios': {'id': UsuarioDB.id, 'nome': UsuarioDB.nome, 'idade': UsuarioDB.idade},
+    'musicas': {'id': MusicaDB.id, 'nome': MusicaDB.nome, 'artista': MusicaDB.artista},
+    'playlists': {'id': PlaylistDB.id, 'nome': PlaylistDB.nome, 'usuario_id': PlaylistDB.usuario_id},
+}
+TABELAS = {
+    'usuarios': UsuarioDB.__table__,
+    'musicas': MusicaDB.__table__,
+    'playlists': PlaylistDB.__table__,
+}
+# Campos que não são colunas da tabela e são carregados à parte
+CAMPOS_CALCULADOS = {
+    'playlists': ('musicas_ids',),
+}
+# Entidades relacionadas que podem ser embutidas (?include=)
+RELACOES = {
+    'playlists': ('musicas', 'usuario'),
+}
+# Máximo de IDs por cláusula IN ao carregar relacionamentos
+DB_LOTE_IN = int(os.getenv('DB_LOTE_IN', '1000'))
+
+# Operações registradas no log de mudanças (remoções ficam como tombstones)
+MUDANCA_GRAVACAO = 'upsert'
+MUDANCA_REMOCAO = 'delete'
+# Maior página de mudanças que uma leitura do log pode pedir
+DB_MUDANCAS_LIMITE_MAXIMO = int(os.getenv(
+    'DB_MUDANCAS_LIMITE_MAXIMO', os.getenv('REST_MUDANCAS_LIMITE_MAXIMO', '10000')
+))
+# Retenção do log: mantém as DB_MUDANCAS_RETENCAO mudanças mais recentes
+# (0 desliga a poda), apagando as antigas a cada DB_MUDANCAS_PODA_INTERVALO segundos
+DB_MUDANCAS_RETENCAO = int(os.getenv('DB_MUDANCAS_RETENCAO', '1000000'))
+DB_MUDANCAS_PODA_INTERVALO = float(os.getenv('DB_MUDANCAS_PODA_INTERVALO', '300'))
+# Posição no log (txid, versao) anterior a qualquer mudança
+TOKEN_INICIAL = (0, 0)
+# Chave do advisory lock que impede duas podas simultâneas (entre processos)
+_LOCK_PODA_MUDANCAS = 0x6d756461
+
+
+class TokenExpirado(Exception):
+    """O token aponta para uma parte do log que já foi apagada: é preciso ressincronizar tudo"""
+
+
+def codificar_token(posicao: tuple) -> str:
+    """Token opaco entregue ao cliente para a próxima sincronização"""
+    return f"{posicao[0]}-{posicao[1]}"
+
+
+def decodificar_token(token: Optional[str]) -> Optional[tuple]:
+    """
+    Converte o token do cliente em (txid, versao); lança ValueError se inválido.
+    Sem token devolve None (só a posição atual do log); '0' é o início do log.
+    """
+    if not token:
+        return None
+    if token == '0':
+        return TOKEN_INICIAL
+    txid, separador, versao = token.partition('-')
+    if not separador:
+        raise ValueError(f"Token inválido: {token}")
+    posicao = (int(txid), int(versao))
+    if min(posicao) < 0:
+        raise ValueError(f"Token inválido: {token}")
+    return posicao
+
+
+def _em_lotes(ids: list, tamanho: int = DB_LOTE_IN):
+    for inicio in range(0, len(ids), tamanho):
+        yield ids[inicio:inicio + tamanho]
 
 
 class Repositorio:
     """Repositório para gerenciar operações CRUD no banco de dados"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, adiar_commit: bool = False):
         self.db = db
+        # Com adiar_commit, as alterações são apenas enviadas ao banco (flush) e
+        # quem criou o repositório decide quando fazer o commit
+        self.adiar_commit = adiar_commit
+    
+    def _confirmar(self, *objetos):
+        """Faz o commit da operação (ou só o flush, se o commit for adiado)"""
+        if self.adiar_commit:
+            self.db.flush()
+            return
+        self.db.commit()
+        leituras_compartilhadas.invalidar()
+        for objeto in objetos:
+            self.db.refresh(objeto)
     
     # ========== USUÁRIOS ==========
     
+    @agrupar_escrita
+    @operacao('write')
     def criar_usuario(self, usuario: Usuario) -> Usuario:
         """Cria um novo usuário"""
         usuario_db = UsuarioDB(
@@ -24,20 +125,25 @@ class Repositorio:
             idade=usuario.idade
         )
         self.db.add(usuario_db)
-        self.db.commit()
-        self.db.refresh(usuario_db)
+        self._registrar_mudancas('usuarios', [usuario_db.id])
+        self._confirmar(usuario_db)
         return Usuario.model_validate(usuario_db)
     
+    @leitura_compartilhada
+    @operacao('point')
     def obter_usuario(self, id: str) -> Optional[Usuario]:
         """Obtém um usuário por ID"""
         usuario_db = self.db.query(UsuarioDB).filter(UsuarioDB.id == id).first()
         return Usuario.model_validate(usuario_db) if usuario_db else None
     
+    @leitura_compartilhada
+    @operacao('scan')
     def listar_usuarios(self) -> List[Usuario]:
         """Lista todos os usuários"""
         usuarios_db = self.db.query(UsuarioDB).all()
         return [Usuario.model_validate(u) for u in usuarios_db]
     
+    @operacao('write')
     def atualizar_usuario(self, id: str, dados: dict) -> Optional[Usuario]:
         """Atualiza um usuário"""
         usuario_db = self.db.query(UsuarioDB).filter(UsuarioDB.id == id).first()
@@ -48,22 +154,28 @@ class Repositorio:
             if hasattr(usuario_db, key):
                 setattr(usuario_db, key, value)
         
-        self.db.commit()
-        self.db.refresh(usuario_db)
+        self._registrar_mudancas('usuarios', [usuario_db.id])
+        self._confirmar(usuario_db)
         return Usuario.model_validate(usuario_db)
     
+    @operacao('write')
     def remover_usuario(self, id: str) -> bool:
         """Remove um usuário e todas suas playlists (cascade)"""
         usuario_db = self.db.query(UsuarioDB).filter(UsuarioDB.id == id).first()
         if not usuario_db:
             return False
         
+        # As playlists do usuário são removidas junto (cascade)
+        self._registrar_mudancas('playlists', [p.id for p in usuario_db.playlists], MUDANCA_REMOCAO)
+        self._registrar_mudancas('usuarios', [id], MUDANCA_REMOCAO)
         self.db.delete(usuario_db)
-        self.db.commit()
+        self._confirmar()
         return True
     
     # ========== MÚSICAS ==========
     
+    @agrupar_escrita
+    @operacao('write')
     def criar_musica(self, musica: Musica) -> Musica:
         """Cria uma nova música"""
         musica_db = MusicaDB(
@@ -72,20 +184,25 @@ class Repositorio:
             artista=musica.artista
         )
         self.db.add(musica_db)
-        self.db.commit()
-        self.db.refresh(musica_db)
+        self._registrar_mudancas('musicas', [musica_db.id])
+        self._confirmar(musica_db)
         return Musica.model_validate(musica_db)
     
+    @leitura_compartilhada
+    @operacao('point')
     def obter_musica(self, id: str) -> Optional[Musica]:
         """Obtém uma música por ID"""
         musica_db = self.db.query(MusicaDB).filter(MusicaDB.id == id).first()
         return Musica.model_validate(musica_db) if musica_db else None
     
+    @leitura_compartilhada
+    @operacao('scan')
     def listar_musicas(self) -> List[Musica]:
         """Lista todas as músicas"""
         musicas_db = self.db.query(MusicaDB).all()
         return [Musica.model_validate(m) for m in musicas_db]
     
+    @operacao('write')
     def atualizar_musica(self, id: str, dados: dict) -> Optional[Musica]:
         """Atualiza uma música"""
         musica_db = self.db.query(MusicaDB).filter(MusicaDB.id == id).first()
@@ -96,22 +213,28 @@ class Repositorio:
             if hasattr(musica_db, key):
                 setattr(musica_db, key, value)
         
-        self.db.commit()
-        self.db.refresh(musica_db)
+        self._registrar_mudancas('musicas', [musica_db.id])
+        self._confirmar(musica_db)
         return Musica.model_validate(musica_db)
     
+    @operacao('write')
     def remover_musica(self, id: str) -> bool:
         """Remove uma música (será removida de todas as playlists automaticamente)"""
         musica_db = self.db.query(MusicaDB).filter(MusicaDB.id == id).first()
         if not musica_db:
             return False
         
+        # As playlists que tinham a música mudam (musicas_ids)
+        self._registrar_mudancas('playlists', [p.id for p in musica_db.playlists])
+        self._registrar_mudancas('musicas', [id], MUDANCA_REMOCAO)
         self.db.delete(musica_db)
-        self.db.commit()
+        self._confirmar()
         return True
     
     # ========== PLAYLISTS ==========
     
+    @agrupar_escrita
+    @operacao('write')
     def criar_playlist(self, playlist: Playlist) -> Playlist:
         """Cria uma nova playlist"""
         # Valida se o usuário existe
@@ -133,8 +256,8 @@ class Repositorio:
             playlist_db.musicas = musicas_db
         
         self.db.add(playlist_db)
-        self.db.commit()
-        self.db.refresh(playlist_db)
+        self._registrar_mudancas('playlists', [playlist_db.id])
+        self._confirmar(playlist_db)
         
         return Playlist(
             id=playlist_db.id,
@@ -143,6 +266,8 @@ class Repositorio:
             musicas_ids=[m.id for m in playlist_db.musicas]
         )
     
+    @leitura_compartilhada
+    @operacao('point')
     def obter_playlist(self, id: str) -> Optional[Playlist]:
         """Obtém uma playlist por ID"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -157,6 +282,8 @@ class Repositorio:
             musicas_ids=[m.id for m in playlist_db.musicas]
         )
     
+    @leitura_compartilhada
+    @operacao('scan')
     def listar_playlists(self) -> List[Playlist]:
         """Lista todas as playlists"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -171,6 +298,8 @@ class Repositorio:
             for p in playlists_db
         ]
     
+    @leitura_compartilhada
+    @operacao('point')
     def listar_playlists_por_usuario(self, usuario_id: str) -> List[Playlist]:
         """Lista playlists de um usuário"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -185,6 +314,8 @@ class Repositorio:
             for p in playlists_db
         ]
     
+    @leitura_compartilhada
+    @operacao('point')
     def listar_musicas_por_playlist(self, playlist_id: str) -> List[Musica]:
         """Lista músicas de uma playlist"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -194,6 +325,8 @@ class Repositorio:
         
         return [Musica.model_validate(m) for m in playlist_db.musicas]
     
+    @leitura_compartilhada
+    @operacao('point')
     def listar_playlists_por_musica(self, musica_id: str) -> List[Playlist]:
         """Lista playlists que contêm uma música"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -211,6 +344,7 @@ class Repositorio:
             for p in musica_db.playlists
         ]
     
+    @operacao('write')
     def atualizar_playlist(self, id: str, dados: dict) -> Optional[Playlist]:
         """Atualiza uma playlist"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -228,8 +362,8 @@ class Repositorio:
         if 'nome' in dados:
             playlist_db.nome = dados['nome']
         
-        self.db.commit()
-        self.db.refresh(playlist_db)
+        self._registrar_mudancas('playlists', [playlist_db.id])
+        self._confirmar(playlist_db)
         
         return Playlist(
             id=playlist_db.id,
@@ -238,6 +372,7 @@ class Repositorio:
             musicas_ids=[m.id for m in playlist_db.musicas]
         )
     
+    @operacao('write')
     def adicionar_musica_a_playlist(self, playlist_id: str, musica_id: str) -> Optional[Playlist]:
         """Adiciona uma música a uma playlist"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -252,8 +387,8 @@ class Repositorio:
         # Evita duplicatas
         if musica_db not in playlist_db.musicas:
             playlist_db.musicas.append(musica_db)
-            self.db.commit()
-            self.db.refresh(playlist_db)
+            self._registrar_mudancas('playlists', [playlist_db.id])
+            self._confirmar(playlist_db)
         
         return Playlist(
             id=playlist_db.id,
@@ -262,6 +397,7 @@ class Repositorio:
             musicas_ids=[m.id for m in playlist_db.musicas]
         )
     
+    @operacao('write')
     def remover_musica_de_playlist(self, playlist_id: str, musica_id: str) -> Optional[Playlist]:
         """Remove uma música de uma playlist"""
         # Usa selectinload para muitos-para-muitos (evita produto cartesiano)
@@ -275,8 +411,8 @@ class Repositorio:
         
         if musica_db in playlist_db.musicas:
             playlist_db.musicas.remove(musica_db)
-            self.db.commit()
-            self.db.refresh(playlist_db)
+            self._registrar_mudancas('playlists', [playlist_db.id])
+            self._confirmar(playlist_db)
         
         return Playlist(
             id=playlist_db.id,
@@ -285,13 +421,427 @@ class Repositorio:
             musicas_ids=[m.id for m in playlist_db.musicas]
         )
     
+    @operacao('write')
     def remover_playlist(self, id: str) -> bool:
         """Remove uma playlist"""
         playlist_db = self.db.query(PlaylistDB).filter(PlaylistDB.id == id).first()
         if not playlist_db:
             return False
         
+        self._registrar_mudancas('playlists', [id], MUDANCA_REMOCAO)
         self.db.delete(playlist_db)
-        self.db.commit()
+        self._confirmar()
         return True
 
+    # ========== CRIAÇÃO EM LOTE ==========
+
+    def _linha_para_insercao(self, entidade: str, modelo) -> dict:
+        linha = {coluna: getattr(modelo, coluna) for coluna in COLUNAS[entidade]}
+        linha['id'] = linha['id'] or str(uuid.uuid4())
+        return linha
+
+    def _recusar_playlists_sem_referencias(self, pendentes: dict, musicas: dict, resultados: list):
+        """Recusa playlists cujo usuário ou músicas não existem (uma query por tabela)"""
+        usuarios_ids = list({linha['usuario_id'] for _, linha in pendentes.values()})
+        musicas_ids = list({m for ids in musicas.values() for m in ids})
+        usuarios_existentes = set()
+        for ids in _em_lotes(usuarios_ids):
+            usuarios_existentes.update(self.db.execute(select(UsuarioDB.id).where(UsuarioDB.id.in_(ids))).scalars())
+        musicas_existentes = set()
+        for ids in _em_lotes(musicas_ids):
+            musicas_existentes.update(self.db.execute(select(MusicaDB.id).where(MusicaDB.id.in_(ids))).scalars())
+
+        for id, (indice, linha) in list(pendentes.items()):
+            if linha['usuario_id'] not in usuarios_existentes:
+                resultados[indice] = (None, 'Usuário não encontrado')
+            elif any(m not in musicas_existentes for m in musicas[id]):
+                resultados[indice] = (None, 'Uma ou mais músicas não foram encontradas')
+            else:
+                continue
+            del pendentes[id]
+
+    @operacao('write')
+    def criar_em_lote(self, entidade: str, modelos: list) -> List[tuple]:
+        """
+        Cria vários registros com INSERTs multi-linha em uma transação. Retorna,
+        para cada modelo, (id, None) se ele foi criado ou (None, erro) se foi
+        recusado (id repetido ou já existente, referência inexistente); os
+        demais são criados normalmente.
+        """
+        resultados = [None] * len(modelos)
+        pendentes = {}
+        musicas = {}
+        for indice, modelo in enumerate(modelos):
+            linha = self._linha_para_insercao(entidade, modelo)
+            if linha['id'] in pendentes:
+                resultados[indice] = (None, f"id repetido no lote: {linha['id']}")
+                continue
+            pendentes[linha['id']] = (indice, linha)
+            if entidade == 'playlists':
+                musicas[linha['id']] = list(dict.fromkeys(modelo.musicas_ids or []))
+
+        if entidade == 'playlists' and pendentes:
+            self._recusar_playlists_sem_referencias(pendentes, musicas, resultados)
+
+        criados = set()
+        if pendentes:
+            tabela = TABELAS[entidade]
+            consulta = insert(tabela).on_conflict_do_nothing(index_elements=['id']).returning(tabela.c.id)
+            criados.update(self.db.execute(consulta, [linha for _, linha in pendentes.values()]).scalars())
+            associacoes = [
+                {'playlist_id': id, 'musica_id': musica_id}
+                for id in criados for musica_id in musicas.get(id, ())
+            ]
+            if associacoes:
+                self.db.execute(playlist_musica.insert(), associacoes)
+
+        for id, (indice, _) in pendentes.items():
+            resultados[indice] = (id, None) if id in criados else (None, f"id já existe: {id}")
+        self._registrar_mudancas(entidade, criados)
+        self._confirmar()
+        return resultados
+
+    # ========== LINHAS (SEM MODELOS) ==========
+    # Leituras que devolvem dicionários prontos para serialização, sem
+    # instanciar objetos do ORM nem modelos Pydantic. `campos` restringe as
+    # colunas do SELECT e `incluir` embute entidades relacionadas, carregadas
+    # em lote (uma query por relação, não uma por linha).
+
+    def _projecao(self, entidade: str, campos: Optional[tuple], incluir: tuple):
+        """Valida a projeção e retorna (campos da resposta, colunas do SELECT)"""
+        if entidade not in COLUNAS:
+            raise ValueError(f"Entidade desconhecida: {entidade}")
+        disponiveis = list(COLUNAS[entidade]) + list(CAMPOS_CALCULADOS.get(entidade, ()))
+        if campos is None:
+            campos = tuple(disponiveis)
+        elif not campos:
+            raise ValueError(f"Nenhum campo informado para {entidade}")
+        invalidos = [c for c in campos if c not in disponiveis]
+        if invalidos:
+            raise ValueError(f"Campos inválidos para {entidade}: {', '.join(invalidos)}")
+        invalidas = [r for r in incluir if r not in RELACOES.get(entidade, ())]
+        if invalidas:
+            raise ValueError(f"Relações inválidas para {entidade}: {', '.join(invalidas)}")
+
+        campos = tuple(dict.fromkeys(campos))
+        necessarias = [c for c in campos if c in COLUNAS[entidade]]
+        # Colunas usadas só para carregar os relacionamentos
+        if entidade == 'playlists' and ('musicas_ids' in campos or 'musicas' in incluir):
+            necessarias.append('id')
+        if 'usuario' in incluir:
+            necessarias.append('usuario_id')
+        if not necessarias:
+            necessarias.append('id')
+        return campos, tuple(dict.fromkeys(necessarias))
+
+    def _completar_linhas(self, entidade: str, linhas: List[dict], campos: tuple, incluir: tuple):
+        """Carrega campos calculados e relações de um lote e remove colunas auxiliares"""
+        if not linhas:
+            return linhas
+        if entidade == 'playlists':
+            if 'musicas_ids' in campos:
+                self._anexar_musicas_ids(linhas)
+            if 'musicas' in incluir:
+                self._anexar_musicas(linhas)
+            if 'usuario' in incluir:
+                self._anexar_usuarios(linhas)
+        chaves = campos + tuple(incluir)
+        if tuple(linhas[0]) != chaves:
+            linhas = [{chave: linha[chave] for chave in chaves} for linha in linhas]
+        return linhas
+
+    def _anexar_musicas_ids(self, playlists: List[dict]):
+        """Preenche musicas_ids de um lote de playlists"""
+        por_id = {}
+        for playlist in playlists:
+            playlist['musicas_ids'] = []
+            por_id[playlist['id']] = playlist
+        for ids in _em_lotes(list(por_id)):
+            for playlist_id, musica_id in self.db.execute(
+                select(playlist_musica.c.playlist_id, playlist_musica.c.musica_id)
+                .where(playlist_musica.c.playlist_id.in_(ids))
+            ):
+                por_id[playlist_id]['musicas_ids'].append(musica_id)
+
+    def _anexar_musicas(self, playlists: List[dict]):
+        """Embute as músicas de um lote de playlists"""
+        por_id = {}
+        for playlist in playlists:
+            playlist['musicas'] = []
+            por_id[playlist['id']] = playlist
+        colunas = COLUNAS['musicas']
+        for ids in _em_lotes(list(por_id)):
+            consulta = (
+                select(playlist_musica.c.playlist_id, *colunas.values())
+                .join(MusicaDB, MusicaDB.id == playlist_musica.c.musica_id)
+                .where(playlist_musica.c.playlist_id.in_(ids))
+            )
+            for playlist_id, *valores in self.db.execute(consulta):
+                por_id[playlist_id]['musicas'].append(dict(zip(colunas, valores)))
+
+    def _anexar_usuarios(self, playlists: List[dict]):
+        """Embute o usuário dono de cada playlist de um lote"""
+        colunas = COLUNAS['usuarios']
+        usuarios = {}
+        for ids in _em_lotes(list({p['usuario_id'] for p in playlists})):
+            for valores in self.db.execute(select(*colunas.values()).where(UsuarioDB.id.in_(ids))):
+                usuario = dict(zip(colunas, valores))
+                usuarios[usuario['id']] = usuario
+        for playlist in playlists:
+            playlist['usuario'] = usuarios.get(playlist['usuario_id'])
+
+    def _linhas(self, consulta, colunas: tuple) -> List[dict]:
+        return [dict(zip(colunas, valores)) for valores in self.db.execute(consulta)]
+
+    @leitura_compartilhada
+    @operacao('scan')
+    def listar_linhas(self, entidade: str, campos: Optional[tuple] = None, incluir: tuple = ()) -> List[dict]:
+        """Lista todos os registros de uma entidade como dicionários"""
+        campos, colunas = self._projecao(entidade, campos, incluir)
+        consulta = select(*(COLUNAS[entidade][c] for c in colunas))
+        return self._completar_linhas(entidade, self._linhas(consulta, colunas), campos, incluir)
+
+    @leitura_compartilhada
+    @operacao('point')
+    def obter_linha(self, entidade: str, id: str, campos: Optional[tuple] = None, incluir: tuple = ()) -> Optional[dict]:
+        """Obtém um registro por ID como dicionário"""
+        campos, colunas = self._projecao(entidade, campos, incluir)
+        consulta = select(*(COLUNAS[entidade][c] for c in colunas)).where(COLUNAS[entidade]['id'] == id)
+        linhas = self._completar_linhas(entidade, self._linhas(consulta, colunas), campos, incluir)
+        return linhas[0] if linhas else None
+
+    def iterar_linhas(self, entidade: str, campos: Optional[tuple] = None, incluir: tuple = (),
+                      lote: int = DB_STREAM_LOTE) -> Iterator[List[dict]]:
+        """
+        Gera os registros de uma entidade em lotes, lidos de um cursor no servidor.
+        Ocupa uma vaga de 'scan' até o gerador terminar ou ser fechado; use com
+        uma sessão própria (sessao_para('scan')), que não é compartilhada com
+        outras operações enquanto o stream estiver aberto.
+        """
+        campos, colunas = self._projecao(entidade, campos, incluir)
+        with vaga('scan'):
+            try:
+                with medir('repositorio'):
+                    particoes = self.db.execute(
+                        select(*(COLUNAS[entidade][c] for c in colunas)).execution_options(yield_per=lote)
+                    ).partitions()
+                while True:
+                    with medir('repositorio'):
+                        particao = next(particoes, None)
+                        if particao is None:
+                            break
+                        linhas = [dict(zip(colunas, valores)) for valores in particao]
+                        linhas = self._completar_linhas(entidade, linhas, campos, incluir)
+                    verificar_cancelamento()
+                    yield linhas
+            finally:
+                self.db.rollback()
+
+    @operacao('point')
+    def listar_linhas_por(self, entidade: str, coluna: str, valores: list, campos: Optional[tuple] = None) -> List[dict]:
+        """
+        Registros cuja `coluna` está em `valores` (ex.: playlists por usuario_id),
+        com uma query por lote de DB_LOTE_IN valores. Usado pelos DataLoaders.
+        """
+        campos, colunas = self._projecao(entidade, campos, ())
+        linhas = []
+        for lote in _em_lotes(list(dict.fromkeys(valores))):
+            consulta = select(*(COLUNAS[entidade][c] for c in colunas)).where(COLUNAS[entidade][coluna].in_(lote))
+            linhas.extend(self._linhas(consulta, colunas))
+        return self._completar_linhas(entidade, linhas, campos, ())
+
+    @operacao('point')
+    def listar_playlists_por_musicas(self, musicas_ids: list, campos: Optional[tuple] = None) -> List[tuple]:
+        """Pares (musica_id, playlist) das playlists que contêm cada uma das músicas"""
+        # O id identifica as playlists repetidas entre as músicas
+        campos, colunas = self._projecao('playlists', campos and tuple(dict.fromkeys(('id',) + campos)), ())
+        pares = []
+        playlists = {}
+        for lote in _em_lotes(list(dict.fromkeys(musicas_ids))):
+            consulta = (
+                select(playlist_musica.c.musica_id, *(COLUNAS['playlists'][c] for c in colunas))
+                .join(PlaylistDB, PlaylistDB.id == playlist_musica.c.playlist_id)
+                .where(playlist_musica.c.musica_id.in_(lote))
+            )
+            for musica_id, *valores in self.db.execute(consulta):
+                playlist = dict(zip(colunas, valores))
+                playlists.setdefault(playlist['id'], playlist)
+                pares.append((musica_id, playlist['id']))
+        completas = {p['id']: p for p in self._completar_linhas('playlists', list(playlists.values()), campos, ())}
+        return [(musica_id, completas[playlist_id]) for musica_id, playlist_id in pares]
+
+    @operacao('point')
+    def estimar_linhas(self) -> dict:
+        """
+        Número aproximado de linhas de cada tabela, pelas estatísticas do
+        Postgres (pg_class.reltuples); tabelas ainda não analisadas são contadas
+        """
+        tabelas = ['usuarios', 'musicas', 'playlists', playlist_musica.name]
+        estimativas = dict(self.db.execute(
+            text('SELECT relname, reltuples FROM pg_class WHERE relkind = \'r\' AND relname = ANY(:tabelas)'),
+            {'tabelas': tabelas}
+        ).all())
+        contagens = {}
+        for tabela in tabelas:
+            estimativa = estimativas.get(tabela, -1)
+            if estimativa is None or estimativa <= 0:
+                estimativa = self.db.execute(text(f'SELECT count(*) FROM {tabela}')).scalar()
+            contagens[tabela] = int(estimativa)
+        return contagens
+
+    # ========== LOG DE MUDANÇAS ==========
+
+    def _registrar_mudancas(self, entidade: str, ids, operacao: str = MUDANCA_GRAVACAO):
+        """Registra mudanças no log, na mesma transação da alteração"""
+        ids = list(dict.fromkeys(ids))
+        if ids:
+            _iniciar_poda_mudancas()
+            self.db.execute(
+                insert(MudancaDB.__table__),
+                [{'entidade': entidade, 'entidade_id': id, 'operacao': operacao} for id in ids]
+            )
+
+    def _anexar_dados_mudancas(self, mudancas: List[dict]):
+        """Embute o estado atual das entidades gravadas (uma query por entidade)"""
+        por_entidade = {}
+        for mudanca in mudancas:
+            mudanca['dados'] = None
+            if mudanca['operacao'] == MUDANCA_GRAVACAO:
+                por_entidade.setdefault(mudanca['entidade'], {})[mudanca['id']] = mudanca
+        for entidade, por_id in por_entidade.items():
+            campos, colunas = self._projecao(entidade, None, ())
+            for ids in _em_lotes(list(por_id)):
+                consulta = select(*(COLUNAS[entidade][c] for c in colunas)).where(COLUNAS[entidade]['id'].in_(ids))
+                for linha in self._completar_linhas(entidade, self._linhas(consulta, colunas), campos, ()):
+                    por_id[linha['id']]['dados'] = linha
+
+    @leitura_compartilhada
+    @operacao('point')
+    def listar_mudancas(self, desde: Optional[tuple] = TOKEN_INICIAL, limite: int = 1000,
+                        com_dados: bool = True) -> dict:
+        """
+        Lista as mudanças posteriores ao token `desde` (txid, versao), na ordem
+        em que foram confirmadas. Só entram mudanças de transações anteriores ao
+        xmin do snapshot atual: todas essas já terminaram, então nenhuma mudança
+        com posição menor pode aparecer depois e ser perdida pelo cliente.
+        Várias mudanças da mesma entidade na página viram uma só (a última).
+        `limite` deve estar entre 1 e DB_MUDANCAS_LIMITE_MAXIMO (ValueError).
+
+        Com `desde` None, devolve só o token da posição atual, sem mudanças. O
+        log só tem o que foi alterado depois da sua criação e perde as mudanças
+        além da retenção: um cliente novo (ou com TokenExpirado) pega o token
+        atual, baixa as listagens completas e sincroniza a partir desse token.
+        """
+        if not 1 <= limite <= DB_MUDANCAS_LIMITE_MAXIMO:
+            raise ValueError(f"limite deve estar entre 1 e {DB_MUDANCAS_LIMITE_MAXIMO}")
+        poda = PodaMudancasDB.__table__
+        xmin, poda_txid, poda_versao = self.db.execute(
+            select(
+                text('txid_snapshot_xmin(txid_current_snapshot())'),
+                select(poda.c.txid).scalar_subquery(),
+                select(poda.c.versao).scalar_subquery(),
+            )
+        ).one()
+        if desde is None:
+            return {'mudancas': [], 'token': (xmin, 0), 'mais': False}
+        if poda_txid is not None and desde < (poda_txid, poda_versao):
+            raise TokenExpirado("Token anterior à retenção do log de mudanças; ressincronize")
+        tabela = MudancaDB.__table__
+        linhas = self.db.execute(
+            select(tabela.c.txid, tabela.c.versao, tabela.c.entidade, tabela.c.entidade_id, tabela.c.operacao)
+            .where(tuple_(tabela.c.txid, tabela.c.versao) > tuple_(literal(desde[0]), literal(desde[1])))
+            .where(tabela.c.txid < xmin)
+            .order_by(tabela.c.txid, tabela.c.versao)
+            .limit(limite)
+        ).all()
+
+        mais = len(linhas) == limite
+        if mais:
+            token = (linhas[-1].txid, linhas[-1].versao)
+        else:
+            # Tudo antes do xmin já foi entregue; a próxima leitura começa nele
+            token = max(desde, (xmin, 0))
+
+        ultimas = {}
+        for linha in linhas:
+            chave = (linha.entidade, linha.entidade_id)
+            ultimas.pop(chave, None)
+            ultimas[chave] = {
+                'versao': linha.versao,
+                'entidade': linha.entidade,
+                'id': linha.entidade_id,
+                'operacao': linha.operacao,
+            }
+        mudancas = list(ultimas.values())
+        if com_dados:
+            self._anexar_dados_mudancas(mudancas)
+        return {'mudancas': mudancas, 'token': token, 'mais': mais}
+
+    @operacao('write')
+    def podar_mudancas(self, retencao: int = DB_MUDANCAS_RETENCAO) -> int:
+        """
+        Apaga do log as mudanças além das `retencao` mais recentes e avança a
+        posição da poda; tokens anteriores a ela passam a dar TokenExpirado.
+        Retorna quantas mudanças foram apagadas.
+        """
+        if not self.db.execute(text('SELECT pg_try_advisory_xact_lock(:chave)'), {'chave': _LOCK_PODA_MUDANCAS}).scalar():
+            # Outro processo já está podando
+            self.db.rollback()
+            return 0
+        xmin = self.db.execute(text('SELECT txid_snapshot_xmin(txid_current_snapshot())')).scalar()
+        tabela = MudancaDB.__table__
+        corte = self.db.execute(
+            select(tabela.c.txid, tabela.c.versao)
+            .where(tabela.c.txid < xmin)
+            .order_by(tabela.c.txid.desc(), tabela.c.versao.desc())
+            .offset(retencao)
+            .limit(1)
+        ).first()
+        if corte is None:
+            self.db.rollback()
+            return 0
+        posicao = tuple_(literal(corte.txid), literal(corte.versao))
+        apagadas = self.db.execute(
+            tabela.delete().where(tuple_(tabela.c.txid, tabela.c.versao) <= posicao)
+        ).rowcount
+        poda = PodaMudancasDB.__table__
+        comando = insert(poda).values(id=1, txid=corte.txid, versao=corte.versao)
+        self.db.execute(comando.on_conflict_do_update(
+            index_elements=[poda.c.id],
+            set_={'txid': comando.excluded.txid, 'versao': comando.excluded.versao},
+            where=tuple_(poda.c.txid, poda.c.versao) < tuple_(comando.excluded.txid, comando.excluded.versao),
+        ))
+        self.db.commit()
+        leituras_compartilhadas.invalidar()
+        return apagadas
+
+
+# ========== RETENÇÃO DO LOG DE MUDANÇAS ==========
+
+_poda_mudancas = None
+_lock_poda_mudancas = threading.Lock()
+
+
+def _iniciar_poda_mudancas():
+    """Inicia (uma vez por processo) a thread que poda o log de mudanças"""
+    global _poda_mudancas
+    if DB_MUDANCAS_RETENCAO <= 0 or _poda_mudancas == os.getpid():
+        return
+    with _lock_poda_mudancas:
+        if _poda_mudancas != os.getpid():
+            # Guarda o pid: os workers do pre-fork não herdam a thread do pai
+            _poda_mudancas = os.getpid()
+            threading.Thread(target=_executar_poda_mudancas, name='poda-mudancas', daemon=True).start()
+
+
+def _executar_poda_mudancas():
+    while True:
+        time.sleep(DB_MUDANCAS_PODA_INTERVALO)
+        db = SessionLocal()
+        try:
+            Repositorio(db).podar_mudancas()
+        except Exception:
+            # Tenta de novo no próximo intervalo
+            pass
+        finally:
+            db.close()
@@ -0,0 +1,105 @@
+"""
+Single-flight para leituras do Repositorio
+
+Chamadas idênticas e simultâneas (mesmo método, mesmos argumentos) esperam uma
+única execução da query e compartilham o resultado. Toda escrita confirmada
+inicia uma nova geração, para que leituras que começaram antes dela não sejam
+entregues a quem chegou depois.
+"""
+import functools
+import threading
+
+from shared.cancelamento import OperacaoCancelada, token_atual
+
+
+class _Voo:
+    """Uma execução em andamento, aguardada pelos seguidores"""
+
+    def __init__(self):
+        self.pronto = threading.Event()
+        self.resultado = None
+        self.erro = None
+
+
+class SingleFlight:
+    """Coalesce execuções idênticas e simultâneas de uma função"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._voos = {}
+        self._geracao = 0
+        self.chamadas = 0
+        self.execucoes = 0
+        self.compartilhadas = 0
+
+    def invalidar(self):
+        """Faz com que as próximas chamadas não aproveitem execuções já iniciadas"""
+        with self._lock:
+            self._geracao += 1
+
+    def executar(self, chave, funcao):
+        with self._lock:
+            self.chamadas += 1
+        while True:
+            with self._lock:
+                chave_voo = (self._geracao, chave)
+                voo = self._voos.get(chave_voo)
+                lider = voo is None
+                if lider:
+                    voo = self._voos[chave_voo] = _Voo()
+                    self.execucoes += 1
+
+            if lider:
+                try:
+                    voo.resultado = funcao()
+                    return voo.resultado
+                except BaseException as exc:
+                    voo.erro = exc
+                    raise
+                finally:
+                    with self._lock:
+                        self._voos.pop(chave_voo, None)
+                    voo.pronto.set()
+
+            self._aguardar(voo)
+            if voo.erro is None:
+                with self._lock:
+                    self.compartilhadas += 1
+                return voo.resultado
+            if not isinstance(voo.erro, OperacaoCancelada):
+                raise voo.erro
+            # O líder foi cancelado pelo cliente dele; outro seguidor assume a execução
+
+    @staticmethod
+    def _aguardar(voo: _Voo):
+        token = token_atual.get()
+        restante = token.tempo_restante() if token is not None else None
+        if not voo.pronto.wait(restante) and token is not None:
+            token.verificar()
+        voo.pronto.wait()
+
+    def metricas(self) -> dict:
+        with self._lock:
+            return {
+                'chamadas': self.chamadas,
+                'consultas_executadas': self.execucoes,
+                'consultas_economizadas': self.compartilhadas,
+                'em_andamento': len(self._voos),
+            }
+
+
+leituras_compartilhadas = SingleFlight()
+
+
+def leitura_compartilhada(metodo):
+    """Decorator para leituras do Repositorio: chamadas idênticas simultâneas compartilham a query"""
+    @functools.wraps(metodo)
+    def wrapper(self, *args, **kwargs):
+        if self.adiar_commit:
+            # Leituras dentro de uma transação precisam ver as escritas dela e o
+            # snapshot dela: o voo é identificado pela geração do momento da
+            # chamada, que pode ser posterior ao início da transação
+            return metodo(self, *args, **kwargs)
+        chave = (metodo.__name__, args, tuple(sorted(kwargs.items())))
+        return leituras_compartilhadas.executar(chave, lambda: metodo(self, *args, **kwargs))
+    return wrapper
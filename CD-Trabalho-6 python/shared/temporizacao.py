@@ -0,0 +1,104 @@
+"""
+Medição das fases de uma requisição (fila, pool, SQL, ORM, serialização)
+
+Cada requisição pode ter uma MedicaoRequisicao no contexto atual. Os eventos do
+SQLAlchemy registrados aqui (em nível de classe, valendo para todas as engines)
+acumulam nela o tempo de espera por conexão, o tempo de SQL e a contagem de
+statements e linhas; as demais fases são medidas por quem as executa.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+# Ordem em que as fases aparecem no Server-Timing
+FASES = ('fila', 'pool', 'sql', 'orm', 'validacao', 'json', 'compressao')
+
+
+class MedicaoRequisicao:
+    """Tempos acumulados (em segundos) e contadores de uma requisição"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tempos = dict.fromkeys(FASES + ('repositorio',), 0.0)
+        self.statements = 0
+        self.linhas = 0
+        # Instante em que a sessão pediu uma conexão (para medir a espera no pool)
+        self.pedido_conexao: Optional[float] = None
+        # Instante em que o handler retornou (para medir a validação da resposta)
+        self.fim_handler: Optional[float] = None
+
+    def adicionar(self, fase: str, duracao: float):
+        with self._lock:
+            self.tempos[fase] += duracao
+
+    def contar_statement(self, duracao: float, linhas: int):
+        with self._lock:
+            self.tempos['sql'] += duracao
+            self.statements += 1
+            if linhas > 0:
+                self.linhas += linhas
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            tempos = dict(self.tempos)
+            statements, linhas = self.statements, self.linhas
+        # Hidratação: tempo dentro do repositório que não foi espera nem SQL
+        tempos['orm'] = max(0.0, tempos.pop('repositorio') - tempos['sql'] - tempos['pool'])
+        return {
+            'fases_ms': {fase: round(tempos[fase] * 1000, 3) for fase in FASES},
+            'statements': statements,
+            'linhas': linhas,
+        }
+
+
+medicao_atual: ContextVar[Optional[MedicaoRequisicao]] = ContextVar('medicao_requisicao', default=None)
+
+
+@contextmanager
+def medir(fase: str):
+    """Soma a duração do bloco à fase da medição atual (se houver)"""
+    medicao = medicao_atual.get()
+    if medicao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao.adicionar(fase, time.perf_counter() - inicio)
+
+
+def marcar_pedido_conexao():
+    """Chamada pela sessão antes de obter uma conexão"""
+    medicao = medicao_atual.get()
+    if medicao is not None:
+        medicao.pedido_conexao = time.perf_counter()
+
+
+@event.listens_for(Pool, 'checkout')
+def _medir_espera_pool(dbapi_connection, connection_record, connection_proxy):
+    medicao = medicao_atual.get()
+    if medicao is not None and medicao.pedido_conexao is not None:
+        medicao.adicionar('pool', time.perf_counter() - medicao.pedido_conexao)
+        medicao.pedido_conexao = None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _inicio_statement(conn, cursor, statement, parameters, context, executemany):
+    if medicao_atual.get() is not None:
+        conn.info.setdefault('inicio_statement', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _fim_statement(conn, cursor, statement, parameters, context, executemany):
+    medicao = medicao_atual.get()
+    inicios = conn.info.get('inicio_statement')
+    if medicao is None or not inicios:
+        return
+    medicao.contar_statement(time.perf_counter() - inicios.pop(), cursor.rowcount)
@@ -1,12 +1,17 @@
 """
 Serviço SOAP implementado com Flask e processamento XML manual
 """
-from flask import Flask, request, Response, jsonify
+from flask import Flask, request, Response, jsonify, g
+from werkzeug.local import LocalProxy
 from flask_cors import CORS
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
+import math
+import select
+import socket
 import sys
 import os
+import threading
 
 # Adiciona o diretório raiz ao path
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
@@ -14,6 +19,12 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 from shared.database import get_db, init_db, SessionLocal
 from shared.repository import Repositorio
 from shared.models import Usuario, Musica, Playlist
+from shared.bulkhead import metricas_bulkheads
+from shared.group_commit import coalescedor_escrita
+from shared.singleflight import leituras_compartilhadas
+from shared.cancelamento import (
+    TokenCancelamento, token_atual, verificar_cancelamento, MOTIVO_DESCONEXAO, MOTIVO_PRAZO
+)
 import uuid
 
 # Inicializa o banco de dados
@@ -26,9 +37,189 @@ CORS(app)
 SOAP_NS = "http://schemas.xmlsoap.org/soap/envelope/"
 TNS_NS = "http://streaming-musicas.com/soap"
 
-# Instância do repositório
-db = SessionLocal()
-repo = Repositorio(db)
+
+def obter_repo():
+    """Retorna o repositório da requisição atual (uma sessão por requisição)"""
+    if 'repo' not in g:
+        g.db = SessionLocal()
+        g.repo = Repositorio(g.db)
+    return g.repo
+
+
+@app.teardown_appcontext
+def fechar_sessao(exc):
+    """Fecha a sessão da requisição, devolvendo as conexões aos sub-pools"""
+    db = g.pop('db', None)
+    g.pop('repo', None)
+    if db is not None:
+        db.close()
+
+
+# Instância do repositório (uma sessão por requisição, já que o Flask atende em várias threads)
+repo = LocalProxy(obter_repo)
+
+
+# Prazo padrão das requisições; o cliente pode pedir um menor em X-Timeout-Ms
+SOAP_PRAZO_REQUISICAO = float(os.getenv('SOAP_PRAZO_REQUISICAO_MS', '30000')) / 1000
+
+
+class VigiaDesconexao:
+    """
+    Uma única thread vigia as conexões de todas as requisições em andamento com
+    um único poll: cancela o token quando o cliente fecha a conexão ou o prazo
+    expira. As requisições se registram no before_request e saem no teardown.
+    """
+
+    # Intervalo para reexaminar conexões com dados ainda não lidos (corpo da
+    # requisição ou pipelining), que o poll acusaria como legíveis sem parar
+    INTERVALO_PENDENTES = 0.05
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._thread = None
+        self._despertar_r, self._despertar_w = socket.socketpair()
+        self._despertar_r.setblocking(False)
+        self._despertar_w.setblocking(False)
+
+    def registrar(self, sock, token):
+        with self._lock:
+            self._tokens[sock] = token
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='vigia-desconexao', daemon=True)
+                self._thread.start()
+        self._despertar()
+
+    def remover(self, sock):
+        with self._lock:
+            removido = self._tokens.pop(sock, None)
+        if removido is not None:
+            self._despertar()
+
+    def _despertar(self):
+        try:
+            self._despertar_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            # Buffer cheio: a thread já tem um aviso pendente
+            pass
+
+    def _cancelar(self, sock, motivo):
+        # Só cancela se a requisição ainda estiver registrada: o socket pode ter
+        # saído (e até sido fechado) depois da cópia feita para o select
+        with self._lock:
+            token = self._tokens.pop(sock, None)
+        if token is not None:
+            token.cancelar(motivo)
+
+    @staticmethod
+    def _verificar(sock):
+        """True se o cliente fechou a conexão, False se há dados, None se nada mudou"""
+        try:
+            fd = sock.fileno()
+            if fd < 0:
+                return True
+            poll = select.poll()
+            poll.register(fd, select.POLLIN)
+            eventos = poll.poll(0)
+            if not eventos:
+                return None
+            if eventos[0][1] & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                return True
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+
+    def _executar(self):
+        # poll em vez de select: não há limite de FD_SETSIZE para os descritores
+        poll = select.poll()
+        poll.register(self._despertar_r, select.POLLIN)
+        vigiados = {}
+        pendentes = set()
+        while True:
+            with self._lock:
+                tokens = dict(self._tokens)
+            pendentes &= tokens.keys()
+
+            # Sincroniza o poll com as requisições registradas; quem saiu é
+            # removido antes de novos registros, pois o descritor pode ter sido reaproveitado
+            for sock, fd in list(vigiados.items()):
+                if sock not in tokens or sock in pendentes:
+                    poll.unregister(fd)
+                    del vigiados[sock]
+
+            espera = None
+            for sock, token in tokens.items():
+                if token.expirado:
+                    self._cancelar(sock, MOTIVO_PRAZO)
+                    continue
+                restante = token.tempo_restante()
+                if restante is not None:
+                    espera = restante if espera is None else min(espera, restante)
+                if sock in vigiados or sock in pendentes:
+                    continue
+                try:
+                    fd = sock.fileno()
+                    if fd < 0:
+                        raise ValueError(fd)
+                    poll.register(fd, select.POLLIN)
+                except (OSError, ValueError):
+                    self._cancelar(sock, MOTIVO_DESCONEXAO)
+                    continue
+                vigiados[sock] = fd
+            if pendentes:
+                espera = self.INTERVALO_PENDENTES if espera is None else min(espera, self.INTERVALO_PENDENTES)
+
+            eventos = poll.poll(None if espera is None else math.ceil(espera * 1000))
+            por_fd = {fd: sock for sock, fd in vigiados.items()}
+            legiveis = []
+            for fd, evento in eventos:
+                if fd == self._despertar_r.fileno():
+                    try:
+                        while self._despertar_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                elif fd in por_fd:
+                    legiveis.append(por_fd[fd])
+
+            for sock in [*legiveis, *pendentes]:
+                fechado = self._verificar(sock)
+                if fechado:
+                    self._cancelar(sock, MOTIVO_DESCONEXAO)
+                    pendentes.discard(sock)
+                elif fechado is False:
+                    pendentes.add(sock)
+                else:
+                    pendentes.discard(sock)
+
+
+vigia_desconexao = VigiaDesconexao()
+
+
+@app.before_request
+def iniciar_cancelamento():
+    """Cria o token de cancelamento da requisição e começa a vigiar a conexão do cliente"""
+    prazo = SOAP_PRAZO_REQUISICAO
+    try:
+        prazo = min(prazo, float(request.headers.get('X-Timeout-Ms', 'inf')) / 1000)
+    except ValueError:
+        pass
+    token = TokenCancelamento(prazo)
+    g.reset_cancelamento = token_atual.set(token)
+    sock = request.environ.get('werkzeug.socket')
+    if sock is not None:
+        g.socket_vigiado = sock
+        vigia_desconexao.registrar(sock, token)
+
+
+@app.teardown_request
+def encerrar_cancelamento(exc):
+    sock = g.pop('socket_vigiado', None)
+    if sock is not None:
+        vigia_desconexao.remover(sock)
+    anterior = g.pop('reset_cancelamento', None)
+    if anterior is not None:
+        token_atual.reset(anterior)
 
 
 def criar_resposta_soap(body_content):
@@ -99,6 +290,8 @@ def soap_endpoint():
         # Chama a função correspondente
         if nome_operacao in handlers:
             resposta = handlers[nome_operacao](operacao)
+            # A formatação é a parte mais cara da resposta; não vale a pena se o cliente já desistiu
+            verificar_cancelamento()
             return Response(xml_para_string(resposta), mimetype='text/xml')
         else:
             return Response(xml_para_string(criar_resposta_erro(f"Operação {nome_operacao} não encontrada")), 
@@ -654,6 +847,16 @@ def get_listar_playlists():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/metricas', methods=['GET'])
+def metricas():
+    """Métricas dos bulkheads, do single-flight e do group commit"""
+    return jsonify({
+        "bulkheads": metricas_bulkheads(),
+        "single_flight": leituras_compartilhadas.metricas(),
+        "group_commit": coalescedor_escrita.metricas(),
+    })
+
+
 if __name__ == '__main__':
     PORT = 3002
     print(f"Serviço SOAP rodando na porta {PORT}")
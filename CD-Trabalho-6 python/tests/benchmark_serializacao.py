@@ -0,0 +1,117 @@
+"""
+Benchmark da serialização das listagens REST
+Compara o caminho padrão do FastAPI (modelos Pydantic revalidados pelo
+response_model + jsonable_encoder + json.dumps) com o caminho rápido
+(linhas do banco como dicts codificadas direto com orjson) e com os formatos
+binários negociáveis pelo Accept (MessagePack e protobuf)
+
+Uso: python tests/benchmark_serializacao.py [quantidade]
+"""
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+
+from shared.models import Musica
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Mensagens geradas por grpc/generate_proto.py (as mesmas usadas pelo REST)
+ARQUIVO_PROTO = os.path.join(os.path.dirname(SCRIPT_DIR), 'grpc', 'proto', 'grpc_proto.py')
+if os.path.exists(ARQUIVO_PROTO):
+    _spec = importlib.util.spec_from_file_location('streaming_pb2', ARQUIVO_PROTO)
+    streaming_pb2 = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(streaming_pb2)
+else:
+    streaming_pb2 = None
+
+REPETICOES = 7
+
+
+def gerar_linhas(quantidade):
+    """Gera linhas no formato devolvido por Repositorio.listar_linhas('musicas')"""
+    return [
+        {'id': str(uuid.uuid4()), 'nome': f'Música {i}', 'artista': f'Artista {i % 100}'}
+        for i in range(quantidade)
+    ]
+
+
+def caminho_padrao(linhas):
+    """Repositório devolve modelos; FastAPI valida contra List[Musica] e codifica"""
+    modelos = [Musica(**linha) for linha in linhas]
+    validados = TypeAdapter(List[Musica]).validate_python(modelos, from_attributes=True)
+    conteudo = jsonable_encoder(validados)
+    return json.dumps(conteudo, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def caminho_rapido(linhas):
+    """Repositório devolve dicts; o corpo é codificado uma única vez"""
+    if orjson is not None:
+        return orjson.dumps(linhas)
+    return json.dumps(linhas, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def caminho_msgpack(linhas):
+    """Accept: application/msgpack"""
+    return msgpack.packb(linhas)
+
+
+def caminho_protobuf(linhas):
+    """Accept: application/x-protobuf (ListarMusicasResponse)"""
+    return streaming_pb2.ListarMusicasResponse(
+        musicas=[streaming_pb2.Musica(**linha) for linha in linhas]
+    ).SerializeToString()
+
+
+def medir(funcao, linhas):
+    tempos = []
+    for _ in range(REPETICOES):
+        inicio = time.perf_counter()
+        corpo = funcao(linhas)
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos) * 1000, len(corpo)
+
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    linhas = gerar_linhas(quantidade)
+
+    assert json.loads(caminho_padrao(linhas)) == json.loads(caminho_rapido(linhas))
+
+    padrao_ms, padrao_bytes = medir(caminho_padrao, linhas)
+    rapido_ms, rapido_bytes = medir(caminho_rapido, linhas)
+
+    print(f"Serialização de {quantidade} músicas (mediana de {REPETICOES} execuções)")
+    print(f"  padrão (Pydantic + response_model): {padrao_ms:8.2f} ms  {padrao_bytes} bytes")
+    print(f"  rápido ({'orjson' if orjson else 'json'} sobre linhas):      {rapido_ms:8.2f} ms  {rapido_bytes} bytes")
+    print(f"  speedup: {padrao_ms / rapido_ms:.1f}x")
+
+    if msgpack is not None:
+        assert msgpack.unpackb(caminho_msgpack(linhas)) == linhas
+        tempo_ms, tamanho = medir(caminho_msgpack, linhas)
+        print(f"  msgpack:                            {tempo_ms:8.2f} ms  {tamanho} bytes")
+    if streaming_pb2 is not None:
+        tempo_ms, tamanho = medir(caminho_protobuf, linhas)
+        print(f"  protobuf:                           {tempo_ms:8.2f} ms  {tamanho} bytes")
+
+
+if __name__ == "__main__":
+    main()